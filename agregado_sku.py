@@ -0,0 +1,96 @@
+import pandas as pd
+
+from totais_contagem import calcular_totais, numeros, COLUNA_TOTAL_CAIXAS, COLUNA_TOTAL_UNIDADES
+
+
+def _quantidades(valores):
+    """Pallets/caixas somáveis: valores fora do comum (ex.: "2", None) passam por `numeros`."""
+    if set(map(type, valores)) <= {int}:
+        return valores
+    return [int(valor) if valor.is_integer() else valor for valor in numeros(valores).tolist()]
+
+
+class AgregadoSKU:
+    """Somatórios por SKU x Barracão e por SKU, atualizados a cada registro.
+
+    Cada registro anexado custa O(1); montar a visão custa O(chaves distintas),
+    nunca O(registros). Os totais em caixas/unidades são lineares em pallets e
+    caixas soltas, por isso podem ser calculados sobre as somas.
+    """
+
+    def __init__(self):
+        self.por_local = {}
+        self.por_sku = {}
+        self.descricoes = {}
+        self.barracoes = set()
+
+    @staticmethod
+    def _somar(destino, chave, pallets, caixas):
+        acumulado = destino.get(chave)
+        if acumulado is None:
+            destino[chave] = [1, pallets, caixas]
+        else:
+            acumulado[0] += 1
+            acumulado[1] += pallets
+            acumulado[2] += caixas
+
+    def anexar(self, registro):
+        self.anexar_colunas({coluna: [registro.get(coluna)] for coluna in ('SKU', 'Descrição', 'Barracão', 'Pallets', 'Caixas Soltas')})
+
+    def anexar_colunas(self, colunas):
+        """Anexa registros dados como colunas (SKU, Descrição, Barracão, Pallets, Caixas Soltas)."""
+        for sku, descricao, barracao, pallets, caixas in zip(
+            colunas['SKU'], colunas['Descrição'], colunas['Barracão'],
+            _quantidades(colunas['Pallets']), _quantidades(colunas['Caixas Soltas']),
+        ):
+            sku = str(sku)
+            self._somar(self.por_local, (sku, barracao), pallets, caixas)
+            self._somar(self.por_sku, sku, pallets, caixas)
+            self.descricoes.setdefault(sku, descricao)
+            self.barracoes.add(barracao)
+
+    def _dataframe(self, chaves, somas, fatores):
+        colunas = {
+            'Registros': [s[0] for s in somas],
+            'Pallets': [s[1] for s in somas],
+            'Caixas Soltas': [s[2] for s in somas],
+        }
+        total_caixas, total_unidades = calcular_totais(
+            [chave[0] if isinstance(chave, tuple) else chave for chave in chaves],
+            colunas['Pallets'], colunas['Caixas Soltas'], fatores,
+        )
+        colunas[COLUNA_TOTAL_CAIXAS] = pd.array(total_caixas.round(), dtype='Int64')
+        colunas[COLUNA_TOTAL_UNIDADES] = pd.array(total_unidades.round(), dtype='Int64')
+        return colunas
+
+    def por_sku_barracao(self, fatores):
+        """Uma linha por SKU x Barracão."""
+        chaves = list(self.por_local)
+        colunas = {
+            'SKU': [sku for sku, _ in chaves],
+            'Descrição': [self.descricoes.get(sku) for sku, _ in chaves],
+            'Barracão': [barracao for _, barracao in chaves],
+        }
+        colunas.update(self._dataframe(chaves, [self.por_local[c] for c in chaves], fatores))
+        return pd.DataFrame(colunas).sort_values(['SKU', 'Barracão'], ignore_index=True)
+
+    def resumo(self, fatores):
+        """Uma linha por SKU: caixas por barracão e o total geral do SKU."""
+        skus = list(self.por_sku)
+        colunas = {
+            'SKU': skus,
+            'Descrição': [self.descricoes.get(sku) for sku in skus],
+        }
+        por_local = self.por_sku_barracao(fatores)
+        posicao = {sku: i for i, sku in enumerate(skus)}
+        caixas_por_barracao = {
+            barracao: [pd.NA] * len(skus)
+            for barracao in sorted(b for b in self.barracoes if b is not None)
+        }
+        for sku, barracao, caixas in zip(por_local['SKU'], por_local['Barracão'], por_local[COLUNA_TOTAL_CAIXAS]):
+            if barracao in caixas_por_barracao:
+                caixas_por_barracao[barracao][posicao[sku]] = caixas
+        for barracao, valores in caixas_por_barracao.items():
+            colunas[f"Caixas {barracao}"] = pd.array(valores, dtype='Int64')
+        colunas.update(self._dataframe(skus, [self.por_sku[sku] for sku in skus], fatores))
+        return pd.DataFrame(colunas).sort_values('SKU', ignore_index=True)
@@ -0,0 +1,328 @@
+"""Benchmarks do caminho de contagem, sem interface.
+
+Com catálogos e fichas sintéticos, mede as etapas que o app executa a cada
+rerun ou envio de contagem:
+
+- catálogo: leitura do CSV (fria e pelo cache binário) e montagem do índice;
+- seleção de item: opções por marca/tipo, busca por texto e item escolhido;
+- gravação: anexar registros (journal JSON e SQLite) e a fila em lote;
+- registros: carga e sincronização da tabela, página com totais, resumos,
+  exportação CSV/XLSX e comparação de fichas;
+- app (opcional, --apptest): reruns do main.py pelo AppTest do Streamlit.
+
+Para cada etapa mostra p50/p95/p99/máx da latência e o pico de memória
+alocada (tracemalloc, em uma execução à parte). Com --saida grava os
+resultados em JSON; com --base compara com uma execução anterior e termina
+com erro se alguma etapa ficou mais lenta que a tolerância.
+
+Uso:
+    python bench/bench_contagem.py
+    python bench/bench_contagem.py --skus 1000,10000,100000 --registros 1000,100000,500000
+    python bench/bench_contagem.py --saida bench_base.json
+    python bench/bench_contagem.py --base bench_base.json --tolerancia 0.3
+    python bench/bench_contagem.py --apptest
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import exportacao
+import fichas_storage
+import catalogo_produtos
+from fila_gravacao import FilaGravacao
+from registros_tabela import TabelaRegistros
+from comparacao_fichas import comparar_fichas
+from totais_contagem import adicionar_totais, resumo_totais
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PALAVRAS = [
+    "LEITE", "INTEGRAL", "DESNATADO", "CREME", "QUEIJO", "MUSSARELA", "PRATO", "MANTEIGA",
+    "IOGURTE", "NATURAL", "MORANGO", "BEB", "LACTEA", "ACHOCOLATADO", "REQUEIJAO", "ZERO",
+    "LACTOSE", "TRADICIONAL", "COPO", "GARRAFA", "CAIXA", "SACHE", "POTE", "FATIADO",
+]
+TAMANHOS = ["200 ML", "1000 ML", "500 G", "1 KG", "150 G", "5 KG"]
+BARRACOES = ["A", "B", "C", "D", "E"]
+
+
+def gerar_catalogo(quantidade, semente=42):
+    aleatorio = random.Random(semente)
+    marcas = [f"MARCA {i:02}" for i in range(20)]
+    tipos = ["MIX", "LIQUIDO", "CREMOSO", "SOLIDO", "FERMENTADO", "EM PO", "FATIADO", "PASTOSO"]
+    linhas = []
+    for i in range(quantidade):
+        marca = aleatorio.choice(marcas)
+        descricao = " ".join(aleatorio.sample(PALAVRAS, 3) + [marca, aleatorio.choice(TAMANHOS)])
+        linhas.append({
+            "codigo_amarracao_imagem": str(100000000 + i),
+            "codigo": f"{100000000 + i}-109",
+            "descricao": descricao,
+            "familia_comercial": f"Familia {i % 40}",
+            "familia_material": f"Material {i % 120}",
+            "qtd_por_caixa": aleatorio.choice([6, 8, 12, 24, 27]),
+            "qtd_por_pallet": aleatorio.choice([60, 85, 100, 170, 240]),
+            "qtd_por_camada": aleatorio.choice([10, 17, 20]),
+            "marca": marca,
+            "tipo": aleatorio.choice(tipos),
+        })
+    return pd.DataFrame(linhas)
+
+
+def gerar_registros(quantidade, catalogo, semente=7):
+    aleatorio = random.Random(semente)
+    codigos = catalogo["codigo"].tolist()
+    descricoes = catalogo["descricao"].tolist()
+    registros = []
+    for i in range(quantidade):
+        pos = aleatorio.randrange(len(codigos))
+        rua = aleatorio.randint(1, 30)
+        registros.append({
+            "Hora": f"{(i // 3600) % 24:02}:{(i // 60) % 60:02}:{i % 60:02}",
+            "SKU": codigos[pos],
+            "Descrição": descricoes[pos],
+            "Barracão": aleatorio.choice(BARRACOES),
+            "Rua Inicial": f"{rua:02}",
+            "Rua Final": f"{min(30, rua + aleatorio.randint(0, 2)):02}",
+            "Pallets": aleatorio.randint(1, 12),
+            "Caixas Soltas": aleatorio.randint(0, 40),
+        })
+    return registros
+
+
+def _percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+class Medidor:
+    """Executa e registra as etapas medidas."""
+
+    def __init__(self, memoria=True):
+        self.memoria = memoria
+        self.resultados = []
+
+    def medir(self, etapa, tamanho, funcao, repeticoes=5, preparar=None):
+        duracoes = []
+        resultado = None
+        for _ in range(repeticoes):
+            argumento = preparar() if preparar else None
+            inicio = time.perf_counter()
+            resultado = funcao(argumento) if preparar else funcao()
+            duracoes.append(time.perf_counter() - inicio)
+
+        pico = None
+        if self.memoria:
+            argumento = preparar() if preparar else None
+            tracemalloc.start()
+            funcao(argumento) if preparar else funcao()
+            pico = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+
+        linha = {
+            "etapa": etapa,
+            "tamanho": tamanho,
+            "n": repeticoes,
+            "p50_ms": _percentil(duracoes, 0.50) * 1000,
+            "p95_ms": _percentil(duracoes, 0.95) * 1000,
+            "p99_ms": _percentil(duracoes, 0.99) * 1000,
+            "max_ms": max(duracoes) * 1000,
+            "memoria_mb": pico,
+        }
+        self.resultados.append(linha)
+        memoria = f"{pico:9.1f}" if pico is not None else "        -"
+        print(f"{etapa:<32} {tamanho:>8} {linha['p50_ms']:10.3f} {linha['p95_ms']:10.3f} "
+              f"{linha['p99_ms']:10.3f} {linha['max_ms']:10.3f} {memoria}", flush=True)
+        return resultado
+
+
+def bench_catalogo(medidor, quantidade):
+    catalogo = gerar_catalogo(quantidade)
+    os.makedirs("db", exist_ok=True)
+    caminho = os.path.join("db", f"catalogo_{quantidade}.csv")
+    catalogo.to_csv(caminho, sep=";", index=False)
+    cache_dir = os.path.join("db", f"cache_{quantidade}")
+
+    def sem_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    medidor.medir("catalogo.csv", quantidade,
+                  lambda _: catalogo_produtos.ler_catalogo(caminho, cache_dir), repeticoes=3, preparar=sem_cache)
+    df = medidor.medir("catalogo.cache", quantidade, lambda: catalogo_produtos.ler_catalogo(caminho, cache_dir))
+    indice = medidor.medir("catalogo.indice", quantidade, lambda: catalogo_produtos.IndiceProdutos(df), repeticoes=3)
+
+    aleatorio = random.Random(1)
+    filtros = [(aleatorio.choice([""] + indice.marcas), aleatorio.choice([""] + indice.tipos)) for _ in range(200)]
+    termos = [aleatorio.choice(PALAVRAS)[:aleatorio.randint(2, 5)].lower() for _ in range(200)]
+    displays = [aleatorio.choice(indice.displays) for _ in range(200)]
+    filtros_iter, termos_iter, displays_iter = iter(filtros), iter(termos), iter(displays)
+
+    medidor.medir("selecao.opcoes", quantidade, lambda filtro: indice.opcoes(*filtro),
+                  repeticoes=199, preparar=lambda: next(filtros_iter))
+    medidor.medir("selecao.busca", quantidade, lambda termo: indice.buscar(termo),
+                  repeticoes=199, preparar=lambda: next(termos_iter))
+    medidor.medir("selecao.item", quantidade, lambda display: indice.por_opcao(display),
+                  repeticoes=199, preparar=lambda: next(displays_iter))
+    return catalogo, indice
+
+
+def bench_gravacao(medidor, registros, repeticoes=300):
+    for backend in sorted(fichas_storage.BACKENDS):
+        storage = fichas_storage.criar_storage(backend)
+        ficha_id = storage.criar_ficha(f"Bench gravação {backend}")["id"]
+        amostra = iter(registros * (repeticoes // len(registros) + 2))
+        medidor.medir(f"gravacao.{backend}.anexar", repeticoes,
+                      lambda registro: storage.anexar_registro(ficha_id, registro),
+                      repeticoes=repeticoes, preparar=lambda: next(amostra))
+
+    storage = fichas_storage.criar_storage("json")
+    ficha_id = storage.criar_ficha("Bench fila")["id"]
+    fila = FilaGravacao(storage)
+    amostra = iter(registros * (repeticoes // len(registros) + 2))
+    medidor.medir("gravacao.fila.enfileirar", repeticoes,
+                  lambda registro: fila.enfileirar(ficha_id, registro),
+                  repeticoes=repeticoes, preparar=lambda: next(amostra))
+    medidor.medir("gravacao.fila.descarregar", repeticoes, lambda: fila.descarregar(), repeticoes=1)
+    fila.parar()
+
+
+def bench_registros(medidor, catalogo, indice, quantidade, xlsx_max):
+    registros = gerar_registros(quantidade, catalogo)
+    fatores = indice.fatores
+    storage = fichas_storage.criar_storage("json")
+    ficha_id = storage.criar_ficha(f"Bench {quantidade}")["id"]
+    storage.importar({"sheets": [{"id": ficha_id, "name": f"Bench {quantidade}", "data": registros}]})
+
+    medidor.medir("registros.carga", quantidade,
+                  lambda _: fichas_storage.criar_storage("json").contar_registros(ficha_id), repeticoes=3,
+                  preparar=lambda: None)
+    tabela = medidor.medir("registros.sincronizar", quantidade,
+                           lambda _: TabelaRegistros().sincronizar(storage, ficha_id), repeticoes=3,
+                           preparar=lambda: None)
+
+    novos = iter(gerar_registros(50, catalogo, semente=99))
+
+    def anexar_e_sincronizar(registro):
+        storage.anexar_registro(ficha_id, registro)
+        return tabela.sincronizar(storage, ficha_id)
+
+    medidor.medir("registros.envio_e_sincronia", quantidade, anexar_e_sincronizar,
+                  repeticoes=49, preparar=lambda: next(novos))
+    medidor.medir("registros.pagina", quantidade,
+                  lambda: pd.DataFrame(adicionar_totais(tabela.pagina(1, 100), fatores)), repeticoes=50)
+    medidor.medir("registros.resumo_totais", quantidade,
+                  lambda: resumo_totais(tabela, tabela.total, fatores), repeticoes=10)
+    medidor.medir("registros.resumo_sku", quantidade, lambda: tabela.resumo_por_sku(fatores), repeticoes=5)
+    medidor.medir("exportacao.csv", quantidade,
+                  lambda: exportacao.gerar_csv(tabela, tabela.total, fatores), repeticoes=3)
+    if quantidade <= xlsx_max:
+        medidor.medir("exportacao.xlsx", quantidade,
+                      lambda: exportacao.gerar_xlsx(tabela, tabela.total, fatores, tabela.resumo_por_sku(fatores)),
+                      repeticoes=1)
+
+    colunas_a = tabela.fatia(0, tabela.total)
+    colunas_b = tabela.fatia(tabela.total // 10, tabela.total)
+    medidor.medir("comparacao.fichas", quantidade,
+                  lambda: comparar_fichas(colunas_a, colunas_b, fatores), repeticoes=3)
+
+
+def bench_apptest(medidor, catalogo, quantidade):
+    from streamlit.testing.v1 import AppTest
+
+    os.makedirs("db", exist_ok=True)
+    catalogo.to_csv(os.path.join("db", "dbItens.csv"), sep=";", index=False)
+    storage = fichas_storage.criar_storage("json")
+    ficha_id = storage.criar_ficha("Bench AppTest")["id"]
+    storage.importar({"sheets": [{"id": ficha_id, "name": "Bench AppTest", "data": gerar_registros(quantidade, catalogo)}]})
+
+    app = AppTest.from_file(os.path.join(RAIZ, "main.py"), default_timeout=120)
+    app.session_state["ficha_atual"] = ficha_id
+    medidor.medir("app.primeiro_run", quantidade, lambda: app.run(), repeticoes=1)
+    medidor.medir("app.rerun", quantidade, lambda: app.run(), repeticoes=10)
+    app.selectbox(key="selectbox_item").select_index(1).run()
+
+    def enviar():
+        [botao for botao in app.button if "SALVAR" in botao.label][0].click().run()
+
+    medidor.medir("app.envio_contagem", quantidade, enviar, repeticoes=5)
+    if app.exception:
+        print(f"AppTest terminou com exceção: {app.exception}")
+
+
+def _lista(texto):
+    return [int(valor) for valor in texto.split(",") if valor]
+
+
+def comparar_com_base(resultados, caminho_base, tolerancia):
+    with open(caminho_base, "r", encoding="utf-8") as f:
+        base = {(linha["etapa"], linha["tamanho"]): linha for linha in json.load(f)["resultados"]}
+    regressoes = []
+    for linha in resultados:
+        anterior = base.get((linha["etapa"], linha["tamanho"]))
+        # Etapas abaixo de 1 ms variam demais entre execuções para comparar.
+        if anterior is None or anterior["p50_ms"] < 1:
+            continue
+        if linha["p50_ms"] > anterior["p50_ms"] * (1 + tolerancia):
+            regressoes.append((linha, anterior))
+    for linha, anterior in regressoes:
+        print(f"REGRESSÃO: {linha['etapa']} ({linha['tamanho']}) p50 "
+              f"{anterior['p50_ms']:.2f}ms -> {linha['p50_ms']:.2f}ms")
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--skus", default="1000,10000", help="tamanhos de catálogo, separados por vírgula")
+    parser.add_argument("--registros", default="1000,50000", help="tamanhos de ficha, separados por vírgula")
+    parser.add_argument("--xlsx-max", type=int, default=20_000, help="maior ficha exportada em XLSX")
+    parser.add_argument("--apptest", action="store_true", help="mede também os reruns do main.py pelo AppTest")
+    parser.add_argument("--sem-memoria", action="store_true", help="não mede o pico de memória")
+    parser.add_argument("--saida", help="grava os resultados neste arquivo JSON")
+    parser.add_argument("--base", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="piora aceita no p50 (0.25 = 25%%)")
+    args = parser.parse_args()
+    saida = os.path.abspath(args.saida) if args.saida else None
+    base = os.path.abspath(args.base) if args.base else None
+
+    origem = os.getcwd()
+    diretorio = tempfile.mkdtemp(prefix="bench_contagem_")
+    os.chdir(diretorio)
+    medidor = Medidor(memoria=not args.sem_memoria)
+
+    print(f"{'etapa':<32} {'tamanho':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10} {'mem MB':>9}")
+    try:
+        catalogos = [bench_catalogo(medidor, quantidade) for quantidade in _lista(args.skus)]
+        catalogo, indice = catalogos[-1]
+        bench_gravacao(medidor, gerar_registros(100, catalogo))
+        for quantidade in _lista(args.registros):
+            bench_registros(medidor, catalogo, indice, quantidade, args.xlsx_max)
+        if args.apptest:
+            bench_apptest(medidor, catalogos[0][0], _lista(args.registros)[0])
+    finally:
+        os.chdir(origem)
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    try:
+        import resource
+        print(f"pico de RSS do processo: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    except ImportError:  # Windows
+        pass
+
+    if saida:
+        with open(saida, "w", encoding="utf-8") as f:
+            json.dump({"data": time.strftime("%Y-%m-%d %H:%M:%S"), "resultados": medidor.resultados}, f, indent=2)
+    if base and comparar_com_base(medidor.resultados, base, args.tolerancia):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Stress de gravação concorrente de contagens.
+
+Simula várias sessões do Streamlit (processos x threads) gravando registros
+na mesma ficha pelo mesmo caminho de persistência usado em
+`salvar_e_visualizar_contagem`, com compactações e criação de fichas no meio,
+e confere ao final que nenhum registro foi perdido ou duplicado.
+
+Com `--gravacao lote`, as sessões de cada processo registram por um
+`NucleoContagem` compartilhado (como o `get_nucleo` do app), passando pela
+`FilaGravacao`; a contagem final é conferida depois de `descarregar()`.
+
+Uso:
+    python bench/stress_concorrencia.py --processos 8 --threads 4 --registros 200
+    python bench/stress_concorrencia.py --backend sqlite
+    python bench/stress_concorrencia.py --gravacao lote
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fichas_storage
+import nucleo_contagem
+
+FICHA_ALVO = "Ficha Stress"
+
+
+def _registro(processo, thread, i):
+    return {
+        "Hora": time.strftime("%H:%M:%S"),
+        "SKU": f"P{processo}-T{thread}-{i}",
+        "Descrição": "REGISTRO DE STRESS",
+        "Barracão": "A",
+        "Rua Inicial": "01",
+        "Rua Final": "01",
+        "Pallets": 1,
+        "Caixas Soltas": 0,
+    }
+
+
+def _sessao(backend, nucleo, ficha_id, processo, thread, registros, latencias):
+    # Cada thread faz o papel de uma sessão; sem núcleo, com o seu próprio storage.
+    storage = fichas_storage.criar_storage(backend) if nucleo is None else nucleo.storage
+    gravar = storage.anexar_registro if nucleo is None else nucleo.registrar
+    for i in range(registros):
+        inicio = time.perf_counter()
+        gravar(ficha_id, _registro(processo, thread, i))
+        latencias.append(time.perf_counter() - inicio)
+        if i % 50 == 49 and thread == 0:
+            storage.criar_ficha(f"Ficha P{processo} #{i}")
+
+
+def _processo(backend, gravacao, diretorio, ficha_id, processo, threads, registros, limite_journal, fila):
+    os.chdir(diretorio)
+    fichas_storage.JOURNAL_COMPACTAR_BYTES = limite_journal
+    nucleo = None
+    if gravacao == "lote":
+        nucleo = nucleo_contagem.NucleoContagem(
+            fichas_storage.criar_storage(backend), gravacao="lote", observar_catalogo=False
+        )
+    latencias = []
+    workers = [
+        threading.Thread(target=_sessao, args=(backend, nucleo, ficha_id, processo, t, registros, latencias))
+        for t in range(threads)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    descarregada = nucleo is None or nucleo.descarregar(timeout=60)
+    fila.put((latencias, descarregada))
+
+
+def _percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=sorted(fichas_storage.BACKENDS), default="json")
+    parser.add_argument("--gravacao", choices=["direta", "lote"], default="direta",
+                        help="direta: storage.anexar_registro; lote: NucleoContagem + FilaGravacao")
+    parser.add_argument("--processos", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--registros", type=int, default=100, help="registros por sessão")
+    parser.add_argument("--limite-journal", type=int, default=16 * 1024,
+                        help="bytes do journal que disparam compactação")
+    args = parser.parse_args()
+
+    diretorio = tempfile.mkdtemp(prefix="stress_fichas_")
+    os.chdir(diretorio)
+    ficha_id = fichas_storage.criar_storage(args.backend).criar_ficha(FICHA_ALVO)["id"]
+
+    fila = mp.Queue()
+    inicio = time.perf_counter()
+    processos = [
+        mp.Process(target=_processo, args=(args.backend, args.gravacao, diretorio, ficha_id, p, args.threads,
+                                           args.registros, args.limite_journal, fila))
+        for p in range(args.processos)
+    ]
+    for p in processos:
+        p.start()
+    latencias = []
+    descarregados = 0
+    for _ in processos:
+        parciais, descarregada = fila.get()
+        latencias.extend(parciais)
+        descarregados += descarregada
+    for p in processos:
+        p.join()
+    duracao = time.perf_counter() - inicio
+
+    registros = fichas_storage.criar_storage(args.backend).carregar_registros(ficha_id)
+    esperado = args.processos * args.threads * args.registros
+    unicos = len({r["SKU"] for r in registros})
+
+    print(f"backend={args.backend} gravação={args.gravacao} sessões={args.processos * args.threads} "
+          f"registros={len(registros)}/{esperado} únicos={unicos}")
+    print(f"vazão={len(latencias) / duracao:.0f} reg/s "
+          f"p50={_percentil(latencias, 0.50) * 1000:.2f}ms "
+          f"p99={_percentil(latencias, 0.99) * 1000:.2f}ms "
+          f"max={max(latencias) * 1000:.2f}ms")
+
+    shutil.rmtree(diretorio, ignore_errors=True)
+    if descarregados != args.processos:
+        print("FALHA: a fila de gravação não esvaziou.")
+        sys.exit(1)
+    if len(registros) != esperado or unicos != esperado:
+        print("FALHA: registros perdidos ou duplicados.")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
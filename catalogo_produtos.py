@@ -0,0 +1,313 @@
+import re
+import json
+import time
+import bisect
+import hashlib
+import threading
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from totais_contagem import fatores_conversao
+
+PRODUTOS_CSV = Path("db/dbItens.csv")
+CACHE_DIR = Path("db/cache")
+
+OPCAO_TODOS = ''
+
+# Tipos explícitos do catálogo: textos repetidos viram categorias e as
+# quantidades cabem em int32.
+SCHEMA_PRODUTOS = {
+    'codigo_amarracao_imagem': 'string',
+    'codigo': 'string',
+    'descricao': 'string',
+    'familia_comercial': 'category',
+    'familia_material': 'category',
+    'marca': 'category',
+    'tipo': 'category',
+    'qtd_por_caixa': 'int32',
+    'qtd_por_pallet': 'int32',
+    'qtd_por_camada': 'int32',
+}
+
+
+def aplicar_schema(df):
+    df = df.copy()
+    for coluna, tipo in SCHEMA_PRODUTOS.items():
+        if coluna not in df.columns:
+            continue
+        if tipo == 'int32':
+            valores = pd.to_numeric(df[coluna], errors='coerce')
+            df[coluna] = valores.astype('int32' if valores.notna().all() else 'Int32')
+        else:
+            df[coluna] = df[coluna].astype(tipo)
+    return df
+
+
+def assinatura_csv(caminho=PRODUTOS_CSV):
+    """(mtime, tamanho) do CSV, ou None se ele não existir."""
+    try:
+        info = Path(caminho).stat()
+    except FileNotFoundError:
+        return None
+    return (info.st_mtime_ns, info.st_size)
+
+
+def _hash_arquivo(caminho):
+    sha1 = hashlib.sha1()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(bloco)
+    return sha1.hexdigest()
+
+
+def _ler_csv(caminho):
+    tipos_texto = {coluna: 'string' for coluna, tipo in SCHEMA_PRODUTOS.items() if tipo != 'int32'}
+    return aplicar_schema(pd.read_csv(caminho, sep=';', dtype=tipos_texto))
+
+
+def ler_catalogo(caminho=PRODUTOS_CSV, cache_dir=CACHE_DIR):
+    """Lê o catálogo tipado, usando o cache binário quando o CSV não mudou.
+
+    O cache é validado pelo mtime/tamanho do CSV e, se eles mudaram (ex.: um
+    checkout novo no deploy), pelo hash do conteúdo antes de reprocessar.
+    """
+    caminho = Path(caminho)
+    cache_pkl = Path(cache_dir) / f"{caminho.stem}.pkl"
+    cache_meta = Path(cache_dir) / f"{caminho.stem}.meta.json"
+    assinatura = list(assinatura_csv(caminho))
+
+    meta = None
+    if cache_pkl.exists() and cache_meta.exists():
+        try:
+            meta = json.loads(cache_meta.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            meta = None
+
+    if meta is not None and meta.get("assinatura") == assinatura:
+        return pd.read_pickle(cache_pkl)
+
+    hash_csv = _hash_arquivo(caminho)
+    if meta is not None and meta.get("sha1") == hash_csv:
+        df = pd.read_pickle(cache_pkl)
+    else:
+        df = _ler_csv(caminho)
+        try:
+            cache_pkl.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache_pkl.with_suffix(".pkl.tmp")
+            df.to_pickle(tmp)
+            tmp.replace(cache_pkl)
+        except OSError:
+            return df
+
+    try:
+        cache_meta.write_text(json.dumps({"assinatura": assinatura, "sha1": hash_csv}), encoding="utf-8")
+    except OSError:
+        pass
+    return df
+
+
+def normalizar_texto(texto):
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def tokenizar(texto):
+    return [t for t in re.split(r"[^0-9a-z]+", normalizar_texto(texto)) if t]
+
+
+class IndiceProdutos:
+    """Índice do catálogo montado uma única vez por carga do CSV.
+
+    - `por_display` / `por_sku` / `por_amarracao`: posição da linha por texto
+      exibido, por SKU e por código de amarração;
+    - `opcoes(marca, tipo)`: listas de exibição já filtradas, por combinação;
+    - `buscar(texto, ...)`: busca por prefixo de palavras da descrição/SKU.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        if df.empty:
+            self.displays = []
+        else:
+            self.displays = (df['codigo'].astype(str) + ' - ' + df['descricao'].astype(str)).tolist()
+
+        self.por_display = {display: pos for pos, display in enumerate(self.displays)}
+        self.por_sku = {}
+        if 'codigo' in df.columns:
+            self.por_sku = {str(codigo): pos for pos, codigo in enumerate(df['codigo'].tolist())}
+        self.por_amarracao = {}
+        if 'codigo_amarracao_imagem' in df.columns:
+            for pos, codigo in enumerate(df['codigo_amarracao_imagem'].tolist()):
+                # Vários SKUs podem compartilhar a amarração; vale o primeiro.
+                self.por_amarracao.setdefault(str(codigo), pos)
+
+        self.marcas = sorted(df['marca'].dropna().unique().tolist()) if 'marca' in df.columns else []
+        self.tipos = sorted(df['tipo'].dropna().unique().tolist()) if 'tipo' in df.columns else []
+        self._montar_opcoes()
+        self._montar_tokens()
+        self._registros = {}
+        self._indices_codigo = None
+        self.fatores = fatores_conversao(df)
+
+    def _montar_opcoes(self):
+        marcas = self.df['marca'].tolist() if self.marcas else [OPCAO_TODOS] * len(self.displays)
+        tipos = self.df['tipo'].tolist() if self.tipos else [OPCAO_TODOS] * len(self.displays)
+
+        self._marca_de = marcas
+        self._tipo_de = tipos
+        self._posicoes = {}
+        for pos, (marca, tipo) in enumerate(zip(marcas, tipos)):
+            for chave in ((marca, tipo), (marca, OPCAO_TODOS), (OPCAO_TODOS, tipo), (OPCAO_TODOS, OPCAO_TODOS)):
+                self._posicoes.setdefault(chave, []).append(pos)
+        self._opcoes = {
+            chave: [self.displays[pos] for pos in posicoes]
+            for chave, posicoes in self._posicoes.items()
+        }
+
+    def _montar_tokens(self):
+        indice = {}
+        descricoes = self.df['descricao'].tolist() if 'descricao' in self.df.columns else []
+        for pos, (display, descricao) in enumerate(zip(self.displays, descricoes)):
+            for token in set(tokenizar(display)) | set(tokenizar(descricao)):
+                indice.setdefault(token, []).append(pos)
+        self._tokens = sorted(indice)
+        self._postings = [indice[token] for token in self._tokens]
+
+    def _posicoes_com_prefixo(self, prefixo):
+        inicio = bisect.bisect_left(self._tokens, prefixo)
+        fim = bisect.bisect_left(self._tokens, prefixo + "\uffff")
+        posicoes = set()
+        for postings in self._postings[inicio:fim]:
+            posicoes.update(postings)
+        return posicoes
+
+    def opcoes(self, marca=OPCAO_TODOS, tipo=OPCAO_TODOS):
+        return self._opcoes.get((marca, tipo), [])
+
+    def buscar(self, texto, marca=OPCAO_TODOS, tipo=OPCAO_TODOS, limite=200):
+        """Produtos cujas palavras começam com cada termo digitado."""
+        termos = tokenizar(texto)
+        if not termos:
+            return self.opcoes(marca, tipo)[:limite]
+
+        encontrados = None
+        for termo in sorted(termos, key=len, reverse=True):
+            posicoes = self._posicoes_com_prefixo(termo)
+            encontrados = posicoes if encontrados is None else encontrados & posicoes
+            if not encontrados:
+                return []
+
+        if marca != OPCAO_TODOS:
+            encontrados = {pos for pos in encontrados if self._marca_de[pos] == marca}
+        if tipo != OPCAO_TODOS:
+            encontrados = {pos for pos in encontrados if self._tipo_de[pos] == tipo}
+        return [self.displays[pos] for pos in sorted(encontrados)[:limite]]
+
+    def registro(self, pos):
+        registro = self._registros.get(pos)
+        if registro is None:
+            registro = self.df.iloc[pos].to_dict()
+            self._registros[pos] = registro
+        return registro
+
+    def por_opcao(self, display):
+        pos = self.por_display.get(display)
+        return self.registro(pos) if pos is not None else None
+
+    def resolver_codigo(self, codigo):
+        """Resolve um SKU digitado/lido, aceitando também o código de amarração."""
+        codigo = str(codigo).strip()
+        pos = self.por_sku.get(codigo)
+        if pos is None:
+            pos = self.por_amarracao.get(codigo)
+        return self.registro(pos) if pos is not None else None
+
+    def posicoes(self, codigos):
+        """`resolver_codigo` vetorizado: posição de cada código no catálogo (-1 se não existir)."""
+        if self._indices_codigo is None:
+            self._indices_codigo = tuple(
+                (pd.Index(list(mapa), dtype=object), np.fromiter(mapa.values(), dtype='int64', count=len(mapa)))
+                for mapa in (self.por_sku, self.por_amarracao)
+            )
+        codigos = pd.Index(pd.Series(codigos, dtype='string').str.strip().fillna('').to_numpy(dtype=object))
+        posicoes = np.full(len(codigos), -1, dtype='int64')
+        for chaves, valores in self._indices_codigo:
+            faltando = posicoes < 0
+            if not faltando.any() or not len(chaves):
+                continue
+            encontrados = chaves.get_indexer(codigos[faltando])
+            posicoes[faltando] = np.where(encontrados >= 0, valores[encontrados], -1)
+        return posicoes
+
+
+class CatalogoVivo:
+    """Mantém o índice do catálogo atualizado sem reiniciar o servidor.
+
+    Uma thread em segundo plano observa a assinatura do CSV; quando ela muda,
+    o catálogo é relido e indexado fora do caminho das requisições e só então
+    a referência é trocada, de uma vez, pelo novo `IndiceProdutos`. Leitores
+    nunca esperam pela recarga nem veem um índice pela metade. Com
+    `intervalo=None` não há thread: só `verificar()` recarrega.
+    """
+
+    def __init__(self, carregar, caminho=PRODUTOS_CSV, intervalo=2.0):
+        self._carregar = carregar
+        self._caminho = caminho
+        self._intervalo = intervalo
+        self._assinatura = assinatura_csv(caminho)
+        self.versao = 1
+        self.ultimo_erro = None
+        try:
+            self._indice = self._indexar()
+        except Exception as e:
+            # Sem catálogo válido: fica vazio até o CSV ser corrigido.
+            self._indice = IndiceProdutos(pd.DataFrame())
+            self.ultimo_erro = e
+        self._parar = threading.Event()
+        if intervalo:
+            self._thread = threading.Thread(target=self._observar, name="catalogo-reload", daemon=True)
+            self._thread.start()
+
+    def atual(self):
+        return self._indice
+
+    def _indexar(self):
+        df = self._carregar()
+        if df.empty:
+            raise ValueError(f"nenhum produto em {self._caminho}")
+        return IndiceProdutos(df)
+
+    def _observar(self):
+        while not self._parar.wait(self._intervalo):
+            self.verificar()
+
+    def verificar(self):
+        """Recarrega o catálogo se o CSV mudou; retorna True se houve troca.
+
+        Um CSV que não carrega (ou vem vazio) não substitui o índice atual:
+        fica só registrado em `ultimo_erro` até a próxima mudança do arquivo.
+        """
+        assinatura = assinatura_csv(self._caminho)
+        if assinatura == self._assinatura:
+            return False
+        try:
+            # Espera a escrita do arquivo terminar antes de ler.
+            time.sleep(min(0.5, self._intervalo or 0.5))
+            if assinatura_csv(self._caminho) != assinatura:
+                return False
+            novo_indice = self._indexar()
+        except Exception as e:
+            self._assinatura = assinatura
+            self.ultimo_erro = e
+            return False
+        self._indice = novo_indice
+        self._assinatura = assinatura
+        self.versao += 1
+        self.ultimo_erro = None
+        return True
+
+    def parar(self):
+        self._parar.set()
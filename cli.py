@@ -0,0 +1,198 @@
+"""Linha de comando para as fichas de contagem, sem abrir o Streamlit.
+
+Usa o mesmo núcleo (`nucleo_contagem`) e os mesmos arquivos em db/ do app.
+Fichas podem ser indicadas pelo id ou pelo nome.
+
+Uso:
+    python cli.py fichas [--arquivadas]
+    python cli.py nova-ficha ["Contagem Barracão A"]
+    python cli.py registrar FICHA SKU --barracao A --rua-inicial 01 [--rua-final 03] [--pallets 2] [--caixas 5]
+    python cli.py importar FICHA arquivo.csv|arquivo.xlsx [--barracao A] [--rua-inicial 01] [--rua-final 03] [--rejeitados rejeitados.csv]
+    python cli.py resumo FICHA [--por-sku]
+    python cli.py locais FICHA [--barracao A] [--rua-inicial 01 [--rua-final 05]]
+    python cli.py exportar FICHA [--formato csv|xlsx|resumo] [-o arquivo]
+    python cli.py comparar FICHA_A FICHA_B [-o arquivo.csv]
+    python cli.py arquivar FICHA
+    python cli.py restaurar FICHA
+"""
+import os
+import sys
+import argparse
+
+import nucleo_contagem
+import importacao_contagens
+from comparacao_fichas import resumo_comparacao
+
+
+def _ficha(nucleo, id_ou_nome):
+    ficha_id = nucleo.resolver_ficha(id_ou_nome)
+    if ficha_id is None:
+        raise SystemExit(f"Ficha não encontrada: {id_ou_nome}")
+    return ficha_id
+
+
+def _saida(conteudo, caminho):
+    if caminho:
+        with open(caminho, "wb") as f:
+            f.write(conteudo)
+        print(f"Gravado em {caminho} ({len(conteudo)} bytes).", file=sys.stderr)
+    else:
+        sys.stdout.buffer.write(conteudo)
+
+
+def cmd_fichas(nucleo, args):
+    arquivadas = set(nucleo.listar_arquivadas())
+    for ficha in nucleo.storage.manifesto():
+        if (ficha["id"] in arquivadas) != args.arquivadas:
+            continue
+        # O manifesto não inclui o journal ainda não compactado das fichas ativas.
+        registros = ficha['registros'] if args.arquivadas else nucleo.contar_registros(ficha['id'])
+        print(f"{ficha['id']}\t{ficha['name']}\t{ficha.get('created_at') or ''}\t{registros} registro(s)")
+
+
+def cmd_nova_ficha(nucleo, args):
+    ficha = nucleo.criar_ficha(args.nome)
+    print(f"{ficha['id']}\t{ficha['name']}")
+
+
+def cmd_registrar(nucleo, args):
+    ficha_id = _ficha(nucleo, args.ficha)
+    item = nucleo.produtos().resolver_codigo(args.sku)
+    if item is None:
+        raise SystemExit(f"SKU '{args.sku}' não encontrado no catálogo.")
+    registro = nucleo_contagem.montar_registro(
+        item, args.barracao, args.rua_inicial, args.rua_final or args.rua_inicial, args.pallets, args.caixas
+    )
+    nucleo.registrar(ficha_id, registro)
+    print(f"{registro['SKU']} - {registro['Descrição']} | {args.pallets} pallet(s), {args.caixas} cx")
+
+
+def cmd_importar(nucleo, args):
+    padroes = {'Barracão': args.barracao, 'Rua Inicial': args.rua_inicial, 'Rua Final': args.rua_final}
+    try:
+        resultado = nucleo.importar(_ficha(nucleo, args.ficha), args.arquivo, padroes=padroes)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"{resultado['importados']} registro(s) importado(s), {resultado['rejeitados']} rejeitado(s).")
+    if args.rejeitados and resultado['rejeitados']:
+        with open(args.rejeitados, "wb") as f:
+            f.write(importacao_contagens.gerar_csv_rejeicoes(resultado['rejeicoes']))
+        print(f"Rejeições gravadas em {args.rejeitados}.", file=sys.stderr)
+
+
+def cmd_resumo(nucleo, args):
+    ficha_id = _ficha(nucleo, args.ficha)
+    if args.por_sku:
+        print(nucleo.resumo_por_sku(ficha_id).to_string(index=False))
+        return
+    for chave, valor in nucleo.resumo(ficha_id).items():
+        print(f"{chave}: {valor}")
+
+
+def cmd_locais(nucleo, args):
+    ficha_id = _ficha(nucleo, args.ficha)
+    if args.rua_inicial:
+        if not args.barracao:
+            raise SystemExit("Informe o --barracao da faixa de ruas.")
+        registros = nucleo.registros_na_faixa(ficha_id, args.barracao, args.rua_inicial, args.rua_final)
+        print(registros.to_string(index=False))
+    elif args.barracao:
+        print(nucleo.progresso_locais(ficha_id, args.barracao).to_string(index=False))
+    else:
+        print(nucleo.resumo_locais(ficha_id).to_string(index=False))
+        fora_do_mapa = nucleo.tabela(ficha_id).locais.fora_do_mapa
+        if fora_do_mapa:
+            print(f"{fora_do_mapa} registro(s) com barracão/rua fora do mapa.", file=sys.stderr)
+
+
+def cmd_exportar(nucleo, args):
+    _saida(nucleo.exportar(_ficha(nucleo, args.ficha), args.formato), args.saida)
+
+
+def cmd_comparar(nucleo, args):
+    comparacao = nucleo.comparar(_ficha(nucleo, args.ficha_a), _ficha(nucleo, args.ficha_b))
+    for status, quantidade in resumo_comparacao(comparacao).items():
+        print(f"{status}: {quantidade}", file=sys.stderr)
+    _saida(comparacao.to_csv(index=False, sep=';').encode('utf-8'), args.saida)
+
+
+def cmd_arquivar(nucleo, args):
+    if not nucleo.arquivar_ficha(_ficha(nucleo, args.ficha)):
+        raise SystemExit("A ficha não pôde ser arquivada.")
+
+
+def cmd_restaurar(nucleo, args):
+    if not nucleo.restaurar_ficha(_ficha(nucleo, args.ficha)):
+        raise SystemExit("A ficha não pôde ser restaurada.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fichas de contagem de estoque.")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default=os.environ.get("FICHAS_BACKEND", "json"))
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    p = comandos.add_parser("fichas", help="lista as fichas")
+    p.add_argument("--arquivadas", action="store_true", help="lista as arquivadas em vez das ativas")
+    p.set_defaults(executar=cmd_fichas)
+
+    p = comandos.add_parser("nova-ficha", help="cria uma ficha")
+    p.add_argument("nome", nargs="?")
+    p.set_defaults(executar=cmd_nova_ficha)
+
+    p = comandos.add_parser("registrar", help="registra uma contagem")
+    p.add_argument("ficha")
+    p.add_argument("sku")
+    p.add_argument("--barracao", required=True)
+    p.add_argument("--rua-inicial", required=True)
+    p.add_argument("--rua-final")
+    p.add_argument("--pallets", type=int, default=1)
+    p.add_argument("--caixas", type=int, default=0)
+    p.set_defaults(executar=cmd_registrar)
+
+    p = comandos.add_parser("importar", help="importa contagens de um CSV/XLSX")
+    p.add_argument("ficha")
+    p.add_argument("arquivo")
+    p.add_argument("--barracao", help="barracão das linhas sem barracão")
+    p.add_argument("--rua-inicial", help="rua das linhas sem rua")
+    p.add_argument("--rua-final")
+    p.add_argument("--rejeitados", help="grava as linhas rejeitadas neste CSV")
+    p.set_defaults(executar=cmd_importar)
+
+    p = comandos.add_parser("resumo", help="totais da ficha")
+    p.add_argument("ficha")
+    p.add_argument("--por-sku", action="store_true")
+    p.set_defaults(executar=cmd_resumo)
+
+    p = comandos.add_parser("locais", help="progresso por barracão/rua, ou os registros de uma faixa de ruas")
+    p.add_argument("ficha")
+    p.add_argument("--barracao")
+    p.add_argument("--rua-inicial")
+    p.add_argument("--rua-final")
+    p.set_defaults(executar=cmd_locais)
+
+    p = comandos.add_parser("exportar", help="exporta a ficha")
+    p.add_argument("ficha")
+    p.add_argument("--formato", choices=["csv", "xlsx", "resumo"], default="csv")
+    p.add_argument("-o", "--saida")
+    p.set_defaults(executar=cmd_exportar)
+
+    p = comandos.add_parser("comparar", help="compara duas fichas (recontagem)")
+    p.add_argument("ficha_a")
+    p.add_argument("ficha_b")
+    p.add_argument("-o", "--saida")
+    p.set_defaults(executar=cmd_comparar)
+
+    for nome, executar in (("arquivar", cmd_arquivar), ("restaurar", cmd_restaurar)):
+        p = comandos.add_parser(nome, help=f"{nome} a ficha")
+        p.add_argument("ficha")
+        p.set_defaults(executar=executar)
+
+    args = parser.parse_args(argv)
+    nucleo = nucleo_contagem.NucleoContagem(
+        nucleo_contagem.abrir_storage(args.backend), gravacao="direta", observar_catalogo=False
+    )
+    args.executar(nucleo, args)
+
+
+if __name__ == "__main__":
+    main()
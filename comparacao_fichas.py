@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from totais_contagem import calcular_totais, como_texto, numeros
+
+CHAVE_COMPARACAO = ['SKU', 'Barracão', 'Rua Inicial', 'Rua Final']
+CAMPOS_COMPARACAO = CHAVE_COMPARACAO + ['Descrição', 'Pallets', 'Caixas Soltas']
+
+STATUS_ADICIONADO = "Adicionado"
+STATUS_REMOVIDO = "Removido"
+STATUS_ALTERADO = "Alterado"
+STATUS_IGUAL = "Igual"
+
+
+def _colunas(registros, coluna, tamanho):
+    """Coluna como array numpy, aceitando DataFrame, dict de colunas ou lista de registros."""
+    if isinstance(registros, list):
+        valores = [registro.get(coluna) for registro in registros]
+    elif coluna in registros:
+        valores = registros[coluna]
+    else:
+        valores = [None] * tamanho
+    return np.asarray(valores, dtype=object)
+
+
+def _tamanho(registros):
+    if isinstance(registros, list):
+        return len(registros)
+    if isinstance(registros, pd.DataFrame):
+        return len(registros)
+    return len(next(iter(registros.values()), []))
+
+
+def comparar_fichas(registros_a, registros_b, fatores=None):
+    """Compara duas fichas por SKU e local.
+
+    `registros_a` é a ficha de referência e `registros_b` a recontagem; ambos
+    podem ser listas de registros, dicionários de colunas ou DataFrames.
+    Retorna uma linha por SKU + local com as quantidades de cada ficha, as
+    diferenças (B - A) e o status: Adicionado, Removido, Alterado ou Igual.
+
+    As duas fichas são concatenadas e a chave composta vira um único inteiro
+    (factorize por coluna); os somatórios por chave e por ficha saem de um
+    `bincount`, sem laços em Python nem joins sobre MultiIndex.
+    """
+    tamanho_a, tamanho_b = _tamanho(registros_a), _tamanho(registros_b)
+    lado = np.concatenate([np.zeros(tamanho_a, dtype='int64'), np.ones(tamanho_b, dtype='int64')])
+
+    def juntar(coluna):
+        return np.concatenate([_colunas(registros_a, coluna, tamanho_a), _colunas(registros_b, coluna, tamanho_b)])
+
+    chave = np.zeros(len(lado), dtype='int64')
+    valores_chave = {}
+    codigos_chave = {}
+    for coluna in CHAVE_COMPARACAO:
+        valores = juntar(coluna)
+        valores[pd.isna(valores)] = ''
+        valores = como_texto(valores)
+        # Códigos em ordem alfabética: servem também para ordenar o resultado.
+        codigos, _ = pd.factorize(valores, sort=True)
+        chave = chave * (codigos.max() + 1 if len(codigos) else 1) + codigos
+        valores_chave[coluna] = valores
+        codigos_chave[coluna] = codigos
+
+    grupos, _ = pd.factorize(chave)
+    total_grupos = grupos.max() + 1 if len(grupos) else 0
+    _, primeira_linha = np.unique(grupos, return_index=True)
+
+    posicao = grupos * 2 + lado
+    def somar(pesos=None):
+        return np.bincount(posicao, weights=pesos, minlength=2 * total_grupos).reshape(total_grupos, 2).astype('int64')
+
+    registros = somar()
+    pallets = somar(numeros(juntar('Pallets')))
+    caixas = somar(numeros(juntar('Caixas Soltas')))
+
+    # Descrição preferencialmente da recontagem (B).
+    descricoes = juntar('Descrição')
+    ultima_linha = len(grupos) - 1 - np.unique(grupos[::-1], return_index=True)[1]
+
+    # Ordena os grupos pela chave antes de montar o DataFrame.
+    ordem = np.lexsort([codigos_chave[coluna][primeira_linha] for coluna in reversed(CHAVE_COMPARACAO)])
+    primeira_linha, ultima_linha = primeira_linha[ordem], ultima_linha[ordem]
+    registros, pallets, caixas = registros[ordem], pallets[ordem], caixas[ordem]
+
+    comparacao = pd.DataFrame({coluna: valores[primeira_linha] for coluna, valores in valores_chave.items()})
+    comparacao['Descrição'] = descricoes[ultima_linha]
+    comparacao['Pallets (A)'] = pallets[:, 0]
+    comparacao['Caixas Soltas (A)'] = caixas[:, 0]
+    comparacao['Pallets (B)'] = pallets[:, 1]
+    comparacao['Caixas Soltas (B)'] = caixas[:, 1]
+    comparacao['Δ Pallets'] = pallets[:, 1] - pallets[:, 0]
+    comparacao['Δ Caixas Soltas'] = caixas[:, 1] - caixas[:, 0]
+
+    if fatores is not None:
+        for indice, nome in ((0, 'A'), (1, 'B')):
+            total_caixas, _ = calcular_totais(valores_chave['SKU'][primeira_linha], pallets[:, indice], caixas[:, indice], fatores)
+            comparacao[f'Total Caixas ({nome})'] = pd.array(total_caixas.round(), dtype='Int64')
+        comparacao['Δ Total Caixas'] = comparacao['Total Caixas (B)'] - comparacao['Total Caixas (A)']
+
+    alterado = (pallets[:, 1] != pallets[:, 0]) | (caixas[:, 1] != caixas[:, 0])
+    comparacao.insert(0, 'Status', np.select(
+        [registros[:, 0] == 0, registros[:, 1] == 0, alterado],
+        [STATUS_ADICIONADO, STATUS_REMOVIDO, STATUS_ALTERADO],
+        default=STATUS_IGUAL,
+    ))
+    return comparacao
+
+
+def resumo_comparacao(comparacao):
+    contagem = comparacao['Status'].value_counts()
+    return {status: int(contagem.get(status, 0)) for status in (STATUS_ADICIONADO, STATUS_REMOVIDO, STATUS_ALTERADO, STATUS_IGUAL)}
@@ -0,0 +1,52 @@
+import io
+
+import pandas as pd
+from openpyxl import Workbook
+
+from totais_contagem import adicionar_totais
+
+# Registros serializados por vez, para não montar a ficha inteira em um DataFrame.
+REGISTROS_POR_BLOCO = 10_000
+
+
+def _blocos(tabela, total, fatores):
+    for bloco in tabela.blocos(REGISTROS_POR_BLOCO, total):
+        yield adicionar_totais(bloco, fatores) if fatores is not None else bloco
+
+
+def gerar_csv(tabela, total=None, fatores=None):
+    saida = io.BytesIO()
+    cabecalho = True
+    for bloco in _blocos(tabela, total, fatores):
+        saida.write(pd.DataFrame(bloco).to_csv(index=False, header=cabecalho, sep=';').encode('utf-8'))
+        cabecalho = False
+    if cabecalho:
+        saida.write((';'.join(tabela.colunas) + '\n').encode('utf-8'))
+    return saida.getvalue()
+
+
+def gerar_csv_resumo(resumo):
+    return resumo.to_csv(index=False, sep=';').encode('utf-8')
+
+
+def gerar_xlsx(tabela, total=None, fatores=None, resumo=None):
+    # Modo write-only: as linhas vão direto para o arquivo, sem manter células em memória.
+    workbook = Workbook(write_only=True)
+    planilha = workbook.create_sheet("Contagens")
+    cabecalho = True
+    for bloco in _blocos(tabela, total, fatores):
+        if cabecalho:
+            planilha.append(list(bloco))
+            cabecalho = False
+        for linha in zip(*bloco.values()):
+            planilha.append([None if pd.isna(valor) else valor for valor in linha])
+    if cabecalho:
+        planilha.append(list(tabela.colunas))
+    if resumo is not None:
+        planilha_resumo = workbook.create_sheet("Resumo por SKU")
+        planilha_resumo.append(list(resumo.columns))
+        for linha in resumo.itertuples(index=False, name=None):
+            planilha_resumo.append([None if pd.isna(valor) else valor for valor in linha])
+    saida = io.BytesIO()
+    workbook.save(saida)
+    return saida.getvalue()
@@ -1,41 +1,55 @@
 import os
-import json
-import time
 
-FICHAS_FILE = "fichas.json"
-BASE_PATH = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_PATH, "db")
+import fichas_storage
+import nucleo_contagem
+
+# Mesma base (relativa ao diretório de trabalho) que os arquivos do storage.
+DB_PATH = os.fspath(fichas_storage.FICHA_FILE.parent)
 os.makedirs(DB_PATH, exist_ok=True)
 
-def carregar_fichas():
-    caminho = os.path.join(DB_PATH, FICHAS_FILE)
-    if os.path.exists(caminho):
-        with open(caminho, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"sheets": []}
+# Compatibilidade: a lógica de fichas vive em nucleo_contagem/fichas_storage
+# (usados pelo app e pela cli.py); aqui ficam só as funções antigas, que
+# passam pela mesma API de storage.
 
-def salvar_fichas(fichas):
-    caminho = os.path.join(DB_PATH, FICHAS_FILE)
-    with open(caminho, "w", encoding="utf-8") as f:
-        json.dump(fichas, f, ensure_ascii=False, indent=2)
-
-def criar_ficha(nome_ficha):
-    timestamp = time.time()
-    return {
-        "id": f"sheet_{int(timestamp)}",
-        "name": nome_ficha,
-        "createdAt": timestamp
-    }
+_storage = None
 
-def listar_fichas():
-    fichas = carregar_fichas()
-    return [sheet["name"] for sheet in fichas["sheets"]]
+def _abrir_storage():
+    global _storage
+    if _storage is None:
+        _storage = nucleo_contagem.abrir_storage(os.environ.get("FICHAS_BACKEND", "json"))
+    return _storage
 
-# --- Teste correto ---
+def carregar_fichas():
+    data = _abrir_storage().carregar()
+    for ficha in data["sheets"]:
+        # Quantos registros já estavam gravados: salvar_fichas só anexa os seguintes.
+        ficha["registros"] = len(ficha["data"])
+    return data
 
-# fichas_data = carregar_fichas()
-# ficha = criar_ficha("teste")
-# fichas_data["sheets"].append(ficha)
-# salvar_fichas(fichas_data)
+def salvar_fichas(fichas):
+    """Grava as fichas novas e os registros acrescentados desde carregar_fichas().
+
+    Nada é regravado por cima: o que outras sessões gravaram nesse meio-tempo
+    continua lá. Fichas sem "id" (formato antigo) usam o id derivado do nome.
+    """
+    storage = _abrir_storage()
+    existentes = storage.nomes_fichas()
+    novas = []
+    for ficha in fichas["sheets"]:
+        ficha.setdefault("id", fichas_storage.id_legado(ficha["name"]))
+        registros = list(ficha.get("data", []))
+        if ficha["id"] not in existentes:
+            novas.append({**ficha, "data": registros})
+        elif registros[ficha.get("registros", 0):]:
+            storage.anexar_registros(ficha["id"], registros[ficha.get("registros", 0):])
+        ficha["registros"] = len(registros)
+    if novas:
+        storage.importar({"sheets": novas})
+
+def criar_ficha(nome_ficha=None):
+    return fichas_storage.nova_ficha(nome_ficha or nucleo_contagem.nome_nova_ficha())
 
-# print(listar_fichas())
+def listar_fichas():
+    storage = _abrir_storage()
+    nomes = storage.nomes_fichas()
+    return [nomes.get(ficha_id, ficha_id) for ficha_id in storage.listar_fichas()]
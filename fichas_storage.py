@@ -0,0 +1,1136 @@
+import os
+import atexit
+import gzip
+import json
+import time
+import uuid
+import zlib
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+from registros_compactos import RegistrosCompactos
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# O snapshot é o manifesto das fichas (nome, id, criação, nº de registros);
+# os registros de cada ficha ficam em um arquivo próprio, lido só quando a
+# ficha é aberta, e as fichas arquivadas vão comprimidas para ARQUIVO_DIR.
+FICHA_FILE = Path("db/ficha_contagem.json")
+FICHAS_DIR = Path("db/fichas")
+ARQUIVO_DIR = Path("db/arquivo")
+JOURNAL_DIR = Path("db/journal")
+# Journal renomeado para ser incorporado ao arquivo da ficha:
+# "<id>.<geração>.compactando". Os anexos seguintes vão para um journal novo.
+SUFIXO_INCORPORANDO = ".compactando"
+SQLITE_FILE = Path("db/fichas.sqlite3")
+LOCK_FILE = Path("db/ficha_contagem.lock")
+
+# O journal de uma ficha é consolidado no arquivo dela quando passa de
+# JOURNAL_COMPACTAR_BYTES ou de uma fração do tamanho desse arquivo, o que for
+# maior: fichas grandes são regravadas com menos frequência, e o custo de cada
+# regravação fica proporcional ao que foi anexado desde a anterior.
+JOURNAL_COMPACTAR_BYTES = 512 * 1024
+JOURNAL_COMPACTAR_FRACAO = 0.5
+
+# Coluna SQLite -> chave do registro gravado no JSON / exportado no CSV.
+COLUNAS_REGISTRO = [
+    ("hora", "Hora"),
+    ("sku", "SKU"),
+    ("descricao", "Descrição"),
+    ("barracao", "Barracão"),
+    ("rua_inicial", "Rua Inicial"),
+    ("rua_final", "Rua Final"),
+    ("pallets", "Pallets"),
+    ("caixas_soltas", "Caixas Soltas"),
+]
+
+
+def _travar(f, exclusiva):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusiva else fcntl.LOCK_SH)
+    else:
+        # msvcrt só oferece trava exclusiva.
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _destravar(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def trava_fichas(exclusiva=False):
+    """Trava entre processos sobre o conjunto snapshot + journals.
+
+    Anexos ao journal usam a trava compartilhada (não se bloqueiam entre si);
+    reescritas do snapshot usam a exclusiva.
+    """
+    LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_FILE, "a+b") as f:
+        _travar(f, exclusiva)
+        try:
+            yield
+        finally:
+            _destravar(f)
+
+
+def novo_id_ficha():
+    """Id estável e único da ficha; o nome exibido pode se repetir."""
+    return f"sheet_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+
+
+def id_legado(nome_ficha):
+    """Id das fichas gravadas quando o nome era a chave (também o nome do journal)."""
+    return hashlib.sha1(nome_ficha.encode("utf-8")).hexdigest()[:16]
+
+
+def _journal_path(ficha_id):
+    return JOURNAL_DIR / f"{ficha_id}.jsonl"
+
+
+def _geracao():
+    # Ordena cronologicamente pelo nome.
+    return f"{time.time_ns():020d}{uuid.uuid4().hex[:6]}"
+
+
+def _payload_path(ficha):
+    # Cada regravação vai para um arquivo novo, apontado por "arquivo" no
+    # manifesto; fichas gravadas antes disso usam o próprio id.
+    nome = ficha.get("arquivo") or ficha["id"]
+    if ficha.get("arquivada"):
+        return ARQUIVO_DIR / f"{nome}.json.gz"
+    return FICHAS_DIR / f"{nome}.json"
+
+
+def nova_ficha(nome_ficha, ficha_id=None):
+    return {
+        "id": ficha_id or novo_id_ficha(),
+        "name": nome_ficha,
+        "created_at": time.time(),
+        "registros": 0,
+        "data": RegistrosCompactos(),
+    }
+
+
+def _ler_journal(caminho, inicio=0):
+    """Lê as entradas de um journal a partir do byte `inicio`.
+
+    Retorna as entradas e o offset até onde a leitura foi consumida; uma
+    última linha ainda incompleta fica para a próxima leitura.
+    """
+    entradas = []
+    with open(caminho, "rb") as f:
+        f.seek(inicio)
+        conteudo = f.read()
+    fim = conteudo.rfind(b"\n") + 1
+    linhas = [linha for linha in conteudo[:fim].splitlines() if linha.strip()]
+    try:
+        # Caso comum: todas as linhas íntegras, lidas numa única chamada.
+        lidas = json.loads(b"[" + b",".join(linhas) + b"]")
+        if len(lidas) == len(linhas):
+            return lidas, inicio + fim
+    except json.JSONDecodeError:
+        pass
+    for linha in linhas:
+        try:
+            entradas.append(json.loads(linha))
+        except json.JSONDecodeError:
+            # Linha truncada por uma escrita interrompida.
+            continue
+    return entradas, inicio + fim
+
+
+def _posicoes_apos_entradas(caminhos, quantidade):
+    """Até onde ler cada journal de `caminhos` (em sequência) para pular as
+    `quantidade` primeiras entradas; None se a sequência tiver menos."""
+    posicoes = {}
+    for caminho in caminhos:
+        if quantidade == 0:
+            break
+        try:
+            with open(caminho, "rb") as f:
+                conteudo = f.read()
+        except FileNotFoundError:
+            continue
+        posicao = 0
+        for linha in conteudo.splitlines(keepends=True):
+            if quantidade == 0 or not linha.endswith(b"\n"):
+                break
+            posicao += len(linha)
+            if not linha.strip():
+                continue
+            try:
+                json.loads(linha)
+            except json.JSONDecodeError:
+                continue
+            quantidade -= 1
+        posicoes[caminho] = posicao
+    return posicoes if quantidade == 0 else None
+
+
+def ler_snapshot():
+    """Lê o manifesto das fichas, sem os registros.
+
+    Snapshots no formato antigo (registros embutidos em "data") continuam
+    válidos: essas fichas já chegam carregadas e passam a ter arquivo
+    próprio na próxima gravação.
+    """
+    if FICHA_FILE.exists() and FICHA_FILE.stat().st_size > 0:
+        with open(FICHA_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for ficha in data["sheets"]:
+            ficha.setdefault("id", id_legado(ficha["name"]))
+            ficha.setdefault("created_at", None)
+            ficha.setdefault("registros", len(ficha.get("data", [])))
+            if "data" in ficha:
+                ficha["data"] = RegistrosCompactos(ficha["data"])
+        return data
+    return None
+
+
+def ler_registros_da_ficha(ficha):
+    """Registros gravados no arquivo da ficha (sem o journal)."""
+    caminho = _payload_path(ficha)
+    try:
+        if ficha.get("arquivada"):
+            with gzip.open(caminho, "rt", encoding="utf-8") as f:
+                return RegistrosCompactos(json.load(f))
+        with open(caminho, "r", encoding="utf-8") as f:
+            return RegistrosCompactos(json.load(f))
+    except FileNotFoundError:
+        return RegistrosCompactos()
+
+
+def versao_snapshot():
+    """Identifica a versão do snapshot em disco (muda a cada reescrita)."""
+    try:
+        info = FICHA_FILE.stat()
+    except FileNotFoundError:
+        return None
+    return (info.st_mtime_ns, info.st_size, info.st_ino)
+
+
+def _id_da_entrada(entrada):
+    # Journals antigos identificam a ficha pelo nome.
+    return entrada["ficha"] if "ficha" in entrada else id_legado(entrada["sheet"])
+
+
+def _aplicar_entradas(data, fichas_por_id, entradas):
+    # Agrupa por ficha (mantendo a ordem) para anexar cada grupo de uma vez.
+    novos = {}
+    for entrada in entradas:
+        ficha_id = _id_da_entrada(entrada)
+        if ficha_id not in novos:
+            novos[ficha_id] = (entrada.get("sheet", ficha_id), [])
+        novos[ficha_id][1].append(entrada["registro"])
+    for ficha_id, (nome, registros) in novos.items():
+        ficha = fichas_por_id.get(ficha_id)
+        if ficha is None:
+            ficha = nova_ficha(nome, ficha_id)
+            data["sheets"].append(ficha)
+            fichas_por_id[ficha_id] = ficha
+        ficha["data"].extend(registros)
+
+
+def _ficha_do_journal(caminho):
+    return caminho.name.split(".", 1)[0]
+
+
+def _journals_incorporando(data, ficha_id=None):
+    """Journals renomeados para incorporação que o manifesto `data` ainda não
+    dá como incorporados, do mais antigo ao mais novo (por ficha)."""
+    if not JOURNAL_DIR.exists():
+        return []
+    incorporados = set(data.get("incorporados", []))
+    padrao = f"{ficha_id if ficha_id else '*'}.*{SUFIXO_INCORPORANDO}"
+    return sorted(caminho for caminho in JOURNAL_DIR.glob(padrao) if caminho.name not in incorporados)
+
+
+def _journals_ativos():
+    return sorted(JOURNAL_DIR.glob("*.jsonl")) if JOURNAL_DIR.exists() else []
+
+
+def aplicar_journals(data):
+    """Reaplica sobre o snapshot os registros anexados desde a última compactação."""
+    fichas_por_id = {ficha["id"]: ficha for ficha in data["sheets"]}
+    for caminho in _journals_incorporando(data) + _journals_ativos():
+        entradas, _ = _ler_journal(caminho)
+        _aplicar_entradas(data, fichas_por_id, entradas)
+    return data
+
+
+def _carregar_fichas_do_disco():
+    data = ler_snapshot()
+    if data is None:
+        return None
+    for ficha in data["sheets"]:
+        if "data" not in ficha:
+            ficha["data"] = ler_registros_da_ficha(ficha)
+    return aplicar_journals(data)
+
+
+def como_listas(data):
+    """Cópia de `data` com os registros de cada ficha como listas de dicts."""
+    return {
+        **data,
+        "sheets": [
+            {**ficha, "data": list(ficha["data"])} if "data" in ficha else dict(ficha)
+            for ficha in data["sheets"]
+        ],
+    }
+
+
+def carregar_fichas_do_disco():
+    """Reconstrói todas as fichas (manifesto + arquivos + journals)."""
+    with trava_fichas():
+        data = _carregar_fichas_do_disco()
+    return como_listas(data) if data is not None else None
+
+
+def _escrever_temporario(caminho, conteudo):
+    """Grava `conteudo` num arquivo temporário ao lado de `caminho` e o retorna."""
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    tmp = caminho.with_name(f"{caminho.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(conteudo)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp
+
+
+def _escrever_atomico(caminho, conteudo):
+    os.replace(_escrever_temporario(caminho, conteudo), caminho)
+
+
+def _conteudo_da_ficha(ficha):
+    conteudo = json.dumps(list(ficha["data"]), ensure_ascii=False).encode("utf-8")
+    if ficha.get("arquivada"):
+        conteudo = gzip.compress(conteudo, compresslevel=9)
+    return conteudo
+
+
+def _escrever_manifesto(data):
+    for ficha in data["sheets"]:
+        if "data" in ficha:
+            ficha["registros"] = len(ficha["data"])
+    manifesto = {
+        "sheets": [{chave: valor for chave, valor in ficha.items() if chave != "data"} for ficha in data["sheets"]],
+        "incorporados": data.get("incorporados", []),
+    }
+    _escrever_atomico(FICHA_FILE, json.dumps(manifesto, indent=4, ensure_ascii=False).encode("utf-8"))
+
+
+def _gravar_arquivos(data):
+    """Grava cada ficha carregada em `data` num arquivo novo; retorna essas fichas.
+
+    Fichas sem "data" (não carregadas) mantêm o arquivo que já têm. Nada
+    muda para quem lê até `_confirmar`.
+    """
+    regravadas = []
+    for ficha in data["sheets"]:
+        if "data" in ficha:
+            ficha["arquivo"] = f"{ficha['id']}.{_geracao()}"
+            _escrever_atomico(_payload_path(ficha), _conteudo_da_ficha(ficha))
+            regravadas.append(ficha)
+    return regravadas
+
+
+def _confirmar(data, regravadas, incorporados=()):
+    """Grava o manifesto, que passa a apontar para os arquivos `regravadas` e a
+    dar os journals `incorporados` como incluídos neles; só então apaga o que
+    ficou para trás. Chamar sob a trava exclusiva.
+
+    O manifesto é o ponto de confirmação: uma interrupção antes dele deixa o
+    estado anterior (arquivos antigos + journals), e depois dele o novo, sem
+    que um journal já incorporado seja reaplicado.
+    """
+    # Journals que uma confirmação anterior não chegou a apagar.
+    for nome in data.get("incorporados", []):
+        (JOURNAL_DIR / nome).unlink(missing_ok=True)
+    data["incorporados"] = [caminho.name for caminho in incorporados]
+    _escrever_manifesto(data)
+    for caminho in incorporados:
+        caminho.unlink(missing_ok=True)
+    for ficha in regravadas:
+        atual = _payload_path(ficha)
+        for pasta in (FICHAS_DIR, ARQUIVO_DIR):
+            for caminho in pasta.glob(f"{ficha['id']}.*"):
+                if caminho != atual:
+                    caminho.unlink(missing_ok=True)
+
+
+def _salvar_snapshot(data, incorporados=()):
+    _confirmar(data, _gravar_arquivos(data), incorporados)
+
+
+def _incorporar_journals(ficha_id=None):
+    """Renomeia os journals ativos (ou o da ficha) para incorporação.
+
+    Só renomeia, então a trava exclusiva (que deve estar em uso) é breve.
+    """
+    geracao = _geracao()
+    ativos = [_journal_path(ficha_id)] if ficha_id else _journals_ativos()
+    for caminho in ativos:
+        try:
+            if not caminho.stat().st_size:
+                continue
+        except FileNotFoundError:
+            continue
+        os.replace(caminho, caminho.with_name(f"{caminho.stem}.{geracao}{SUFIXO_INCORPORANDO}"))
+
+
+def anexar_registros(ficha_id, registros, limite=JOURNAL_COMPACTAR_BYTES):
+    """Anexa registros ao journal da ficha, em O(registros anexados).
+
+    O lote inteiro é gravado em uma única chamada write() com O_APPEND (e um
+    único fsync), sob a trava compartilhada e uma trava do próprio journal,
+    de modo que sessões concorrentes nunca intercalam nem sobrescrevem linhas.
+
+    Retorna True quando o journal passou de `limite` bytes e deve ser compactado.
+    """
+    JOURNAL_DIR.mkdir(parents=True, exist_ok=True)
+    linhas = "".join(
+        json.dumps({"ficha": ficha_id, "registro": registro}, ensure_ascii=False) + "\n"
+        for registro in registros
+    )
+    with trava_fichas():
+        with open(_journal_path(ficha_id), "ab") as f:
+            _travar(f, exclusiva=True)
+            try:
+                os.write(f.fileno(), linhas.encode("utf-8"))
+                os.fsync(f.fileno())
+                tamanho = os.fstat(f.fileno()).st_size
+            finally:
+                _destravar(f)
+    return tamanho >= limite
+
+
+def anexar_registro(ficha_id, registro):
+    return anexar_registros(ficha_id, [registro])
+
+
+def compactar():
+    """Incorpora os journals aos arquivos das fichas.
+
+    Só as fichas que têm journal são lidas e regravadas. A trava exclusiva
+    é usada duas vezes, e brevemente: para renomear os journals ativos (os
+    anexos seguintes vão para journals novos) e para confirmar o manifesto.
+    Ler e gravar os arquivos acontece no meio, sob a trava compartilhada,
+    sem bloquear os anexos.
+    """
+    with trava_fichas(exclusiva=True):
+        _incorporar_journals()
+        data = ler_snapshot() or {"sheets": []}
+        incorporando = _journals_incorporando(data)
+        if not incorporando:
+            # Outra sessão/processo já compactou: nada a regravar (além de
+            # apagar journals incorporados que tenham ficado para trás).
+            if data.get("incorporados"):
+                _salvar_snapshot(data)
+            return None
+        # Nova versão do manifesto: quem lê passa a considerar os renomeados.
+        _salvar_snapshot(data)
+        versao = versao_snapshot()
+
+    with trava_fichas():
+        if versao_snapshot() != versao:
+            return None
+        fichas_por_id = {ficha["id"]: ficha for ficha in data["sheets"]}
+        for caminho in incorporando:
+            entradas, _ = _ler_journal(caminho)
+            for ficha_id in {_id_da_entrada(entrada) for entrada in entradas}:
+                ficha = fichas_por_id.get(ficha_id)
+                if ficha is not None and "data" not in ficha:
+                    ficha["data"] = ler_registros_da_ficha(ficha)
+            _aplicar_entradas(data, fichas_por_id, entradas)
+        regravadas = _gravar_arquivos(data)
+
+    with trava_fichas(exclusiva=True):
+        if versao_snapshot() != versao:
+            # O snapshot foi regravado por outra sessão/processo; os journals
+            # continuam por incorporar e o próximo pedido refaz o trabalho.
+            for ficha in regravadas:
+                _payload_path(ficha).unlink(missing_ok=True)
+            return None
+        _confirmar(data, regravadas, incorporando)
+    return data
+
+
+def _mover_ficha(ficha_id, arquivada):
+    with trava_fichas(exclusiva=True):
+        data = ler_snapshot() or {"sheets": []}
+        ficha = next((ficha for ficha in data["sheets"] if ficha["id"] == ficha_id), None)
+        if ficha is None or bool(ficha.get("arquivada")) == arquivada:
+            return False
+        if "data" not in ficha:
+            ficha["data"] = ler_registros_da_ficha(ficha)
+        _incorporar_journals(ficha_id)
+        incorporando = _journals_incorporando(data, ficha_id)
+        for caminho in incorporando:
+            entradas, _ = _ler_journal(caminho)
+            ficha["data"].extend(entrada["registro"] for entrada in entradas)
+        ficha["arquivada"] = arquivada
+        _salvar_snapshot(data, incorporando)
+    return True
+
+
+def arquivar_ficha(ficha_id):
+    """Move os registros da ficha para o arquivo morto comprimido (gzip)."""
+    return _mover_ficha(ficha_id, True)
+
+
+def restaurar_ficha(ficha_id):
+    """Traz uma ficha arquivada de volta para a lista de fichas ativas."""
+    return _mover_ficha(ficha_id, False)
+
+
+class MemoriaStorage:
+    """Fichas mantidas apenas em memória, com índice id -> ficha.
+
+    Uma instância é compartilhada por todas as sessões do processo, por isso
+    todo acesso ao estado passa por `self._lock`.
+    """
+
+    def __init__(self, data=None):
+        self._lock = threading.RLock()
+        self._data = None
+        self._indice = {}
+        self._geracoes = {}
+        if data is not None:
+            self._definir_dados({"sheets": []})
+            self.importar(data)
+
+    def _definir_dados(self, data):
+        self._data = data
+        self._indice = {ficha["id"]: ficha for ficha in data["sheets"]}
+
+    def _sincronizar(self, ficha_id=None, todas=False):
+        pass
+
+    def carregar(self):
+        with self._lock:
+            self._sincronizar(todas=True)
+            return como_listas(self._data)
+
+    def listar_fichas(self):
+        """Ids das fichas ativas (as arquivadas ficam de fora), em ordem de criação."""
+        with self._lock:
+            self._sincronizar()
+            return [ficha["id"] for ficha in self._data["sheets"] if not ficha.get("arquivada")]
+
+    def listar_arquivadas(self):
+        with self._lock:
+            self._sincronizar()
+            return [ficha["id"] for ficha in self._data["sheets"] if ficha.get("arquivada")]
+
+    def nome_ficha(self, ficha_id):
+        with self._lock:
+            self._sincronizar()
+            ficha = self._indice.get(ficha_id)
+            return ficha["name"] if ficha else None
+
+    def nomes_fichas(self):
+        """Id -> nome de todas as fichas (inclusive arquivadas), em ordem de criação."""
+        with self._lock:
+            self._sincronizar()
+            return {ficha["id"]: ficha["name"] for ficha in self._data["sheets"]}
+
+    def manifesto(self):
+        """Id, nome, criação, nº de registros e situação de cada ficha, sem carregá-las."""
+        with self._lock:
+            self._sincronizar()
+            return [
+                {
+                    "id": ficha["id"],
+                    "name": ficha["name"],
+                    "created_at": ficha.get("created_at"),
+                    "registros": len(ficha["data"]) if "data" in ficha else ficha.get("registros", 0),
+                    "arquivada": bool(ficha.get("arquivada")),
+                }
+                for ficha in self._data["sheets"]
+            ]
+
+    def obter_ficha(self, ficha_id):
+        with self._lock:
+            self._sincronizar(ficha_id)
+            return self._indice.get(ficha_id)
+
+    def carregar_registros(self, ficha_id):
+        with self._lock:
+            ficha = self.obter_ficha(ficha_id)
+            return list(ficha["data"]) if ficha else []
+
+    def contar_registros(self, ficha_id):
+        with self._lock:
+            ficha = self.obter_ficha(ficha_id)
+            return len(ficha["data"]) if ficha else 0
+
+    def geracao(self, ficha_id):
+        """Muda quando os registros da ficha são regravados (e não só anexados)."""
+        with self._lock:
+            return self._geracoes.get(ficha_id, 0)
+
+    def registros_desde(self, ficha_id, inicio):
+        """Registros da ficha a partir da posição `inicio` (em ordem de gravação)."""
+        with self._lock:
+            ficha = self.obter_ficha(ficha_id)
+            return ficha["data"][inicio:] if ficha else []
+
+    def registros_apos(self, ficha_id, cursor=None):
+        """Registros gravados depois de `cursor` e o cursor para a próxima leitura.
+
+        O cursor é opaco (aqui, a posição); comece com None e recomece quando
+        a `geracao` da ficha mudar.
+        """
+        with self._lock:
+            registros = self.registros_desde(ficha_id, cursor or 0)
+            return registros, (cursor or 0) + len(registros)
+
+    def criar_ficha(self, nome_ficha):
+        """Cria uma ficha nova (nomes repetidos são permitidos) e a retorna."""
+        with self._lock:
+            ficha = nova_ficha(nome_ficha)
+            self._data["sheets"].append(ficha)
+            self._indice[ficha["id"]] = ficha
+            return ficha
+
+    def anexar_registro(self, ficha_id, registro):
+        self.anexar_registros(ficha_id, [registro])
+
+    def anexar_registros(self, ficha_id, registros):
+        with self._lock:
+            ficha = self.obter_ficha(ficha_id)
+            if ficha is None:
+                ficha = nova_ficha(ficha_id, ficha_id)
+                self._data["sheets"].append(ficha)
+                self._indice[ficha_id] = ficha
+            ficha["data"].extend(registros)
+
+    def importar(self, data):
+        """Acrescenta as fichas de `data`; as que têm id já existente recebem os registros."""
+        with self._lock:
+            for origem in data["sheets"]:
+                ficha = self._indice.get(origem.get("id"))
+                if ficha is None:
+                    ficha = nova_ficha(origem["name"], origem.get("id"))
+                    for chave in ("created_at", "arquivada"):
+                        if origem.get(chave) is not None:
+                            ficha[chave] = origem[chave]
+                    self._data["sheets"].append(ficha)
+                    self._indice[ficha["id"]] = ficha
+                ficha["data"].extend(origem["data"])
+
+    def arquivar_ficha(self, ficha_id):
+        with self._lock:
+            ficha = self._indice.get(ficha_id)
+            if ficha is None or ficha.get("arquivada"):
+                return False
+            ficha["arquivada"] = True
+            self._geracoes[ficha_id] = self._geracoes.get(ficha_id, 0) + 1
+            return True
+
+    def restaurar_ficha(self, ficha_id):
+        with self._lock:
+            ficha = self._indice.get(ficha_id)
+            if ficha is None or not ficha.get("arquivada"):
+                return False
+            ficha["arquivada"] = False
+            self._geracoes[ficha_id] = self._geracoes.get(ficha_id, 0) + 1
+            return True
+
+
+class JournalStorage(MemoriaStorage):
+    """Manifesto JSON + arquivo e journal por ficha (backend padrão).
+
+    O estado em memória é um espelho do disco: o manifesto é relido quando
+    muda de versão, os registros de uma ficha só são lidos quando ela é
+    consultada e, entre uma compactação e outra, só o final ainda não lido
+    do journal da ficha é aplicado.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._versao = None
+        self._offsets = {}
+        self._incorporando = {}
+        self._pedido_compactacao = threading.Event()
+        self._compactando = threading.Lock()
+        self._compactador = None
+
+    def _recarregar(self):
+        anteriores = self._indice
+        data = ler_snapshot() or {"sheets": []}
+        self._offsets = {}
+        self._definir_dados(data)
+        self._versao = versao_snapshot()
+        self._incorporando = {}
+        for caminho in _journals_incorporando(data):
+            self._incorporando.setdefault(_ficha_do_journal(caminho), []).append(caminho)
+        for ficha in data["sheets"]:
+            anterior = anteriores.get(ficha["id"])
+            if anterior is not None and "data" in anterior and "data" not in ficha:
+                self._reaproveitar(ficha, anterior["data"])
+        # Fichas que só existem no journal (anexos a uma ficha ainda não
+        # criada) também precisam aparecer na lista.
+        so_no_journal = (set(self._incorporando) | {caminho.stem for caminho in _journals_ativos()}) - set(self._indice)
+        for ficha_id in sorted(so_no_journal):
+            for caminho in self._journals_da_ficha(ficha_id):
+                self._ler_cauda(caminho)
+
+    def _journals_da_ficha(self, ficha_id):
+        return self._incorporando.get(ficha_id, []) + [_journal_path(ficha_id)]
+
+    def _reaproveitar(self, ficha, registros):
+        """Mantém os registros já lidos de uma ficha que só teve journals
+        renomeados ou incorporados ao arquivo (compactação), sem reler o
+        arquivo inteiro.
+
+        Vale quando a memória cobre todo o arquivo: o excedente são as
+        primeiras entradas dos journals da ficha, e a leitura deles continua
+        logo depois delas.
+        """
+        no_arquivo = ficha.get("registros", 0)
+        if ficha.get("arquivada") or len(registros) < no_arquivo:
+            return
+        posicoes = _posicoes_apos_entradas(self._journals_da_ficha(ficha["id"]), len(registros) - no_arquivo)
+        if posicoes is not None:
+            ficha["data"] = registros
+            self._offsets.update(posicoes)
+
+    def _carregar_ficha(self, ficha_id):
+        ficha = self._indice.get(ficha_id)
+        if ficha is not None and "data" not in ficha:
+            ficha["data"] = ler_registros_da_ficha(ficha)
+        for caminho in self._journals_da_ficha(ficha_id):
+            self._ler_cauda(caminho)
+
+    def _ler_cauda(self, caminho):
+        inicio = self._offsets.get(caminho, 0)
+        try:
+            if caminho.stat().st_size <= inicio:
+                return
+        except FileNotFoundError:
+            return
+        entradas, fim = _ler_journal(caminho, inicio)
+        _aplicar_entradas(self._data, self._indice, entradas)
+        self._offsets[caminho] = fim
+
+    def _sincronizar(self, ficha_id=None, todas=False):
+        with self._lock, trava_fichas():
+            if self._data is None or versao_snapshot() != self._versao:
+                self._recarregar()
+            if ficha_id is not None:
+                self._carregar_ficha(ficha_id)
+            elif todas:
+                for ficha in list(self._data["sheets"]):
+                    self._carregar_ficha(ficha["id"])
+
+    def _modificar(self, funcao):
+        with self._lock, trava_fichas(exclusiva=True):
+            _incorporar_journals()
+            data = _carregar_fichas_do_disco()
+            if data is None:
+                data = aplicar_journals({"sheets": []})
+            incorporando = _journals_incorporando(data)
+            funcao(data)
+            _salvar_snapshot(data, incorporando)
+            self._offsets = {}
+            self._incorporando = {}
+            self._definir_dados(data)
+            self._versao = versao_snapshot()
+
+    def criar_ficha(self, nome_ficha):
+        # Só o manifesto é regravado: nenhum registro precisa ser lido.
+        ficha = nova_ficha(nome_ficha)
+        with self._lock:
+            with trava_fichas(exclusiva=True):
+                data = ler_snapshot() or {"sheets": []}
+                data["sheets"].append(ficha)
+                _salvar_snapshot(data)
+                self._recarregar()
+            return self.obter_ficha(ficha["id"])
+
+    def anexar_registros(self, ficha_id, registros):
+        # Os registros chegam à memória pela leitura da cauda do journal, junto
+        # com o que outras sessões/processos tenham gravado.
+        compactar_journal = anexar_registros(ficha_id, registros, self._limite_do_journal(ficha_id))
+        # Daqui em diante os registros já estão no journal: uma falha ao agendar
+        # a compactação ou ao ler a cauda não pode levar quem chamou a gravá-los
+        # de novo. A próxima leitura sincroniza (e reporta o erro, se persistir).
+        try:
+            if compactar_journal:
+                self._agendar_compactacao()
+            self._sincronizar(ficha_id)
+        except Exception:
+            pass
+
+    def _limite_do_journal(self, ficha_id):
+        with self._lock:
+            ficha = self._indice.get(ficha_id)
+        try:
+            tamanho_ficha = _payload_path(ficha).stat().st_size if ficha else 0
+        except FileNotFoundError:
+            tamanho_ficha = 0
+        return max(JOURNAL_COMPACTAR_BYTES, tamanho_ficha * JOURNAL_COMPACTAR_FRACAO)
+
+    def _agendar_compactacao(self):
+        """Compacta em segundo plano; pedidos feitos enquanto uma compactação
+        está pendente ou em andamento viram uma só."""
+        self._pedido_compactacao.set()
+        with self._lock:
+            if self._compactador is None:
+                self._compactador = threading.Thread(target=self._compactar_em_segundo_plano, name="fichas-compactacao", daemon=True)
+                self._compactador.start()
+                # Ao sair, espera a compactação em andamento em vez de interrompê-la.
+                atexit.register(self._compactando.acquire)
+
+    def _compactar_em_segundo_plano(self):
+        while True:
+            self._pedido_compactacao.wait()
+            with self._compactando:
+                self._pedido_compactacao.clear()
+                try:
+                    compactar()
+                except Exception:
+                    # Os journals continuam íntegros; tenta de novo no próximo pedido.
+                    pass
+
+    def importar(self, data):
+        def _importar(atual):
+            memoria = MemoriaStorage()
+            memoria._definir_dados(atual)
+            memoria.importar(data)
+
+        self._modificar(_importar)
+
+    def arquivar_ficha(self, ficha_id):
+        with self._lock:
+            if not arquivar_ficha(ficha_id):
+                return False
+            self._geracoes[ficha_id] = self._geracoes.get(ficha_id, 0) + 1
+            return True
+
+    def restaurar_ficha(self, ficha_id):
+        with self._lock:
+            if not restaurar_ficha(ficha_id):
+                return False
+            self._geracoes[ficha_id] = self._geracoes.get(ficha_id, 0) + 1
+            return True
+
+
+class SQLiteStorage:
+    """Fichas e contagens em SQLite (WAL), com buscas por índice.
+
+    A ficha é identificada pela `chave` (o mesmo id do backend JSON); o id
+    inteiro fica só para as chaves estrangeiras. Fichas arquivadas saem da
+    tabela de registros e ficam comprimidas (JSON + zlib) na coluna
+    `arquivo` da própria ficha.
+    """
+
+    SCHEMA_SHEETS = """
+        CREATE TABLE IF NOT EXISTS {tabela} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chave TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            created_at REAL,
+            arquivada INTEGER NOT NULL DEFAULT 0,
+            arquivo BLOB,
+            arquivo_registros INTEGER
+        );
+    """
+
+    SCHEMA = SCHEMA_SHEETS.format(tabela="sheets") + """
+        CREATE TABLE IF NOT EXISTS registros (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sheet_id INTEGER NOT NULL REFERENCES sheets(id),
+            hora TEXT,
+            sku TEXT,
+            descricao TEXT,
+            barracao TEXT,
+            rua_inicial TEXT,
+            rua_final TEXT,
+            pallets INTEGER,
+            caixas_soltas INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_registros_sheet ON registros(sheet_id, id);
+        CREATE INDEX IF NOT EXISTS idx_registros_sku ON registros(sku);
+        CREATE INDEX IF NOT EXISTS idx_registros_local ON registros(barracao, rua_inicial, rua_final);
+    """
+
+    def __init__(self, caminho=SQLITE_FILE):
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        # O Streamlit executa cada sessão em uma thread própria.
+        self._local = threading.local()
+        conexao = self._conexao()
+        self._migrar_schema(conexao)
+        conexao.executescript(self.SCHEMA)
+
+    def _migrar_schema(self, conexao):
+        """Atualiza bancos criados quando o nome da ficha era a chave única."""
+        colunas = {linha["name"]: linha for linha in conexao.execute("PRAGMA table_info(sheets)")}
+        if not colunas or "chave" in colunas:
+            return
+        antigas = [coluna for coluna in ("arquivada", "arquivo", "arquivo_registros") if coluna in colunas]
+        fichas = conexao.execute(f"SELECT {', '.join(['id', 'name', 'created_at'] + antigas)} FROM sheets").fetchall()
+        conexao.execute("PRAGMA foreign_keys=OFF")
+        try:
+            with conexao:
+                conexao.execute(self.SCHEMA_SHEETS.format(tabela="sheets_nova"))
+                conexao.executemany(
+                    f"INSERT INTO sheets_nova (id, chave, name, created_at{''.join(', ' + c for c in antigas)}) "
+                    f"VALUES (?, ?, ?, ?{', ?' * len(antigas)})",
+                    (
+                        [ficha["id"], id_legado(ficha["name"]), ficha["name"], ficha["created_at"]]
+                        + [ficha[coluna] for coluna in antigas]
+                        for ficha in fichas
+                    ),
+                )
+                conexao.execute("DROP TABLE sheets")
+                conexao.execute("ALTER TABLE sheets_nova RENAME TO sheets")
+        finally:
+            conexao.execute("PRAGMA foreign_keys=ON")
+
+    def _conexao(self):
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=30)
+            conexao.row_factory = sqlite3.Row
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            conexao.execute("PRAGMA foreign_keys=ON")
+            self._local.conexao = conexao
+        return conexao
+
+    @contextmanager
+    def _transacao(self):
+        """Transação que já começa com a trava de escrita (BEGIN IMMEDIATE).
+
+        O que for lido dentro dela não muda até o commit.
+        """
+        conexao = self._conexao()
+        with conexao:
+            conexao.execute("BEGIN IMMEDIATE")
+            yield conexao
+
+    def _sheet_id(self, ficha_id):
+        linha = self._conexao().execute(
+            "SELECT id FROM sheets WHERE chave = ?", (ficha_id,)
+        ).fetchone()
+        return linha["id"] if linha else None
+
+    def _registro_de_linha(self, linha):
+        return {chave: linha[coluna] for coluna, chave in COLUNAS_REGISTRO}
+
+    def carregar(self):
+        return {
+            "sheets": [
+                dict(ficha, data=self.carregar_registros(ficha["id"]))
+                for ficha in self.manifesto()
+            ]
+        }
+
+    def listar_fichas(self):
+        return [linha["chave"] for linha in self._conexao().execute("SELECT chave FROM sheets WHERE NOT arquivada ORDER BY id")]
+
+    def listar_arquivadas(self):
+        return [linha["chave"] for linha in self._conexao().execute("SELECT chave FROM sheets WHERE arquivada ORDER BY id")]
+
+    def nome_ficha(self, ficha_id):
+        linha = self._conexao().execute("SELECT name FROM sheets WHERE chave = ?", (ficha_id,)).fetchone()
+        return linha["name"] if linha else None
+
+    def nomes_fichas(self):
+        return {linha["chave"]: linha["name"] for linha in self._conexao().execute("SELECT chave, name FROM sheets ORDER BY id")}
+
+    def manifesto(self):
+        cursor = self._conexao().execute(
+            "SELECT s.chave, s.name, s.created_at, s.arquivada, s.arquivo_registros, "
+            "(SELECT COUNT(*) FROM registros r WHERE r.sheet_id = s.id) AS registros "
+            "FROM sheets s ORDER BY s.id"
+        )
+        return [
+            {
+                "id": linha["chave"],
+                "name": linha["name"],
+                "created_at": linha["created_at"],
+                "registros": linha["arquivo_registros"] if linha["arquivada"] else linha["registros"],
+                "arquivada": bool(linha["arquivada"]),
+            }
+            for linha in cursor
+        ]
+
+    def _arquivo(self, ficha_id):
+        """Registros da ficha se ela estiver arquivada, senão None."""
+        linha = self._conexao().execute(
+            "SELECT arquivada, arquivo FROM sheets WHERE chave = ?", (ficha_id,)
+        ).fetchone()
+        if linha is None or not linha["arquivada"]:
+            return None
+        return json.loads(zlib.decompress(linha["arquivo"])) if linha["arquivo"] else []
+
+    def obter_ficha(self, ficha_id):
+        nome = self.nome_ficha(ficha_id)
+        if nome is None:
+            return None
+        return {"id": ficha_id, "name": nome, "data": self.carregar_registros(ficha_id)}
+
+    def carregar_registros(self, ficha_id):
+        return self.registros_desde(ficha_id, 0)
+
+    def contar_registros(self, ficha_id):
+        arquivo = self._arquivo(ficha_id)
+        if arquivo is not None:
+            return len(arquivo)
+        linha = self._conexao().execute(
+            "SELECT COUNT(*) AS total FROM registros WHERE sheet_id = ?",
+            (self._sheet_id(ficha_id),),
+        ).fetchone()
+        return linha["total"]
+
+    def geracao(self, ficha_id):
+        # Id do primeiro registro: arquivar/restaurar regrava as linhas com ids novos.
+        linha = self._conexao().execute(
+            "SELECT MIN(id) AS primeiro FROM registros WHERE sheet_id = ?", (self._sheet_id(ficha_id),)
+        ).fetchone()
+        return linha["primeiro"]
+
+    def registros_desde(self, ficha_id, inicio):
+        arquivo = self._arquivo(ficha_id)
+        if arquivo is not None:
+            return arquivo[inicio:]
+        colunas = ", ".join(coluna for coluna, _ in COLUNAS_REGISTRO)
+        cursor = self._conexao().execute(
+            f"SELECT {colunas} FROM registros WHERE sheet_id = ? ORDER BY id LIMIT -1 OFFSET ?",
+            (self._sheet_id(ficha_id), inicio),
+        )
+        return [self._registro_de_linha(linha) for linha in cursor]
+
+    def registros_apos(self, ficha_id, cursor=None):
+        """Como em `MemoriaStorage`, mas o cursor é o id do último registro lido.
+
+        A busca vai pelo índice (sheet_id, id), sem COUNT nem OFFSET, então
+        não cresce com o tamanho da ficha. Fichas arquivadas usam a posição.
+        """
+        arquivo = self._arquivo(ficha_id)
+        if arquivo is not None:
+            return arquivo[cursor or 0:], len(arquivo)
+        colunas = ", ".join(coluna for coluna, _ in COLUNAS_REGISTRO)
+        linhas = self._conexao().execute(
+            f"SELECT id, {colunas} FROM registros WHERE sheet_id = ? AND id > ? ORDER BY id",
+            (self._sheet_id(ficha_id), cursor or 0),
+        ).fetchall()
+        if not linhas:
+            return [], cursor
+        return [self._registro_de_linha(linha) for linha in linhas], linhas[-1]["id"]
+
+    def _inserir_ficha(self, conexao, ficha):
+        conexao.execute(
+            "INSERT INTO sheets (chave, name, created_at) VALUES (?, ?, ?)",
+            (ficha["id"], ficha["name"], ficha["created_at"]),
+        )
+
+    def criar_ficha(self, nome_ficha):
+        ficha = nova_ficha(nome_ficha)
+        with self._conexao() as conexao:
+            self._inserir_ficha(conexao, ficha)
+        return ficha
+
+    def _inserir_registros(self, conexao, sheet_id, registros):
+        colunas = ", ".join(coluna for coluna, _ in COLUNAS_REGISTRO)
+        marcadores = ", ".join("?" for _ in COLUNAS_REGISTRO)
+        conexao.executemany(
+            f"INSERT INTO registros (sheet_id, {colunas}) VALUES (?, {marcadores})",
+            ([sheet_id] + [registro.get(chave) for _, chave in COLUNAS_REGISTRO] for registro in registros),
+        )
+
+    def anexar_registro(self, ficha_id, registro):
+        self.anexar_registros(ficha_id, [registro])
+
+    def anexar_registros(self, ficha_id, registros):
+        # Busca e criação da ficha na mesma transação dos registros: duas
+        # sessões anexando a uma ficha nova não disputam o UNIQUE de `chave`.
+        with self._transacao() as conexao:
+            sheet_id = self._sheet_id(ficha_id)
+            if sheet_id is None:
+                self._inserir_ficha(conexao, nova_ficha(ficha_id, ficha_id))
+                sheet_id = self._sheet_id(ficha_id)
+            self._inserir_registros(conexao, sheet_id, registros)
+
+    def importar(self, data):
+        for origem in data["sheets"]:
+            ficha_id = origem.get("id")
+            with self._transacao() as conexao:
+                sheet_id = self._sheet_id(ficha_id) if ficha_id else None
+                if sheet_id is None:
+                    ficha = nova_ficha(origem["name"], ficha_id)
+                    if origem.get("created_at") is not None:
+                        ficha["created_at"] = origem["created_at"]
+                    self._inserir_ficha(conexao, ficha)
+                    ficha_id = ficha["id"]
+                    sheet_id = self._sheet_id(ficha_id)
+                self._inserir_registros(conexao, sheet_id, origem["data"])
+            if origem.get("arquivada"):
+                self.arquivar_ficha(ficha_id)
+
+    def arquivar_ficha(self, ficha_id):
+        # Leitura, gravação do arquivo e DELETE na mesma transação: um anexo
+        # concorrente espera o commit em vez de ser apagado sem ter sido arquivado.
+        with self._transacao():
+            sheet_id = self._sheet_id(ficha_id)
+            if sheet_id is None or self._arquivo(ficha_id) is not None:
+                return False
+            registros = self.carregar_registros(ficha_id)
+            arquivo = zlib.compress(json.dumps(registros, ensure_ascii=False).encode("utf-8"), 9)
+            conexao = self._conexao()
+            conexao.execute(
+                "UPDATE sheets SET arquivada = 1, arquivo = ?, arquivo_registros = ? WHERE id = ?",
+                (arquivo, len(registros), sheet_id),
+            )
+            conexao.execute("DELETE FROM registros WHERE sheet_id = ?", (sheet_id,))
+        return True
+
+    def restaurar_ficha(self, ficha_id):
+        with self._transacao():
+            registros = self._arquivo(ficha_id)
+            if registros is None:
+                return False
+            sheet_id = self._sheet_id(ficha_id)
+            conexao = self._conexao()
+            self._inserir_registros(conexao, sheet_id, registros)
+            conexao.execute(
+                "UPDATE sheets SET arquivada = 0, arquivo = NULL, arquivo_registros = NULL WHERE id = ?",
+                (sheet_id,),
+            )
+        return True
+
+
+BACKENDS = {
+    "json": JournalStorage,
+    "sqlite": SQLiteStorage,
+}
+
+
+def criar_storage(backend="json"):
+    try:
+        storage = BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Backend de fichas desconhecido: {backend!r}") from None
+
+    if backend == "sqlite" and not storage.nomes_fichas():
+        # Primeira execução com SQLite: migra as fichas já gravadas em JSON.
+        data = carregar_fichas_do_disco()
+        if data is not None:
+            storage.importar(data)
+    return storage
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import atexit
+import itertools
+import threading
+from collections import deque
+from pathlib import Path
+
+from metricas_desempenho import METRICAS
+
+# Onde ficam as contagens que não puderam ser gravadas até o processo encerrar.
+ARQUIVO_RESERVA = Path("db/contagens_nao_gravadas.jsonl")
+
+
+class FilaGravacao:
+    """Fila de contagens gravadas em lote por uma thread em segundo plano.
+
+    `enfileirar` só guarda o registro na memória e retorna na hora; a thread
+    grava os pendentes quando o lote enche (`tamanho_lote`) ou quando o mais
+    antigo espera há `intervalo` segundos. Os registros de uma mesma ficha no
+    lote viram um único `anexar_registros` (um write + fsync), e enquanto
+    ainda não foram gravados continuam visíveis em `pendentes_da_ficha`.
+
+    Um registro só é considerado gravado depois que o storage confirma a
+    escrita. Se ela falhar, o que ainda não foi gravado volta para o início
+    da fila e é tentado de novo, na mesma ordem. Ao encerrar o processo os
+    pendentes são gravados; se o storage continuar falhando, vão para
+    `arquivo_reserva` (no formato do journal) em vez de se perderem.
+
+    Os storages só levantam exceção em `anexar_registros` quando os
+    registros não foram gravados, de modo que uma nova tentativa nunca os
+    duplica.
+    """
+
+    def __init__(self, storage, tamanho_lote=50, intervalo=0.5, arquivo_reserva=ARQUIVO_RESERVA):
+        self.storage = storage
+        self.arquivo_reserva = Path(arquivo_reserva)
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self._fila = deque()
+        self._em_aberto = {}
+        self._por_ficha = {}
+        self._sequencia = itertools.count(1)
+        self._condicao = threading.Condition()
+        self._urgente = False
+        self._parar = False
+        self.gravados = 0
+        self.lotes = 0
+        self.ultimo_erro = None
+        self._thread = threading.Thread(target=self._executar, name="fila-gravacao", daemon=True)
+        self._thread.start()
+        atexit.register(self.parar)
+
+    def enfileirar(self, ficha_id, registro):
+        """Enfileira o registro e retorna o número de sequência dele."""
+        with self._condicao:
+            seq = next(self._sequencia)
+            self._fila.append((seq, ficha_id, registro, time.monotonic()))
+            self._em_aberto[seq] = ficha_id
+            self._por_ficha.setdefault(ficha_id, {})[seq] = registro
+            # Acorda a thread para começar a contar o prazo ou gravar o lote cheio.
+            if len(self._fila) == 1 or len(self._fila) >= self.tamanho_lote:
+                self._condicao.notify_all()
+        return seq
+
+    def pendente(self, seq):
+        with self._condicao:
+            return seq in self._em_aberto
+
+    def pendentes(self):
+        with self._condicao:
+            return len(self._em_aberto)
+
+    def pendentes_da_ficha(self, ficha_id):
+        """Registros da ficha ainda não gravados, na ordem em que chegaram."""
+        with self._condicao:
+            return list(self._por_ficha.get(ficha_id, {}).values())
+
+    def _concluir(self, ficha_id, itens):
+        # Chamado com self._condicao travada.
+        da_ficha = self._por_ficha.get(ficha_id, {})
+        for item in itens:
+            self._em_aberto.pop(item[0], None)
+            da_ficha.pop(item[0], None)
+        if not da_ficha:
+            self._por_ficha.pop(ficha_id, None)
+        self.gravados += len(itens)
+        self._condicao.notify_all()
+
+    def _proximo_lote(self):
+        with self._condicao:
+            while not self._fila and not self._parar:
+                self._condicao.wait()
+            if not self._fila:
+                return None
+            prazo = self._fila[0][3] + self.intervalo
+            while len(self._fila) < self.tamanho_lote and not (self._urgente or self._parar):
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                self._condicao.wait(restante)
+            return [self._fila.popleft() for _ in range(min(self.tamanho_lote, len(self._fila)))]
+
+    def _gravar(self, lote):
+        por_ficha = {}
+        for item in lote:
+            por_ficha.setdefault(item[1], []).append(item)
+
+        gravados = set()
+        try:
+            for ficha_id, itens in por_ficha.items():
+                registros = [item[2] for item in itens]
+                tamanho = lambda: len(json.dumps(registros, ensure_ascii=False).encode('utf-8'))
+                with METRICAS.medir("io.gravar_lote", tamanho):
+                    self.storage.anexar_registros(ficha_id, registros)
+                gravados.update(item[0] for item in itens)
+                with self._condicao:
+                    self._concluir(ficha_id, itens)
+        except Exception as e:
+            # Devolve o que não foi gravado ao início da fila, na ordem original.
+            with self._condicao:
+                self.ultimo_erro = e
+                self._fila.extendleft(reversed([item for item in lote if item[0] not in gravados]))
+            return False
+
+        with self._condicao:
+            self.lotes += 1
+            self.ultimo_erro = None
+        return True
+
+    def _executar(self):
+        falhas = 0
+        while True:
+            lote = self._proximo_lote()
+            if lote is None:
+                return
+            if self._gravar(lote):
+                falhas = 0
+                continue
+            falhas += 1
+            with self._condicao:
+                desistir = self._parar and falhas >= 3
+            if desistir:
+                self._salvar_reserva()
+                return
+            with self._condicao:
+                self._condicao.wait(min(5.0, self.intervalo * 2 ** falhas))
+
+    def _salvar_reserva(self):
+        """Desiste do storage: grava os pendentes em `arquivo_reserva`, para
+        recuperação manual, e avisa no stderr."""
+        with self._condicao:
+            itens = list(self._fila)
+            self._fila.clear()
+        if not itens:
+            return
+        linhas = "".join(
+            json.dumps({"ficha": item[1], "registro": item[2]}, ensure_ascii=False) + "\n" for item in itens
+        )
+        try:
+            self.arquivo_reserva.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.arquivo_reserva, "a", encoding="utf-8") as f:
+                f.write(linhas)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(f"{len(itens)} contagem(ns) não gravada(s) ({self.ultimo_erro}; reserva: {e}):\n{linhas}",
+                  file=sys.stderr, end="")
+            return
+        print(f"{len(itens)} contagem(ns) não gravada(s) ({self.ultimo_erro}) salvas em {self.arquivo_reserva}.",
+              file=sys.stderr)
+
+    def descarregar(self, timeout=None):
+        """Grava já o que estiver pendente e espera terminar; retorna True se não sobrou nada."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._condicao:
+            self._urgente = True
+            self._condicao.notify_all()
+            try:
+                while self._em_aberto and self._thread.is_alive():
+                    restante = None if limite is None else limite - time.monotonic()
+                    if restante is not None and restante <= 0:
+                        break
+                    self._condicao.wait(restante)
+                return not self._em_aberto
+            finally:
+                self._urgente = False
+
+    def parar(self, timeout=10.0):
+        with self._condicao:
+            self._parar = True
+            self._condicao.notify_all()
+        self._thread.join(timeout)
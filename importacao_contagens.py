@@ -0,0 +1,247 @@
+import re
+import datetime as dt
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from catalogo_produtos import normalizar_texto
+from registros_compactos import RegistrosCompactos
+
+# Linhas lidas, validadas e convertidas por vez.
+LINHAS_POR_BLOCO = 20_000
+# Rejeições guardadas para o relatório (as demais só entram na contagem).
+LIMITE_REJEICOES = 5_000
+
+# Cabeçalho normalizado (minúsculo, sem acento, só letras e números) -> campo do registro.
+ALIASES_COLUNAS = {
+    'hora': 'Hora',
+    'sku': 'SKU', 'codigo': 'SKU', 'cod': 'SKU', 'codigosku': 'SKU', 'ean': 'SKU', 'codigodebarras': 'SKU', 'codigobarras': 'SKU',
+    'barracao': 'Barracão',
+    'ruainicial': 'Rua Inicial', 'ruaini': 'Rua Inicial', 'rua': 'Rua Inicial',
+    'ruafinal': 'Rua Final', 'ruafim': 'Rua Final',
+    'pallets': 'Pallets', 'pallet': 'Pallets', 'palletstotais': 'Pallets', 'totaldepallets': 'Pallets',
+    'caixassoltas': 'Caixas Soltas', 'caixas': 'Caixas Soltas', 'cx': 'Caixas Soltas',
+}
+
+MOTIVO_SKU_VAZIO = "SKU vazio"
+MOTIVO_SKU_DESCONHECIDO = "SKU fora do catálogo"
+MOTIVO_QUANTIDADE_INVALIDA = "Quantidade inválida"
+MOTIVO_QUANTIDADE_ZERO = "Pallets e caixas zerados"
+MOTIVO_LOCAL_AUSENTE = "Barracão/Rua ausente"
+
+
+def _normalizar_cabecalho(nome):
+    return re.sub(r"[^0-9a-z]", "", normalizar_texto(nome if nome is not None else ""))
+
+
+def mapear_colunas(cabecalho):
+    """Nome da coluna no arquivo -> campo do registro (a primeira de cada campo vale)."""
+    mapa = {}
+    for coluna in cabecalho:
+        campo = ALIASES_COLUNAS.get(_normalizar_cabecalho(coluna))
+        if campo is not None and campo not in mapa.values():
+            mapa[coluna] = campo
+    return mapa
+
+
+def _separador(inicio):
+    primeira_linha = inicio.split("\n", 1)[0]
+    return ";" if primeira_linha.count(";") >= primeira_linha.count(",") else ","
+
+
+def _blocos_csv(arquivo, linhas_por_bloco):
+    if isinstance(arquivo, (str, Path)):
+        with open(arquivo, "rb") as f:
+            inicio = f.read(65536)
+    else:
+        inicio = arquivo.read(65536)
+        arquivo.seek(0)
+    sep = _separador(inicio.decode("utf-8-sig", errors="ignore"))
+    leitor = pd.read_csv(arquivo, sep=sep, dtype=str, keep_default_na=False, encoding="utf-8-sig", chunksize=linhas_por_bloco)
+    with leitor:
+        yield from leitor
+
+
+def _blocos_xlsx(arquivo, linhas_por_bloco):
+    # read_only: as linhas são lidas do XML conforme iteradas, sem carregar a planilha.
+    workbook = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        linhas = workbook.active.iter_rows(values_only=True)
+        cabecalho = [str(valor) if valor is not None else f"coluna_{i}" for i, valor in enumerate(next(linhas, ()))]
+        while True:
+            bloco = list(islice(linhas, linhas_por_bloco))
+            if not bloco:
+                break
+            yield pd.DataFrame([linha[:len(cabecalho)] for linha in bloco], columns=cabecalho, dtype=object)
+    finally:
+        workbook.close()
+
+
+def ler_blocos(arquivo, nome=None, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """DataFrames com `linhas_por_bloco` linhas do CSV/XLSX, na ordem do arquivo."""
+    nome = nome or str(arquivo)
+    if nome.lower().endswith((".xlsx", ".xlsm")):
+        return _blocos_xlsx(arquivo, linhas_por_bloco)
+    if nome.lower().endswith((".csv", ".txt")):
+        return _blocos_csv(arquivo, linhas_por_bloco)
+    raise ValueError(f"Formato não suportado: {nome} (use CSV ou XLSX).")
+
+
+def _texto(valores):
+    """Coluna como texto sem espaços nas pontas; números inteiros viram "12", não "12.0"."""
+    valores = pd.Series(valores)
+    if pd.api.types.is_string_dtype(valores.dtype) and valores.dtype != object:
+        # CSV: a coluna já é texto e a limpeza é vetorizada.
+        return valores.fillna('').str.strip().to_numpy(dtype=object)
+    return np.array([
+        '' if valor is None or (isinstance(valor, float) and np.isnan(valor))
+        else str(int(valor)) if isinstance(valor, float) and valor.is_integer()
+        else str(valor).strip()
+        for valor in valores.tolist()
+    ], dtype=object)
+
+
+def _ruas(valores):
+    # Ruas numéricas seguem o formato da tela ("01", "02", ...).
+    return [f"{int(valor):02}" if valor.isdigit() else valor for valor in _texto(valores)]
+
+
+def _horas(valores, padrao):
+    horas = []
+    for valor in valores:
+        if isinstance(valor, (dt.time, dt.datetime)):
+            horas.append(valor.strftime("%H:%M:%S"))
+        elif isinstance(valor, str) and re.fullmatch(r"\d{2}:\d{2}:\d{2}", valor.strip()):
+            horas.append(valor.strip())
+        else:
+            horas.append(padrao)
+    return horas
+
+
+def _quantidades(bloco, coluna, tamanho):
+    """(valores int64, inválidos) da coluna; vazia ou ausente conta como 0."""
+    if coluna is None:
+        return np.zeros(tamanho, dtype='int64'), np.zeros(tamanho, dtype=bool)
+    texto = pd.Series(_texto(bloco[coluna]), dtype=object).str.replace(',', '.', regex=False)
+    numeros = pd.to_numeric(texto.replace('', '0'), errors='coerce').to_numpy(dtype='float64')
+    invalidos = np.isnan(numeros) | (numeros < 0) | (np.nan_to_num(numeros) % 1 != 0)
+    return np.where(invalidos, 0, np.nan_to_num(numeros)).astype('int64'), invalidos
+
+
+def validar_bloco(bloco, colunas, indice_produtos, padroes, primeira_linha):
+    """Valida um bloco inteiro de uma vez.
+
+    Retorna (colunas dos registros aceitos, rejeições); cada rejeição traz
+    a linha do arquivo, o motivo e os valores lidos.
+    """
+    tamanho = len(bloco)
+    por_campo = {campo: coluna for coluna, campo in colunas.items()}
+
+    skus = _texto(bloco[por_campo['SKU']])
+    posicoes = indice_produtos.posicoes(skus)
+    pallets, pallets_invalidos = _quantidades(bloco, por_campo.get('Pallets'), tamanho)
+    caixas, caixas_invalidas = _quantidades(bloco, por_campo.get('Caixas Soltas'), tamanho)
+
+    def local(campo):
+        if campo in por_campo:
+            valores = _ruas(bloco[por_campo[campo]]) if campo.startswith('Rua') else _texto(bloco[por_campo[campo]])
+            padrao = padroes.get(campo) or ''
+            return np.array([valor or padrao for valor in valores], dtype=object)
+        return np.full(tamanho, padroes.get(campo) or '', dtype=object)
+
+    barracoes = np.array([barracao.upper() for barracao in local('Barracão')], dtype=object)
+    ruas_iniciais = local('Rua Inicial')
+    if 'Rua Final' in por_campo or 'Rua Inicial' not in por_campo:
+        ruas_finais = local('Rua Final')
+        ruas_finais = np.where(ruas_finais == '', ruas_iniciais, ruas_finais)
+    else:
+        # Arquivo com uma rua só: a contagem é daquela rua.
+        ruas_finais = ruas_iniciais
+
+    motivos = np.select(
+        [
+            skus == '',
+            posicoes < 0,
+            pallets_invalidos | caixas_invalidas,
+            (pallets == 0) & (caixas == 0),
+            (barracoes == '') | (ruas_iniciais == ''),
+        ],
+        [MOTIVO_SKU_VAZIO, MOTIVO_SKU_DESCONHECIDO, MOTIVO_QUANTIDADE_INVALIDA, MOTIVO_QUANTIDADE_ZERO, MOTIVO_LOCAL_AUSENTE],
+        default='',
+    )
+    aceitos = motivos == ''
+
+    df = indice_produtos.df
+    posicoes_aceitas = posicoes[aceitos]
+    horas = _horas(bloco[por_campo['Hora']], padroes['Hora']) if 'Hora' in por_campo else [padroes['Hora']] * tamanho
+    registros = {
+        'Hora': np.asarray(horas, dtype=object)[aceitos],
+        'SKU': df['codigo'].to_numpy(dtype=object)[posicoes_aceitas],
+        'Descrição': df['descricao'].to_numpy(dtype=object)[posicoes_aceitas],
+        'Barracão': barracoes[aceitos],
+        'Rua Inicial': ruas_iniciais[aceitos],
+        'Rua Final': ruas_finais[aceitos],
+        'Pallets': pallets[aceitos],
+        'Caixas Soltas': caixas[aceitos],
+    }
+
+    rejeicoes = bloco.loc[~aceitos].copy()
+    rejeicoes.insert(0, 'Motivo', motivos[~aceitos])
+    rejeicoes.insert(0, 'Linha', np.flatnonzero(~aceitos) + primeira_linha)
+    return registros, rejeicoes
+
+
+def importar_contagens(storage, ficha_id, arquivo, indice_produtos, nome=None, padroes=None, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """Importa as contagens de um CSV/XLSX para a ficha.
+
+    O arquivo é lido e validado em blocos; só os registros aceitos ficam em
+    memória (em `RegistrosCompactos`) e vão para o storage em uma única
+    gravação (uma escrita no journal ou uma transação no SQLite): ou a
+    importação entra inteira, ou nada entra.
+
+    `padroes` completa Barracão, Rua Inicial e Rua Final quando o arquivo
+    não os tem, e dá a Hora das linhas sem hora (padrão: agora).
+    Retorna {"importados", "rejeitados", "rejeicoes"}; "rejeicoes" é um
+    DataFrame com as primeiras `LIMITE_REJEICOES` linhas rejeitadas.
+    """
+    padroes = dict(padroes or {})
+    padroes.setdefault('Hora', dt.datetime.now().strftime("%H:%M:%S"))
+
+    aceitos = RegistrosCompactos()
+    rejeicoes = []
+    rejeitados = 0
+    guardadas = 0
+    proxima_linha = 2  # linha 1 é o cabeçalho
+    colunas = None
+
+    for bloco in ler_blocos(arquivo, nome, linhas_por_bloco):
+        if colunas is None:
+            colunas = mapear_colunas(bloco.columns)
+            campos = set(colunas.values())
+            if 'SKU' not in campos:
+                raise ValueError("O arquivo não tem coluna de SKU.")
+            if not campos & {'Pallets', 'Caixas Soltas'}:
+                raise ValueError("O arquivo não tem coluna de Pallets nem de Caixas Soltas.")
+        registros, rejeitadas = validar_bloco(bloco, colunas, indice_produtos, padroes, proxima_linha)
+        aceitos.estender_colunas(registros)
+        rejeitados += len(rejeitadas)
+        if guardadas < LIMITE_REJEICOES and len(rejeitadas):
+            rejeicoes.append(rejeitadas.head(LIMITE_REJEICOES - guardadas))
+            guardadas += len(rejeicoes[-1])
+        proxima_linha += len(bloco)
+
+    if len(aceitos):
+        storage.anexar_registros(ficha_id, aceitos)
+
+    return {
+        "importados": len(aceitos),
+        "rejeitados": rejeitados,
+        "rejeicoes": pd.concat(rejeicoes, ignore_index=True) if rejeicoes else pd.DataFrame(columns=['Linha', 'Motivo']),
+    }
+
+
+def gerar_csv_rejeicoes(rejeicoes):
+    return rejeicoes.to_csv(index=False, sep=';').encode('utf-8')
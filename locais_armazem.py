@@ -0,0 +1,186 @@
+import json
+import threading
+from array import array
+from itertools import chain
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Mapa do armazém; sem o arquivo, vale o layout padrão abaixo.
+LOCAIS_JSON = Path("db/locais.json")
+
+BARRACOES_PADRAO = ["A", "B", "C", "D", "E"]
+RUAS_POR_BARRACAO = 30
+POSICOES_POR_RUA = 1
+
+
+def ruas_sequenciais(quantidade):
+    return [f"{i:02}" for i in range(1, quantidade + 1)]
+
+
+class MapaArmazem:
+    """Barracão -> rua -> posições, com um índice de locais pré-calculado.
+
+    Cada rua de cada barracão vira um local numerado de 0 a N-1, com as ruas
+    de um mesmo barracão em sequência. Uma faixa "Rua Inicial a Rua Final" é,
+    então, um intervalo [início, fim] desses números, e perguntas como "quais
+    registros cobrem a rua 05 do barracão B" viram comparações de inteiros.
+
+    `barracoes` é uma lista de (nome, ruas, posições por rua).
+    """
+
+    def __init__(self, barracoes):
+        self.barracoes = []
+        self.locais = []
+        self._ruas = {}
+        self._faixas = {}
+        self._numeros = {}
+        posicoes = []
+        for nome, ruas, posicoes_por_rua in barracoes:
+            if nome in self._ruas:
+                raise ValueError(f"Barracão repetido no mapa: {nome}")
+            if len(set(ruas)) != len(ruas):
+                raise ValueError(f"Rua repetida no barracão {nome}.")
+            inicio = len(self.locais)
+            self.barracoes.append(nome)
+            self._ruas[nome] = list(ruas)
+            self._faixas[nome] = (inicio, inicio + len(ruas))
+            for rua in ruas:
+                self._numeros[(nome, rua)] = len(self.locais)
+                self.locais.append((nome, rua))
+                posicoes.append(posicoes_por_rua)
+        self.posicoes = np.array(posicoes, dtype='int64')
+
+    def __len__(self):
+        return len(self.locais)
+
+    def ruas(self, barracao):
+        return self._ruas.get(barracao, [])
+
+    def faixa(self, barracao):
+        """Números [início, fim) dos locais do barracão."""
+        return self._faixas.get(barracao, (0, 0))
+
+    def numero(self, barracao, rua):
+        """Número do local, ou -1 se o barracão/rua não estiver no mapa."""
+        return self._numeros.get((barracao, rua), -1)
+
+    def intervalo(self, barracao, rua_inicial, rua_final=None):
+        """(início, fim) inclusivo dos locais da faixa de ruas, ou None fora do mapa.
+
+        Uma faixa informada ao contrário (final antes da inicial) é desinvertida.
+        """
+        inicio = self.numero(barracao, rua_inicial)
+        fim = self.numero(barracao, rua_final if rua_final else rua_inicial)
+        if inicio < 0 or fim < 0:
+            return None
+        return (inicio, fim) if inicio <= fim else (fim, inicio)
+
+
+def mapa_padrao():
+    return MapaArmazem([(nome, ruas_sequenciais(RUAS_POR_BARRACAO), POSICOES_POR_RUA) for nome in BARRACOES_PADRAO])
+
+
+def carregar_mapa(caminho=LOCAIS_JSON):
+    """Mapa do `locais.json`, ou o padrão (A a E, 30 ruas) se ele não existir.
+
+    Formato:
+        {"barracoes": [
+            {"nome": "A", "ruas": 30, "posicoes": 12},
+            {"nome": "F", "ruas": ["01", "02", "03A"], "posicoes": 8}
+        ]}
+    `ruas` é a quantidade (ruas "01", "02", ...) ou a lista das ruas, em ordem.
+    """
+    caminho = Path(caminho)
+    if not caminho.exists():
+        return mapa_padrao()
+    with open(caminho, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    barracoes = []
+    for barracao in config.get("barracoes", []):
+        ruas = barracao.get("ruas", RUAS_POR_BARRACAO)
+        ruas = ruas_sequenciais(ruas) if isinstance(ruas, int) else [str(rua) for rua in ruas]
+        barracoes.append((str(barracao["nome"]), ruas, int(barracao.get("posicoes", POSICOES_POR_RUA))))
+    if not barracoes:
+        raise ValueError(f"Nenhum barracão em {caminho}.")
+    return MapaArmazem(barracoes)
+
+
+class CoberturaLocais:
+    """Registros por local do mapa, atualizados a cada registro anexado.
+
+    Cada registro guarda o intervalo de locais que cobre (ou -1 fora do
+    mapa) e entra num array de diferenças: anexar custa O(1) por registro e
+    a contagem por local sai de uma soma acumulada em O(locais), sem
+    percorrer os registros. Os intervalos por registro servem às consultas
+    por faixa de ruas (`registros_na_faixa`).
+    """
+
+    def __init__(self, mapa):
+        self.mapa = mapa
+        self._lock = threading.Lock()
+        self.inicios = array('i')
+        self.fins = array('i')
+        self._diferencas = np.zeros(len(mapa) + 1, dtype='int64')
+        self.fora_do_mapa = 0
+
+    def anexar_colunas(self, colunas):
+        """Anexa registros dados como colunas (Barracão, Rua Inicial, Rua Final)."""
+        faixas = list(zip(colunas['Barracão'], colunas['Rua Inicial'], colunas['Rua Final']))
+        if not faixas:
+            return
+        # Poucas faixas distintas se repetem em muitos registros: cada uma é resolvida uma vez.
+        intervalos = {faixa: self.mapa.intervalo(*faixa) or (-1, -1) for faixa in set(faixas)}
+        pares = np.fromiter(chain.from_iterable(map(intervalos.__getitem__, faixas)), dtype='int32', count=2 * len(faixas))
+        inicios, fins = pares[0::2], pares[1::2]
+        no_mapa = inicios >= 0
+        with self._lock:
+            self.inicios.frombytes(inicios.tobytes())
+            self.fins.frombytes(fins.tobytes())
+            self._diferencas += np.bincount(inicios[no_mapa], minlength=len(self._diferencas))
+            self._diferencas -= np.bincount(fins[no_mapa] + 1, minlength=len(self._diferencas))
+            self.fora_do_mapa += int((~no_mapa).sum())
+
+    def registros_por_local(self):
+        """Quantos registros cobrem cada local (na ordem de `mapa.locais`)."""
+        with self._lock:
+            return np.cumsum(self._diferencas[:-1])
+
+    def registros_na_faixa(self, barracao, rua_inicial, rua_final=None):
+        """Posições dos registros cuja faixa de ruas se sobrepõe à informada."""
+        intervalo = self.mapa.intervalo(barracao, rua_inicial, rua_final)
+        if intervalo is None:
+            return np.empty(0, dtype='int64')
+        with self._lock:
+            inicios = np.frombuffer(self.inicios, dtype='int32')
+            fins = np.frombuffer(self.fins, dtype='int32')
+            return np.flatnonzero((inicios >= 0) & (inicios <= intervalo[1]) & (fins >= intervalo[0]))
+
+    def progresso(self, barracao=None):
+        """Uma linha por rua (do barracão, ou de todos): registros e se já foi contada."""
+        contagens = self.registros_por_local()
+        inicio, fim = self.mapa.faixa(barracao) if barracao is not None else (0, len(self.mapa))
+        locais = self.mapa.locais[inicio:fim]
+        return pd.DataFrame({
+            'Barracão': [local[0] for local in locais],
+            'Rua': [local[1] for local in locais],
+            'Posições': self.mapa.posicoes[inicio:fim],
+            'Registros': contagens[inicio:fim],
+            'Contada': contagens[inicio:fim] > 0,
+        })
+
+    def resumo_por_barracao(self):
+        """Ruas e posições contadas por barracão."""
+        contadas = self.registros_por_local() > 0
+        linhas = []
+        for barracao in self.mapa.barracoes:
+            inicio, fim = self.mapa.faixa(barracao)
+            linhas.append({
+                'Barracão': barracao,
+                'Ruas': fim - inicio,
+                'Ruas contadas': int(contadas[inicio:fim].sum()),
+                'Posições': int(self.mapa.posicoes[inicio:fim].sum()),
+                'Posições contadas': int(self.mapa.posicoes[inicio:fim][contadas[inicio:fim]].sum()),
+            })
+        return pd.DataFrame(linhas, columns=['Barracão', 'Ruas', 'Ruas contadas', 'Posições', 'Posições contadas'])
@@ -3,135 +3,196 @@ import os
 import pandas as pd
 from datetime import datetime
 import json
-from pathlib import Path
 
-FICHA_FILE = Path("db/ficha_contagem.json")
-DEFAULT_FICHA_STRUCTURE = {
-    "sheets": [
-        {"name": "Ficha de Exemplo 1 (Padrão)", "data": []}
-    ]
-}
+import fichas_storage
+import catalogo_produtos
+import nucleo_contagem
+from registros_tabela import COLUNAS_TABELA
+from importacao_contagens import gerar_csv_rejeicoes
+from comparacao_fichas import resumo_comparacao, STATUS_ADICIONADO, STATUS_REMOVIDO, STATUS_ALTERADO, STATUS_IGUAL
+from progresso_contagem import grade_locais
+from totais_contagem import adicionar_totais, COLUNA_TOTAL_CAIXAS, COLUNA_TOTAL_UNIDADES
+from metricas_desempenho import METRICAS, DUMP_JSON, DUMP_PROMETHEUS
+
+FICHAS_BACKEND = os.environ.get("FICHAS_BACKEND", "json")
+# "lote": contagens vão para uma fila gravada em segundo plano; "direta": grava no envio.
+FICHAS_GRAVACAO = os.environ.get("FICHAS_GRAVACAO", "lote")
+
+def _tamanho_arquivo(caminho):
+    try:
+        return os.path.getsize(caminho)
+    except OSError:
+        return 0
 
+@METRICAS.cronometrar("io.load_fichas_from_disk", tamanho=lambda _: _tamanho_arquivo(
+    fichas_storage.SQLITE_FILE if FICHAS_BACKEND == "sqlite" else fichas_storage.FICHA_FILE))
 def _load_fichas_from_disk():
-    if FICHA_FILE.exists() and FICHA_FILE.stat().st_size > 0:
-        try:
-            with open(FICHA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            st.warning("⚠️ Erro ao decodificar ficha_contagem.json. O arquivo pode estar corrompido. Usando dados padrão.", icon="⚠️")
-            return DEFAULT_FICHA_STRUCTURE
-        except Exception as e:
-            st.error(f"❌ Erro ao carregar o arquivo de fichas ({e}). Usando dados padrão.", icon="❌")
-            return DEFAULT_FICHA_STRUCTURE
-    
-    _save_fichas_to_disk(DEFAULT_FICHA_STRUCTURE)
-    return DEFAULT_FICHA_STRUCTURE
+    return nucleo_contagem.abrir_storage(FICHAS_BACKEND)
 
-def _save_fichas_to_disk(data):
+def exigir_fichas():
+    """Interrompe o rerun se as fichas não abrirem.
+
+    Nada fica em cache nesse caso (nem um storage só em memória, que perderia
+    as contagens): o próximo rerun tenta abrir de novo.
+    """
     try:
-        with open(FICHA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        get_nucleo()
+        return
+    except json.JSONDecodeError:
+        st.error("❌ Erro ao decodificar ficha_contagem.json. O arquivo pode estar corrompido.", icon="❌")
     except Exception as e:
-        st.error(f"❌ Erro ao salvar o arquivo de fichas: {e}", icon="❌")
+        st.error(f"❌ Erro ao carregar o arquivo de fichas ({e}).", icon="❌")
+    st.info("Nenhuma contagem pode ser registrada até o arquivo ser corrigido (ou restaurado de um backup). Depois, recarregue a página.")
+    st.stop()
 
-if 'fichas_data' not in st.session_state:
-    st.session_state.fichas_data = _load_fichas_from_disk()
+def _append_registro_to_disk(ficha_id, registro):
+    """Número do registro na fila de gravação, None se já foi gravado ou False se falhou."""
+    tamanho = lambda: len(json.dumps(registro, ensure_ascii=False).encode('utf-8'))
+    try:
+        with METRICAS.medir("io.append_registro_to_disk", tamanho):
+            seq = get_nucleo().registrar(ficha_id, registro)
+            if seq is not None:
+                st.session_state.setdefault('gravacoes_pendentes', []).append(seq)
+    except Exception as e:
+        st.error(f"❌ Erro ao salvar o registro de contagem: {e}", icon="❌")
+        return False
+    return seq
 
-def carregar_fichas():
-    return st.session_state.fichas_data
+def situacao_gravacao(seq):
+    return "registrado e salvo!" if seq is None else f"enfileirado para gravação (#{seq})."
 
-def salvar_fichas(data):
-    st.session_state.fichas_data = data
-    _save_fichas_to_disk(data)
+@st.cache_resource
+def get_nucleo():
+    # Um único núcleo por processo, compartilhado por todas as sessões; cada
+    # sessão guarda apenas o id da ficha selecionada.
+    return nucleo_contagem.NucleoContagem(_load_fichas_from_disk(), carregar_dados_produtos, gravacao=FICHAS_GRAVACAO)
 
+def carregar_fichas():
+    return get_nucleo().storage
+
+def get_fila_gravacao():
+    return get_nucleo().fila
+
+def registros_pendentes(ficha_id):
+    return get_nucleo().registros_pendentes(ficha_id)
+
+def indicador_gravacao():
+    if FICHAS_GRAVACAO != "lote":
+        return
+    fila = get_fila_gravacao()
+    pendentes = [seq for seq in st.session_state.get('gravacoes_pendentes', []) if fila.pendente(seq)]
+    st.session_state.gravacoes_pendentes = pendentes
+    if fila.ultimo_erro is not None:
+        st.warning(f"⚠️ Falha ao gravar as contagens ({fila.ultimo_erro}). Tentando novamente: {len(pendentes)} pendente(s) nesta sessão.")
+    elif pendentes:
+        st.caption(f"⏳ {len(pendentes)} contagem(ns) aguardando gravação.")
+    else:
+        st.caption("✅ Todas as contagens desta sessão estão gravadas.")
 
 def criar_ficha(nome):
-    return {"name": nome, "data": []}
+    try:
+        return get_nucleo().criar_ficha(nome)
+    except Exception as e:
+        st.error(f"❌ Erro ao salvar o arquivo de fichas: {e}", icon="❌")
+        return None
 
 def listar_fichas():
-    return [sheet["name"] for sheet in carregar_fichas()["sheets"]]
+    return get_nucleo().listar_fichas()
 
-BARRACAO_OPCOES = ["A", "B", "C", "D", "E"]
+def nomes_das_fichas():
+    return get_nucleo().nomes_das_fichas()
 
-def carregar_dados_produtos():
-    caminho_produtos = "db/dbItens.csv" 
-    
+def nome_ficha(ficha_id):
+    return get_nucleo().nome_ficha(ficha_id)
+
+def carregar_registros(ficha_id):
+    return carregar_fichas().carregar_registros(ficha_id)
+
+def contar_registros(ficha_id):
+    return get_nucleo().contar_registros(ficha_id)
+
+def arquivar_ficha(ficha_id):
     try:
-        if os.path.exists(caminho_produtos):
-             df = pd.read_csv(caminho_produtos, sep=';')
-             if df.empty:
-                raise ValueError("CSV de produtos vazio.")
-             return df
-        else:
-            st.warning(f"Arquivo '{caminho_produtos}' não encontrado. Usando dados mock para produtos.", icon="📁")
-            mock_data = {
-                'codigo': [1001, 1002, 2005, 3010, 4001, 5002],
-                'descricao': ['Leite Integral UHT 1L', 'Creme de Leite 200g', 'Queijo Mussarela 5kg', 'Manteiga Extra 500g', 'Iogurte Natural 1L', 'Bebida Láctea TP 1L'],
-                'marca': ['Marca A', 'Marca A', 'Marca B', 'Marca C', 'Marca B', 'Marca C'],
-                'tipo': ['Líquido', 'Cremoso', 'Sólido', 'Sólido', 'Líquido', 'Líquido'],
-                'qtd_por_pallet': [1008, 1200, 100, 1500, 960, 1100],
-                'qtd_por_camada': [126, 150, 10, 100, 120, 110],
-                'qtd_por_caixa': [12, 24, 1, 30, 8, 12],
-                'codigo_amarracao_imagem': [1, 2, 3, 4, 5, 6]
-            }
-            return pd.DataFrame(mock_data)
-
-    except pd.errors.ParserError as e:
-        st.error(f"❌ Erro ao carregar dados: Verifique se o arquivo CSV '{caminho_produtos}' está formatado corretamente. Detalhes: {e}")
-        return pd.DataFrame()
+        return get_nucleo().arquivar_ficha(ficha_id)
+    except Exception as e:
+        st.error(f"❌ Erro ao arquivar a ficha: {e}", icon="❌")
+        return False
+
+def restaurar_ficha(ficha_id):
+    try:
+        return get_nucleo().restaurar_ficha(ficha_id)
     except Exception as e:
-        st.error(f"❌ Erro geral ao carregar produtos: {e}")
-        return pd.DataFrame()
+        st.error(f"❌ Erro ao restaurar a ficha: {e}", icon="❌")
+        return False
+
+def tabela_ficha_atual():
+    return get_nucleo().tabela(st.session_state.ficha_atual)
+
+REGISTROS_POR_PAGINA = 100
+
+@METRICAS.cronometrar("io.carregar_dados_produtos", tamanho=lambda _: _tamanho_arquivo(catalogo_produtos.PRODUTOS_CSV))
+def carregar_dados_produtos():
+    # Também roda na thread que observa o CSV: erros sobem para o CatalogoVivo,
+    # e os avisos ficam para aviso_catalogo(), na thread do script.
+    return nucleo_contagem.carregar_produtos(catalogo_produtos.PRODUTOS_CSV)
+
 
+# Recarrega o dbItens.csv em segundo plano quando ele muda, sem reiniciar o
+# servidor e sem bloquear o rerun de quem está contando.
+def get_catalogo():
+    return get_nucleo().catalogo
 
-@st.cache_data
-def get_produtos_df():
-    return carregar_dados_produtos()
 
+def aviso_catalogo():
+    caminho_produtos = str(catalogo_produtos.PRODUTOS_CSV)
+    erro = get_catalogo().ultimo_erro
+    if erro is not None:
+        st.error(f"❌ Erro ao carregar o catálogo '{caminho_produtos}': {erro}. Mantido o último catálogo válido.")
+    elif not os.path.exists(caminho_produtos):
+        st.warning(f"Arquivo '{caminho_produtos}' não encontrado. Usando dados mock para produtos.", icon="📁")
+
+
+def indice_produtos_atual():
+    return get_catalogo().atual()
 
 def configure_page():
     st.set_page_config(layout="wide", page_title="Stock Fast Laticínio")
-    st.title("🥛 Contagem de Estoque")
     st.markdown("---")
 
 
 def criar_nova_ficha():
-    fichas_data = carregar_fichas()
-    nome_ficha = f"Contagem - {datetime.now().strftime('%d/%m/%Y | %H:%M')}"
-    nova_ficha = criar_ficha(nome_ficha)
-    fichas_data["sheets"].append(nova_ficha)
-    salvar_fichas(fichas_data)
+    nome_ficha = nucleo_contagem.nome_nova_ficha()
+    ficha = criar_ficha(nome_ficha)
+    if ficha is None:
+        return
     
     st.session_state.fichas_lista = listar_fichas()
-    st.session_state.ficha_atual = nome_ficha
-    
-    st.session_state.contagens_registradas = [] 
+    st.session_state.ficha_atual = ficha["id"]
     
     st.toast(f"Ficha '{nome_ficha}' criada com sucesso!", icon="✅", duration=3)
 
 
+@METRICAS.cronometrar("secao.ficha_management")
 def ficha_management():
     st.subheader("Gerenciamento de Fichas")
     
     st.session_state.fichas_lista = listar_fichas()
         
-    fichas_data = carregar_fichas()
     fichas_lista = st.session_state.fichas_lista
+    nomes = nomes_das_fichas()
 
     if 'ficha_atual' not in st.session_state and fichas_lista:
         st.session_state.ficha_atual = fichas_lista[0]
-        ficha_encontrada = next((f for f in fichas_data["sheets"] if f["name"] == st.session_state.ficha_atual), None)
-        st.session_state.contagens_registradas = ficha_encontrada["data"] if ficha_encontrada else []
     
     st.write("Selecione uma ficha:") 
-    col1, col2 = st.columns([3,1]) 
+    col1, col2, col3 = st.columns([3,1,1]) 
 
     ficha_selecionada = st.session_state.get('ficha_atual') 
 
     with col1:
         if fichas_lista:
             current_index = fichas_lista.index(st.session_state.ficha_atual) if st.session_state.ficha_atual in fichas_lista else 0
-            ficha_selecionada = st.selectbox("Selecione uma ficha:", fichas_lista, index=current_index, label_visibility="collapsed",key="selectbox_fichas")
+            ficha_selecionada = st.selectbox("Selecione uma ficha:", fichas_lista, index=current_index, format_func=nomes.get, label_visibility="collapsed",key="selectbox_fichas")
         else:
             st.warning("Nenhuma ficha criada ainda.")
             ficha_selecionada = None 
@@ -140,45 +201,66 @@ def ficha_management():
         if st.button("🆕 Nova Ficha", use_container_width=True):
             criar_nova_ficha()
             st.rerun()
+
+    with col3:
+        if st.button("🗄️ Arquivar Ficha", use_container_width=True, disabled=not ficha_selecionada or len(fichas_lista) < 2):
+            if arquivar_ficha(ficha_selecionada):
+                st.session_state.fichas_lista = listar_fichas()
+                st.session_state.ficha_atual = st.session_state.fichas_lista[-1]
+                st.toast(f"Ficha '{nomes.get(ficha_selecionada)}' arquivada.", icon="🗄️", duration=3)
+                st.rerun()
+
+    fichas_arquivadas = carregar_fichas().listar_arquivadas()
+    if fichas_arquivadas:
+        with st.expander(f"🗄️ Fichas Arquivadas ({len(fichas_arquivadas)})"):
+            ficha_arquivada = st.selectbox("Ficha arquivada:", fichas_arquivadas, format_func=nomes.get, key="selectbox_fichas_arquivadas")
+            if st.button("♻️ Restaurar Ficha", key="botao_restaurar_ficha"):
+                if restaurar_ficha(ficha_arquivada):
+                    st.session_state.fichas_lista = listar_fichas()
+                    st.session_state.ficha_atual = ficha_arquivada
+                    st.toast(f"Ficha '{nomes.get(ficha_arquivada)}' restaurada.", icon="♻️", duration=3)
+                    st.rerun()
     
     
     if ficha_selecionada:
         if ficha_selecionada != st.session_state.get('ficha_atual'):
             st.session_state.ficha_atual = ficha_selecionada
             
-            fichas_data = carregar_fichas()
-            ficha_encontrada = next((f for f in fichas_data["sheets"] if f["name"] == ficha_selecionada), None)
-            
-            if ficha_encontrada:
-                st.session_state.contagens_registradas = ficha_encontrada["data"]
-            else:
-                st.session_state.contagens_registradas = []
-            
-            st.toast(f"Ficha '{ficha_selecionada}' carregada com {len(st.session_state.contagens_registradas)} registros!", icon="📄", duration=3)
+            st.toast(f"Ficha '{nomes.get(ficha_selecionada)}' carregada com {contar_registros(ficha_selecionada)} registros!", icon="📄", duration=3)
             st.rerun() 
         
-        st.info(f"Ficha selecionada: **{st.session_state.get('ficha_atual', 'Nenhuma')}**")
+        st.info(f"Ficha selecionada: **{nomes.get(st.session_state.get('ficha_atual'), 'Nenhuma')}**")
     
-def get_lista_ruas_sequenciais(num_ruas):
-    return [f"{i:02}" for i in range(1, num_ruas + 1)]
+def get_mapa_armazem():
+    return get_nucleo().mapa
 
 
+@st.fragment
+@METRICAS.cronometrar("secao.contagem_local_especifico")
 def contagem_local_especifico():
     st.markdown("---")
     st.subheader("Seleção de Local de Contagem")
     
-    lista_barracoes = BARRACAO_OPCOES 
-    lista_ruas = get_lista_ruas_sequenciais(30)
+    mapa = get_mapa_armazem()
+    lista_barracoes = mapa.barracoes
     col_barracao, col_rua_inicial, col_rua_final = st.columns(3) 
-    
+
+    with col_barracao:
+        # O índice vem da sessão: ao voltar de outra página o widget é recriado.
+        barracao_atual = st.session_state.get('barracao_selecionado')
+        barracao_selecionado = st.selectbox(
+            "Selecione o Barracão:",
+            options=lista_barracoes,
+            index=lista_barracoes.index(barracao_atual) if barracao_atual in lista_barracoes else 0,
+            key="barracao_selecionavel",
+        )
+
+    lista_ruas = mapa.ruas(barracao_selecionado)
     if 'rua_inicial' not in st.session_state:
         st.session_state.rua_inicial = lista_ruas[0]
     if 'rua_final' not in st.session_state:
         st.session_state.rua_final = lista_ruas[0]
 
-    with col_barracao:
-        barracao_selecionado = st.selectbox("Selecione o Barracão:", options=lista_barracoes, key="barracao_selecionavel")
-
     with col_rua_inicial:
         rua_inicial = st.selectbox(
             "Rua Inicial:", 
@@ -218,67 +300,101 @@ def contagem_local_especifico():
         else:
             mensagem_rua = f"Ruas de **{rua_inicial}** a **{rua_final}**"
         st.success(f"Local selecionado: Barracão **{barracao_selecionado}** | {mensagem_rua}")
+        progresso_do_local(barracao_selecionado, rua_inicial, rua_final)
     else:
         st.warning("Selecione um local de contagem válido.")
 
 
-if 'form_pallets_totais_value' not in st.session_state:
-    st.session_state.form_pallets_totais_value = 1
-if 'form_caixas_soltas_value' not in st.session_state:
-    st.session_state.form_caixas_soltas_value = 0
+def progresso_do_local(barracao, rua_inicial, rua_final):
+    if not st.session_state.get('ficha_atual'):
+        return
+    # Vem dos contadores por local da ficha, sem percorrer os registros.
+    progresso = get_nucleo().progresso_locais(st.session_state.ficha_atual, barracao)
+    contadas = progresso['Contada'].to_numpy()
+    mapa = get_mapa_armazem()
+    primeira = mapa.faixa(barracao)[0]
+    inicio, fim = mapa.intervalo(barracao, rua_inicial, rua_final) or (primeira, primeira - 1)
+    na_faixa = contadas[inicio - primeira:fim - primeira + 1]
+    st.progress(
+        float(contadas.mean()) if len(contadas) else 0.0,
+        text=f"Barracão {barracao}: {int(contadas.sum())} de {len(contadas)} ruas com contagem nesta ficha "
+             f"| faixa selecionada: {int(na_faixa.sum())} de {len(na_faixa)}",
+    )
+    if st.toggle("Ver registros deste local", key="ver_registros_local"):
+        registros = get_nucleo().registros_na_faixa(st.session_state.ficha_atual, barracao, rua_inicial, rua_final)
+        st.caption(f"{len(registros)} registro(s) cobrem {'a rua' if rua_inicial == rua_final else 'as ruas'} selecionada(s).")
+        st.dataframe(registros.head(REGISTROS_POR_PAGINA), hide_index=True, use_container_width=True)
+
+
+def registrar_contagem(item_selecionado, pallets, caixas):
+    novo_registro = nucleo_contagem.montar_registro(
+        item_selecionado,
+        st.session_state.barracao_selecionado,
+        st.session_state.rua_inicial,
+        st.session_state.rua_final,
+        pallets,
+        caixas,
+    )
+    
+    seq = _append_registro_to_disk(st.session_state.ficha_atual, novo_registro)
+    return novo_registro, seq
 
 
 def salvar_e_visualizar_contagem(item_selecionado, pallets, caixas):
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    
-    novo_registro = {
-        'Hora': timestamp,
-        'SKU': item_selecionado['codigo'],
-        'Descrição': item_selecionado['descricao'],
-        'Barracão': st.session_state.barracao_selecionado, 
-        'Rua Inicial': st.session_state.rua_inicial,
-        'Rua Final': st.session_state.rua_final, 
-        'Pallets': pallets,
-        'Caixas Soltas': caixas
-    }
-    
-    st.session_state.contagens_registradas.append(novo_registro)
-    
-    fichas_data = carregar_fichas()
-    ficha_atual_nome = st.session_state.ficha_atual
-    
-    for ficha in fichas_data["sheets"]:
-        if ficha["name"] == ficha_atual_nome:
-            ficha["data"] = st.session_state.contagens_registradas
-            break
-            
-    salvar_fichas(fichas_data)
-    
-    st.toast(f"✅ Item {item_selecionado['codigo']} registrado e salvo!", icon="📝")
+    _, seq = registrar_contagem(item_selecionado, pallets, caixas)
     
-    st.session_state.form_pallets_totais_value = 1
-    st.session_state.form_caixas_soltas_value = 0
-    st.rerun()
+    if seq is not False:
+        st.toast(f"✅ Item {item_selecionado['codigo']} {situacao_gravacao(seq)}", icon="📝")
 
 
+@st.fragment
+@METRICAS.cronometrar("secao.entrada_rapida")
+def entrada_rapida():
+    st.markdown("---")
+    st.subheader("⚡ Entrada Rápida por SKU")
+
+    if not (st.session_state.get('ficha_atual') and st.session_state.get('barracao_selecionado') and st.session_state.get('rua_inicial')):
+        st.error("Selecione a Localização (Barracão/Rua) na seção acima.")
+        return
+
+    with st.form("form_entrada_rapida", clear_on_submit=True):
+        col_sku, col_pallet, col_caixa = st.columns([2, 1, 1])
+        with col_sku:
+            codigo = st.text_input("SKU / Código de barras:", key="entrada_rapida_codigo")
+        with col_pallet:
+            pallets = st.number_input("Pallets:", min_value=1, step=1, value=1, key="entrada_rapida_pallets")
+        with col_caixa:
+            caixas = st.number_input("Caixas Soltas:", min_value=0, step=1, value=0, key="entrada_rapida_caixas")
+        submitted = st.form_submit_button("💾 SALVAR (ENTER)", type="primary", use_container_width=True)
+
+    if submitted and codigo.strip():
+        item = indice_produtos_atual().resolver_codigo(codigo)
+        if item is None:
+            st.error(f"SKU '{codigo.strip()}' não encontrado no catálogo.")
+        else:
+            registro, seq = registrar_contagem(item, pallets, caixas)
+            if seq is not False:
+                st.success(f"✅ {registro['SKU']} - {registro['Descrição']} | {pallets} pallet(s), {caixas} cx — {situacao_gravacao(seq)}")
+
+
+@st.fragment
+@METRICAS.cronometrar("secao.selecao_de_item")
 def selecao_de_item():
     st.markdown("---")
     st.subheader("🔎 Busca e Seleção de Item")
 
-    df_produtos = get_produtos_df()
+    indice_produtos = indice_produtos_atual()
+    df_produtos = indice_produtos.df
     
     if df_produtos.empty:
         st.warning("Não foi possível carregar os dados de produtos. Verifique o arquivo `db/dbItens.csv`.")
         return 
-
-    if 'display' not in df_produtos.columns:
-        df_produtos['display'] = df_produtos['codigo'].astype(str) + ' - ' + df_produtos['descricao'].astype(str)
         
     col_filtro_marca, col_filtro_tipo = st.columns(2)
     
     with col_filtro_marca:
         if 'marca' in df_produtos.columns:
-            marcas = [''] + sorted(df_produtos['marca'].unique().tolist())
+            marcas = [''] + indice_produtos.marcas
             filtro_marca = st.selectbox("Filtrar por Marca:", marcas, index=0)
         else:
             marcas = ['']
@@ -287,28 +403,27 @@ def selecao_de_item():
         
     with col_filtro_tipo:
         if 'tipo' in df_produtos.columns:
-            tipos = [''] + sorted(df_produtos['tipo'].unique().tolist())
+            tipos = [''] + indice_produtos.tipos
             filtro_tipo = st.selectbox("Filtrar por Tipo:", tipos, index=0)
         else:
             tipos = ['']
             filtro_tipo = ''
             st.warning("Coluna 'tipo' não encontrada nos dados.")
 
-    df_filtrado = df_produtos.copy()
+    busca = st.text_input("Buscar por SKU ou descrição:", key="busca_item", placeholder="Ex.: achoc 1000")
 
-    if filtro_marca != '' and 'marca' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['marca'] == filtro_marca]
-
-    if filtro_tipo != '' and 'tipo' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['tipo'] == filtro_tipo]
+    if busca.strip():
+        opcoes_filtradas = indice_produtos.buscar(busca, filtro_marca, filtro_tipo)
+    else:
+        opcoes_filtradas = indice_produtos.opcoes(filtro_marca, filtro_tipo)
         
-    if df_filtrado.empty:
+    if not opcoes_filtradas:
         st.info("Nenhum produto encontrado com os filtros aplicados.")
         st.session_state.item_selecionado = None
         return 
 
     st.markdown("---")
-    opcoes_display = ['Selecione um produto ou comece a digitar...'] + df_filtrado['display'].tolist()
+    opcoes_display = ['Selecione um produto ou comece a digitar...'] + opcoes_filtradas
     
     item_selecionado_display = st.selectbox(
         "Selecione o Produto (SKU/Descrição):",
@@ -319,8 +434,8 @@ def selecao_de_item():
     
     
     if item_selecionado_display != 'Selecione um produto ou comece a digitar...':
-        item_selecionado = df_filtrado[df_filtrado['display'] == item_selecionado_display].iloc[0]
-        st.session_state.item_selecionado = item_selecionado.to_dict()
+        item_selecionado = indice_produtos.por_opcao(item_selecionado_display)
+        st.session_state.item_selecionado = item_selecionado
         
         st.success(f"Item Selecionado: **{item_selecionado['codigo']} - {item_selecionado['descricao']}**")
         st.markdown("#### Detalhes e Contagem Rápida")
@@ -372,19 +487,18 @@ def selecao_de_item():
                 st.error("Selecione a Localização (Barracão/Rua) na seção acima.")
                 return
             
-            with st.form("form_contagem_rapida_integrada", clear_on_submit=False): 
+            # Depois de salvar, o formulário volta sozinho para 1 pallet e 0 caixas
+            # (clear_on_submit) e a tabela é desenhada logo abaixo, no mesmo rerun do fragmento.
+            with st.form("form_contagem_rapida_integrada", clear_on_submit=True):
                 
                 col_pallet, col_caixa = st.columns(2)
-                
-                pallets_totais_value = st.session_state.get('form_pallets_totais_value', 1)
-                caixas_soltas_value = st.session_state.get('form_caixas_soltas_value', 0)
 
                 with col_pallet:
                     pallets_totais = st.number_input(
                         "Total de PALLETS Contados:", 
                         min_value=1, step=1, 
                         key="form_pallets_totais",
-                        value=pallets_totais_value, 
+                        value=1, 
                     )
                 
                 with col_caixa:
@@ -392,58 +506,344 @@ def selecao_de_item():
                         "Caixas Soltas:",
                         min_value=0, step=1,
                         key="form_caixas_soltas",
-                        value=caixas_soltas_value, 
+                        value=0, 
                     )
                 
                 submitted = st.form_submit_button("💾 SALVAR CONTAGEM (ENTER)", type="primary", use_container_width=True)
 
             if submitted:
-                st.session_state.form_pallets_totais_value = pallets_totais
-                st.session_state.form_caixas_soltas_value = caixas_soltas
                 salvar_e_visualizar_contagem(item_selecionado, pallets_totais, caixas_soltas)
 
-            st.markdown("---")
-            st.markdown("##### Contagens Registradas nesta Ficha")
-            
-            if st.session_state.contagens_registradas:
-                df_registros = pd.DataFrame(st.session_state.contagens_registradas).iloc[::-1].reset_index(drop=True)
-
-                csv_data = df_registros.to_csv(index=False, sep=';', encoding='utf-8').encode('utf-8')
-                
-                col_tabela, col_download = st.columns([4, 1])
-
-                with col_tabela:
-                    st.dataframe(
-                        df_registros,
-                        column_order=["Hora", "SKU", "Descrição", "Barracão", "Rua Inicial", "Rua Final", "Pallets", "Caixas Soltas"],
-                        column_config={
-                            "Descrição": st.column_config.Column(width="large"),
-                            "Barracão": st.column_config.Column(width="small"),
-                            "Rua Inicial": st.column_config.Column("Rua Ini", width="small"),
-                            "Rua Final": st.column_config.Column("Rua Fim", width="small"),
-                        },
-                        hide_index=True,
-                        use_container_width=True,
-                        height=300
-                    )
-                
-                with col_download:
-                    st.download_button(
-                        label="⬇️ Download CSV",
-                        data=csv_data,
-                        file_name=f"{st.session_state.ficha_atual.replace(' | ', '_').replace('/', '-')}_export.csv",
-                        mime="text/csv",
-                        use_container_width=True
-                    )
-            else:
-                st.info("Nenhuma contagem registrada para este item na ficha atual.")
+            registros_da_ficha(ficha_atual)
 
     else:
         st.session_state.item_selecionado = None
         st.info("Aguardando seleção do item...")
 
-if __name__ == "__main__":
+
+@st.fragment
+@METRICAS.cronometrar("secao.registros_da_ficha")
+def registros_da_ficha(ficha_atual):
+    # Fragmento próprio: trocar de página da tabela só redesenha a tabela.
+    st.markdown("---")
+    st.markdown("##### Contagens Registradas nesta Ficha")
+    indicador_gravacao()
     
+    # Lidos antes da tabela: um registro gravado entre as duas leituras
+    # aparece em dobro por um instante, mas nunca some.
+    pendentes = registros_pendentes(ficha_atual)
+    tabela = tabela_ficha_atual()
+    if tabela.total or pendentes:
+        nucleo = get_nucleo()
+        fatores = nucleo.produtos().fatores
+        resumo = nucleo.resumo(ficha_atual)
+
+        col_reg, col_pal, col_cx, col_un = st.columns(4)
+        col_reg.metric("Registros", f"{resumo['registros']:,}".replace(",", "."))
+        col_pal.metric("Total Pallets", f"{resumo['pallets']:,}".replace(",", "."))
+        col_cx.metric("Total Caixas", f"{resumo['caixas']:,}".replace(",", "."))
+        col_un.metric("Total Unidades", f"{resumo['unidades']:,}".replace(",", "."))
+        if resumo['sem_catalogo']:
+            st.warning(f"{resumo['sem_catalogo']} registro(s) com SKU fora do catálogo não entram nos totais.")
+
+        col_tabela, col_download = st.columns([4, 1])
+
+        resumo_sku = nucleo.resumo_por_sku(ficha_atual)
+
+        with col_tabela:
+            aba_registros, aba_resumo = st.tabs(["Registros", "Resumo por SKU"])
+
+            with aba_registros:
+                total_paginas = tabela.paginas(REGISTROS_POR_PAGINA)
+                pagina = 1
+                if total_paginas > 1:
+                    pagina = st.number_input(
+                        f"Página (de {total_paginas}):",
+                        min_value=1, max_value=total_paginas, value=1, step=1,
+                        key="pagina_registros",
+                    )
+                df_registros = tabela.pagina(pagina, REGISTROS_POR_PAGINA)
+                if pagina == 1 and pendentes:
+                    # Contagens ainda na fila de gravação aparecem no topo, como as mais recentes.
+                    df_pendentes = pd.DataFrame(pendentes[::-1], columns=COLUNAS_TABELA)
+                    df_registros = pd.concat([df_pendentes, df_registros], ignore_index=True) if tabela.total else df_pendentes
+                df_registros = pd.DataFrame(adicionar_totais(df_registros, fatores))
+                st.dataframe(
+                    df_registros,
+                    column_order=COLUNAS_TABELA + [COLUNA_TOTAL_CAIXAS, COLUNA_TOTAL_UNIDADES],
+                    column_config={
+                        "Descrição": st.column_config.Column(width="large"),
+                        "Barracão": st.column_config.Column(width="small"),
+                        "Rua Inicial": st.column_config.Column("Rua Ini", width="small"),
+                        "Rua Final": st.column_config.Column("Rua Fim", width="small"),
+                    },
+                    hide_index=True,
+                    use_container_width=True,
+                    height=300
+                )
+                st.caption(f"{tabela.total} registros na ficha.")
+
+            with aba_resumo:
+                st.dataframe(
+                    resumo_sku,
+                    column_config={"Descrição": st.column_config.Column(width="large")},
+                    hide_index=True,
+                    use_container_width=True,
+                    height=300
+                )
+                st.caption(f"{len(resumo_sku)} SKUs distintos na ficha.")
+        
+        with col_download:
+            nome_arquivo = f"{nome_ficha(ficha_atual).replace(' | ', '_').replace('/', '-')}_export"
+            # O conteúdo só é gerado no clique e reaproveitado enquanto a ficha não mudar.
+            st.download_button(
+                label="⬇️ Download CSV",
+                data=lambda: nucleo.exportar(ficha_atual, "csv"),
+                file_name=f"{nome_arquivo}.csv",
+                mime="text/csv",
+                on_click="ignore",
+                use_container_width=True
+            )
+            st.download_button(
+                label="⬇️ Download XLSX",
+                data=lambda: nucleo.exportar(ficha_atual, "xlsx"),
+                file_name=f"{nome_arquivo}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                on_click="ignore",
+                use_container_width=True
+            )
+            st.download_button(
+                label="⬇️ Resumo por SKU",
+                data=lambda: nucleo.exportar(ficha_atual, "resumo"),
+                file_name=f"{nome_arquivo}_resumo_sku.csv",
+                mime="text/csv",
+                on_click="ignore",
+                use_container_width=True
+            )
+    else:
+        st.info("Nenhuma contagem registrada para este item na ficha atual.")
+
+
+@METRICAS.cronometrar("pagina.importacao")
+def pagina_importacao():
+    st.title("📥 Importar Contagens (CSV/XLSX)")
+    ficha_atual = st.session_state.get('ficha_atual')
+    if not ficha_atual:
+        st.info("Selecione uma ficha na página de contagem para importar.")
+        return
+    st.info(f"Ficha selecionada: **{nome_ficha(ficha_atual)}**")
+    st.caption(
+        "Colunas reconhecidas: SKU (ou Código/EAN), Pallets, Caixas Soltas e, opcionalmente, Hora, Barracão, "
+        "Rua Inicial e Rua Final. Linhas sem barracão/rua usam o local selecionado na página de contagem."
+    )
+    arquivo = st.file_uploader("Arquivo de contagens", type=["csv", "xlsx"], key="importar_arquivo")
+    if arquivo is not None and st.button(f"📥 Importar para '{nome_ficha(ficha_atual)}'", key="importar_confirmar"):
+        padroes = {
+            'Barracão': st.session_state.get('barracao_selecionado'),
+            'Rua Inicial': st.session_state.get('rua_inicial'),
+            'Rua Final': st.session_state.get('rua_final'),
+        }
+        try:
+            with st.spinner("Importando..."), METRICAS.medir("io.importar_contagens", arquivo.size):
+                resultado = get_nucleo().importar(ficha_atual, arquivo, nome=arquivo.name, padroes=padroes)
+        except Exception as e:
+            st.error(f"❌ Erro ao importar o arquivo: {e}", icon="❌")
+            return
+        st.session_state.importacao_resultado = {**resultado, "arquivo": arquivo.name}
+
+    resultado = st.session_state.get('importacao_resultado')
+    if not resultado:
+        return
+    st.success(f"✅ {resultado['arquivo']}: {resultado['importados']} registro(s) importado(s), {resultado['rejeitados']} rejeitado(s).")
+    if resultado['rejeitados']:
+        rejeicoes = resultado['rejeicoes']
+        if len(rejeicoes) < resultado['rejeitados']:
+            st.caption(f"Mostrando as primeiras {len(rejeicoes)} linhas rejeitadas.")
+        st.dataframe(rejeicoes, hide_index=True, use_container_width=True, height=250)
+        st.download_button(
+            label="⬇️ Download Rejeitados (CSV)",
+            data=lambda: gerar_csv_rejeicoes(rejeicoes),
+            file_name=f"rejeitados_{resultado['arquivo'].rsplit('.', 1)[0]}.csv",
+            mime="text/csv",
+            on_click="ignore",
+        )
+
+
+@st.cache_resource(max_entries=4)
+def _comparar(ficha_a, total_a, ficha_b, total_b, versao_catalogo):
+    return get_nucleo().comparar(ficha_a, ficha_b)
+
+
+@METRICAS.cronometrar("pagina.comparacao")
+def pagina_comparacao():
+    st.title("🔁 Comparar Fichas (Recontagem)")
+    fichas_lista = st.session_state.get('fichas_lista') or listar_fichas()
+    if len(fichas_lista) < 2:
+        st.info("É preciso ter ao menos duas fichas para comparar.")
+        return
+    nomes = nomes_das_fichas()
+
+    col_a, col_b = st.columns(2)
+    with col_a:
+        ficha_a = st.selectbox("Ficha de referência (A):", fichas_lista, index=len(fichas_lista) - 2, format_func=nomes.get, key="comparar_ficha_a")
+    with col_b:
+        ficha_b = st.selectbox("Recontagem (B):", fichas_lista, index=len(fichas_lista) - 1, format_func=nomes.get, key="comparar_ficha_b")
+
+    if not st.toggle("Comparar", key="comparar_fichas_ativo"):
+        return
+    if ficha_a == ficha_b:
+        st.warning("Selecione duas fichas diferentes.")
+        return
+
+    tabela_a = get_nucleo().tabela(ficha_a)
+    tabela_b = get_nucleo().tabela(ficha_b)
+    comparacao = _comparar(ficha_a, tabela_a.total, ficha_b, tabela_b.total, get_catalogo().versao)
+    resumo = resumo_comparacao(comparacao)
+
+    col_add, col_rem, col_alt, col_igual = st.columns(4)
+    col_add.metric(STATUS_ADICIONADO, resumo[STATUS_ADICIONADO])
+    col_rem.metric(STATUS_REMOVIDO, resumo[STATUS_REMOVIDO])
+    col_alt.metric(STATUS_ALTERADO, resumo[STATUS_ALTERADO])
+    col_igual.metric(STATUS_IGUAL, resumo[STATUS_IGUAL])
+
+    nome_arquivo = f"comparacao_{nomes[ficha_a]}_x_{nomes[ficha_b]}.csv".replace(' | ', '_').replace('/', '-').replace(' ', '_')
+    diferencas_da_comparacao(comparacao, nome_arquivo)
+
+
+@st.fragment
+def diferencas_da_comparacao(comparacao, nome_arquivo):
+    # Trocar o filtro de status só redesenha a tabela, sem recomparar as fichas.
+    filtro_status = st.multiselect(
+        "Mostrar:",
+        [STATUS_ADICIONADO, STATUS_REMOVIDO, STATUS_ALTERADO, STATUS_IGUAL],
+        default=[STATUS_ADICIONADO, STATUS_REMOVIDO, STATUS_ALTERADO],
+        key="comparar_filtro_status",
+    )
+    diferencas = comparacao[comparacao['Status'].isin(filtro_status)]
+    st.dataframe(diferencas, hide_index=True, use_container_width=True, height=300)
+    st.download_button(
+        label="⬇️ Download Comparação (CSV)",
+        data=lambda: comparacao.to_csv(index=False, sep=';').encode('utf-8'),
+        file_name=nome_arquivo,
+        mime="text/csv",
+        on_click="ignore",
+    )
+
+
+INTERVALOS_ATUALIZACAO = {"5 s": 5, "15 s": 15, "30 s": 30, "1 min": 60}
+
+
+@METRICAS.cronometrar("secao.painel_progresso")
+def _painel_progresso(ficha_id):
+    # Só este trecho roda a cada atualização automática: a tabela da ficha
+    # lê apenas o que foi gravado desde a última vez e os totais vêm dos
+    # contadores por local e por SKU.
+    nucleo = get_nucleo()
+    progresso = nucleo.progresso(ficha_id)
+
+    col_registros, col_ruas, col_posicoes, col_skus = st.columns(4)
+    col_registros.metric("Registros", progresso['registros'])
+    col_ruas.metric("Ruas contadas", f"{progresso['ruas_contadas']} / {progresso['ruas']}")
+    col_posicoes.metric("Posições contadas", f"{progresso['posicoes_contadas']} / {progresso['posicoes']}")
+    col_skus.metric("SKUs restantes", progresso['skus_restantes'], help=f"{progresso['skus_contados']} de {progresso['skus_catalogo']} SKUs do catálogo já contados")
+    st.progress(progresso['ruas_contadas'] / progresso['ruas'] if progresso['ruas'] else 0.0, text="Ruas com contagem")
+    if progresso['fora_do_mapa']:
+        st.caption(f"⚠️ {progresso['fora_do_mapa']} registro(s) com barracão/rua fora do mapa do armazém.")
+
+    resumo_locais = nucleo.resumo_locais(ficha_id)
+    resumo_locais['Progresso'] = resumo_locais['Ruas contadas'] / resumo_locais['Ruas'].where(resumo_locais['Ruas'] > 0)
+    st.dataframe(
+        resumo_locais,
+        hide_index=True,
+        use_container_width=True,
+        column_config={"Progresso": st.column_config.ProgressColumn("Progresso", min_value=0.0, max_value=1.0, format="percent")},
+    )
+
+    st.markdown("**Registros por Barracão x Rua** (vazio = rua ainda não contada)")
+    st.dataframe(grade_locais(nucleo.progresso_locais(ficha_id)), use_container_width=True)
+
+    restantes = nucleo.skus_restantes(ficha_id)
+    with st.expander(f"📋 SKUs ainda não contados ({len(restantes)})"):
+        st.dataframe(restantes.head(REGISTROS_POR_PAGINA * 5), hide_index=True, use_container_width=True, height=300)
+        st.download_button(
+            label="⬇️ Download SKUs restantes (CSV)",
+            data=lambda: restantes.to_csv(index=False, sep=';').encode('utf-8'),
+            file_name=f"skus_restantes_{nome_ficha(ficha_id)}.csv".replace(' | ', '_').replace('/', '-').replace(' ', '_'),
+            mime="text/csv",
+            on_click="ignore",
+        )
+    st.caption(f"Atualizado às {datetime.now().strftime('%H:%M:%S')}")
+
+
+def pagina_progresso():
+    st.title("📊 Progresso da Contagem")
+    fichas_lista = st.session_state.get('fichas_lista') or listar_fichas()
+    if not fichas_lista:
+        st.info("Nenhuma ficha ativa.")
+        return
+    nomes = nomes_das_fichas()
+    ficha_atual = st.session_state.get('ficha_atual')
+
+    col_ficha, col_intervalo = st.columns([3, 1])
+    with col_ficha:
+        ficha_id = st.selectbox(
+            "Ficha:", fichas_lista, format_func=nomes.get, key="progresso_ficha",
+            index=fichas_lista.index(ficha_atual) if ficha_atual in fichas_lista else 0,
+        )
+    with col_intervalo:
+        atualizacao = st.selectbox("Atualizar a cada:", ["Desligado", *INTERVALOS_ATUALIZACAO], index=2, key="progresso_intervalo")
+
+    st.fragment(_painel_progresso, run_every=INTERVALOS_ATUALIZACAO.get(atualizacao))(ficha_id)
+
+
+def pagina_contagem():
+    # Seleção de local, busca de item e tabela de registros são fragmentos:
+    # mexer em um deles reexecuta só aquele trecho, não a página inteira.
+    st.title("🥛 Contagem de Estoque")
+    ficha_management()
+    contagem_local_especifico()
+    if st.toggle("⚡ Modo entrada rápida (leitura de SKU)", key="modo_entrada_rapida"):
+        entrada_rapida()
+    else:
+        selecao_de_item()
+
+
+def painel_desempenho():
+    if not METRICAS.ativas:
+        return
+    with st.sidebar:
+        st.subheader("⏱️ Desempenho")
+        resumo = METRICAS.resumo()
+        if not resumo:
+            st.caption("Nenhuma medição ainda.")
+            return
+        st.dataframe(
+            pd.DataFrame(resumo).round({'media_ms': 1, 'p50_ms': 1, 'p95_ms': 1, 'max_ms': 1}),
+            hide_index=True,
+            use_container_width=True,
+        )
+        with st.expander("Últimas medições"):
+            st.dataframe(
+                pd.DataFrame(
+                    [(datetime.fromtimestamp(ts).strftime('%H:%M:%S'), etapa, round(duracao * 1000, 1), tamanho)
+                     for ts, etapa, duracao, tamanho in reversed(METRICAS.eventos(50))],
+                    columns=['hora', 'etapa', 'duracao_ms', 'tamanho'],
+                ),
+                hide_index=True,
+                use_container_width=True,
+            )
+        st.download_button("⬇️ Métricas (JSON)", data=lambda: METRICAS.como_json().encode('utf-8'),
+                           file_name="metricas.json", mime="application/json", on_click="ignore")
+        st.download_button("⬇️ Métricas (Prometheus)", data=lambda: METRICAS.como_prometheus().encode('utf-8'),
+                           file_name="metricas.prom", mime="text/plain", on_click="ignore")
+        st.caption(f"Gravadas também em `{DUMP_JSON}` e `{DUMP_PROMETHEUS}`.")
+
+
+if __name__ == "__main__":
+
+    configure_page()
+    exigir_fichas()
+
     if 'fichas_lista' not in st.session_state:
         st.session_state.fichas_lista = listar_fichas()
 
@@ -451,15 +851,15 @@ if __name__ == "__main__":
         ficha_selecionada = st.session_state.fichas_lista[0]
         if 'ficha_atual' not in st.session_state:
             st.session_state.ficha_atual = ficha_selecionada
-            
-        fichas_data = carregar_fichas()
-        ficha_encontrada = next((f for f in fichas_data["sheets"] if f["name"] == st.session_state.ficha_atual), None)
-        
-        if 'contagens_registradas' not in st.session_state or st.session_state.contagens_registradas != ficha_encontrada["data"]:
-            st.session_state.contagens_registradas = ficha_encontrada["data"] if ficha_encontrada else []
-
 
-    configure_page()
-    ficha_management()
-    contagem_local_especifico()
-    selecao_de_item()
+    aviso_catalogo()
+    pagina = st.navigation([
+        st.Page(pagina_contagem, title="Contagem", icon="🥛", default=True),
+        st.Page(pagina_importacao, title="Importar", icon="📥", url_path="importar"),
+        st.Page(pagina_comparacao, title="Comparar", icon="🔁", url_path="comparar"),
+        st.Page(pagina_progresso, title="Progresso", icon="📊", url_path="progresso"),
+    ])
+    with METRICAS.medir("rerun"):
+        pagina.run()
+    METRICAS.gravar_dump()
+    painel_desempenho()
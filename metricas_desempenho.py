@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from functools import wraps
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+# Instrumentação opcional: STOCK_METRICAS=1 liga a coleta e o painel.
+ATIVAS = os.environ.get("STOCK_METRICAS", "") not in ("", "0")
+
+DUMP_JSON = Path("db/metricas.json")
+DUMP_PROMETHEUS = Path("db/metricas.prom")
+
+# Limites (em segundos) dos buckets do histograma exportado para o Prometheus.
+LIMITES_HISTOGRAMA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))] if valores else 0.0
+
+
+class Metricas:
+    """Durações e tamanhos de payload por etapa, compartilhados pelo processo.
+
+    Cada medição vai para um buffer circular (as últimas `capacidade`) e para
+    agregados acumulados por etapa (contagem, soma, máximo, histograma), que
+    alimentam o painel, o JSON e o texto no formato do Prometheus. Desligada,
+    `medir` devolve um contexto vazio e `cronometrar` não embrulha a função.
+    """
+
+    def __init__(self, capacidade=2000, ativas=ATIVAS):
+        self.ativas = ativas
+        self._eventos = deque(maxlen=capacidade)
+        self._agregados = {}
+        self._lock = threading.Lock()
+        self._ultimo_dump = 0.0
+
+    def registrar(self, etapa, duracao, tamanho=None):
+        with self._lock:
+            self._eventos.append((time.time(), etapa, duracao, tamanho))
+            agregado = self._agregados.get(etapa)
+            if agregado is None:
+                agregado = {"contagem": 0, "soma": 0.0, "max": 0.0, "bytes": 0,
+                            "ultimo_tamanho": None, "buckets": [0] * len(LIMITES_HISTOGRAMA)}
+                self._agregados[etapa] = agregado
+            agregado["contagem"] += 1
+            agregado["soma"] += duracao
+            agregado["max"] = max(agregado["max"], duracao)
+            if tamanho is not None:
+                agregado["bytes"] += tamanho
+                agregado["ultimo_tamanho"] = tamanho
+            for i, limite in enumerate(LIMITES_HISTOGRAMA):
+                if duracao <= limite:
+                    agregado["buckets"][i] += 1
+
+    @contextmanager
+    def _medir(self, etapa, tamanho):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracao = time.perf_counter() - inicio
+            # `tamanho` pode ser uma função: só é avaliada com a coleta ligada.
+            self.registrar(etapa, duracao, tamanho() if callable(tamanho) else tamanho)
+
+    def medir(self, etapa, tamanho=None):
+        if not self.ativas:
+            return nullcontext()
+        return self._medir(etapa, tamanho)
+
+    def cronometrar(self, etapa, tamanho=None):
+        """Decorador; `tamanho(resultado)` calcula o tamanho do payload retornado."""
+        def decorador(funcao):
+            if not self.ativas:
+                return funcao
+
+            @wraps(funcao)
+            def medida(*args, **kwargs):
+                inicio = time.perf_counter()
+                resultado = None
+                try:
+                    resultado = funcao(*args, **kwargs)
+                    return resultado
+                finally:
+                    duracao = time.perf_counter() - inicio
+                    self.registrar(etapa, duracao, tamanho(resultado) if tamanho and resultado is not None else None)
+            return medida
+        return decorador
+
+    def eventos(self, limite=None):
+        with self._lock:
+            eventos = list(self._eventos)
+        return eventos[-limite:] if limite else eventos
+
+    def resumo(self):
+        """Uma linha por etapa: acumulados desde o início e percentis do buffer."""
+        duracoes = {}
+        for _, etapa, duracao, _ in self.eventos():
+            duracoes.setdefault(etapa, []).append(duracao)
+        with self._lock:
+            agregados = {etapa: dict(agregado) for etapa, agregado in self._agregados.items()}
+        return [
+            {
+                "etapa": etapa,
+                "contagem": agregado["contagem"],
+                "media_ms": agregado["soma"] / agregado["contagem"] * 1000,
+                "p50_ms": _percentil(duracoes.get(etapa, []), 0.50) * 1000,
+                "p95_ms": _percentil(duracoes.get(etapa, []), 0.95) * 1000,
+                "max_ms": agregado["max"] * 1000,
+                "ultimo_tamanho": agregado["ultimo_tamanho"],
+            }
+            for etapa, agregado in sorted(agregados.items())
+        ]
+
+    def como_json(self):
+        return json.dumps({
+            "gerado_em": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "resumo": self.resumo(),
+            "eventos": [
+                {"ts": ts, "etapa": etapa, "duracao_ms": duracao * 1000, "tamanho": tamanho}
+                for ts, etapa, duracao, tamanho in self.eventos()
+            ],
+        }, ensure_ascii=False, indent=2)
+
+    def como_prometheus(self):
+        with self._lock:
+            agregados = {etapa: dict(agregado) for etapa, agregado in self._agregados.items()}
+        linhas = [
+            "# HELP stock_fast_duracao_segundos Duração de cada etapa do app.",
+            "# TYPE stock_fast_duracao_segundos histogram",
+        ]
+        for etapa, agregado in sorted(agregados.items()):
+            for limite, quantidade in zip(LIMITES_HISTOGRAMA, agregado["buckets"]):
+                linhas.append(f'stock_fast_duracao_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {quantidade}')
+            linhas.append(f'stock_fast_duracao_segundos_bucket{{etapa="{etapa}",le="+Inf"}} {agregado["contagem"]}')
+            linhas.append(f'stock_fast_duracao_segundos_sum{{etapa="{etapa}"}} {agregado["soma"]:.6f}')
+            linhas.append(f'stock_fast_duracao_segundos_count{{etapa="{etapa}"}} {agregado["contagem"]}')
+        linhas += [
+            "# HELP stock_fast_payload_bytes_total Bytes lidos/gravados por etapa.",
+            "# TYPE stock_fast_payload_bytes_total counter",
+        ]
+        for etapa, agregado in sorted(agregados.items()):
+            if agregado["ultimo_tamanho"] is not None:
+                linhas.append(f'stock_fast_payload_bytes_total{{etapa="{etapa}"}} {agregado["bytes"]}')
+        return "\n".join(linhas) + "\n"
+
+    def gravar_dump(self, intervalo=10.0, caminho_json=DUMP_JSON, caminho_prometheus=DUMP_PROMETHEUS):
+        """Grava o JSON e o texto do Prometheus (no máximo a cada `intervalo` segundos)."""
+        if not self.ativas or time.monotonic() - self._ultimo_dump < intervalo:
+            return False
+        self._ultimo_dump = time.monotonic()
+        for caminho, conteudo in ((caminho_json, self.como_json()), (caminho_prometheus, self.como_prometheus())):
+            caminho.parent.mkdir(parents=True, exist_ok=True)
+            tmp = caminho.with_name(caminho.name + ".tmp")
+            tmp.write_text(conteudo, encoding="utf-8")
+            os.replace(tmp, caminho)
+        return True
+
+
+METRICAS = Metricas()
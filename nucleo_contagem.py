@@ -0,0 +1,267 @@
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+import fichas_storage
+import catalogo_produtos
+import exportacao
+import importacao_contagens
+import locais_armazem
+from fila_gravacao import FilaGravacao
+from registros_tabela import TabelaRegistros
+from comparacao_fichas import comparar_fichas, CAMPOS_COMPARACAO
+from totais_contagem import resumo_totais
+from progresso_contagem import resumo_progresso, skus_restantes
+
+# Quanto `importar` espera a fila de gravação esvaziar antes de desistir.
+TIMEOUT_DESCARREGAR = 30.0
+
+DEFAULT_FICHA_STRUCTURE = {
+    "sheets": [
+        {"name": "Ficha de Exemplo 1 (Padrão)", "data": []}
+    ]
+}
+
+# Catálogo de exemplo, usado quando o dbItens.csv não existe.
+PRODUTOS_MOCK = {
+    'codigo': [1001, 1002, 2005, 3010, 4001, 5002],
+    'descricao': ['Leite Integral UHT 1L', 'Creme de Leite 200g', 'Queijo Mussarela 5kg', 'Manteiga Extra 500g', 'Iogurte Natural 1L', 'Bebida Láctea TP 1L'],
+    'marca': ['Marca A', 'Marca A', 'Marca B', 'Marca C', 'Marca B', 'Marca C'],
+    'tipo': ['Líquido', 'Cremoso', 'Sólido', 'Sólido', 'Líquido', 'Líquido'],
+    'qtd_por_pallet': [1008, 1200, 100, 1500, 960, 1100],
+    'qtd_por_camada': [126, 150, 10, 100, 120, 110],
+    'qtd_por_caixa': [12, 24, 1, 30, 8, 12],
+    'codigo_amarracao_imagem': [1, 2, 3, 4, 5, 6]
+}
+
+
+def abrir_storage(backend="json"):
+    """Storage do backend pedido, criando a ficha de exemplo se não houver nenhuma."""
+    storage = fichas_storage.criar_storage(backend)
+    if not storage.nomes_fichas():
+        storage.importar(DEFAULT_FICHA_STRUCTURE)
+    return storage
+
+
+def carregar_produtos(caminho=catalogo_produtos.PRODUTOS_CSV):
+    """Catálogo tipado do CSV, ou o catálogo de exemplo se o arquivo não existir."""
+    if not os.path.exists(caminho):
+        return catalogo_produtos.aplicar_schema(pd.DataFrame(PRODUTOS_MOCK))
+    df = catalogo_produtos.ler_catalogo(caminho)
+    if df.empty:
+        raise ValueError("CSV de produtos vazio.")
+    return df
+
+
+def nome_nova_ficha(agora=None):
+    return f"Contagem - {(agora or datetime.now()).strftime('%d/%m/%Y | %H:%M')}"
+
+
+def montar_registro(item, barracao, rua_inicial, rua_final, pallets, caixas, hora=None):
+    return {
+        'Hora': hora or datetime.now().strftime("%H:%M:%S"),
+        'SKU': item['codigo'],
+        'Descrição': item['descricao'],
+        'Barracão': barracao,
+        'Rua Inicial': rua_inicial,
+        'Rua Final': rua_final,
+        'Pallets': pallets,
+        'Caixas Soltas': caixas
+    }
+
+
+class NucleoContagem:
+    """Fichas, catálogo, registros e totais, sem depender do Streamlit.
+
+    Uma instância por processo: o app guarda a sua em `st.cache_resource` e a
+    CLI cria a própria. O catálogo, a fila de gravação e as tabelas de
+    registros por ficha são montados na primeira vez que são usados e
+    reaproveitados entre reruns e sessões.
+
+    `gravacao="lote"` manda as contagens para a `FilaGravacao`; `"direta"`
+    grava no storage antes de `registrar` retornar.
+    """
+
+    def __init__(self, storage, carregar=carregar_produtos, gravacao="direta", observar_catalogo=True,
+                 carregar_mapa=locais_armazem.carregar_mapa):
+        self.storage = storage
+        self.gravacao = gravacao
+        self._carregar = carregar
+        self._observar_catalogo = observar_catalogo
+        self._carregar_mapa = carregar_mapa
+        self._mapa = None
+        self._lock = threading.Lock()
+        self._catalogo = None
+        self._fila = None
+        self._tabelas = {}
+
+    @property
+    def catalogo(self):
+        with self._lock:
+            if self._catalogo is None:
+                # Sem observação (CLI), o CSV é lido uma vez e não há thread de recarga.
+                intervalo = 2.0 if self._observar_catalogo else None
+                self._catalogo = catalogo_produtos.CatalogoVivo(self._carregar, intervalo=intervalo)
+            return self._catalogo
+
+    @property
+    def fila(self):
+        with self._lock:
+            if self._fila is None:
+                self._fila = FilaGravacao(self.storage)
+            return self._fila
+
+    @property
+    def mapa(self):
+        """Mapa do armazém (barracões, ruas e posições), lido uma vez por processo."""
+        with self._lock:
+            if self._mapa is None:
+                self._mapa = self._carregar_mapa()
+            return self._mapa
+
+    def produtos(self):
+        return self.catalogo.atual()
+
+    def _produtos_e_versao(self):
+        # A versão é lida antes do índice: numa troca entre as duas leituras,
+        # o resultado fica com a versão antiga e é refeito na próxima chamada.
+        versao = self.catalogo.versao
+        return self.produtos(), versao
+
+    # Fichas
+
+    def listar_fichas(self):
+        return self.storage.listar_fichas()
+
+    def listar_arquivadas(self):
+        return self.storage.listar_arquivadas()
+
+    def nomes_das_fichas(self):
+        return self.storage.nomes_fichas()
+
+    def nome_ficha(self, ficha_id):
+        return self.storage.nome_ficha(ficha_id) or str(ficha_id)
+
+    def resolver_ficha(self, id_ou_nome):
+        """Id da ficha a partir do id ou do nome (o mais recente, se houver repetidos)."""
+        nomes = self.nomes_das_fichas()
+        if id_ou_nome in nomes:
+            return id_ou_nome
+        encontrados = [ficha_id for ficha_id, nome in nomes.items() if nome == id_ou_nome]
+        return encontrados[-1] if encontrados else None
+
+    def criar_ficha(self, nome=None):
+        return self.storage.criar_ficha(nome or nome_nova_ficha())
+
+    def arquivar_ficha(self, ficha_id):
+        arquivada = self.storage.arquivar_ficha(ficha_id)
+        if arquivada:
+            with self._lock:
+                self._tabelas.pop(ficha_id, None)
+        return arquivada
+
+    def restaurar_ficha(self, ficha_id):
+        return self.storage.restaurar_ficha(ficha_id)
+
+    # Registros
+
+    def registrar(self, ficha_id, registro):
+        """Grava (ou enfileira) o registro; retorna o número na fila ou None se já gravado."""
+        if self.gravacao == "lote":
+            return self.fila.enfileirar(ficha_id, registro)
+        self.storage.anexar_registro(ficha_id, registro)
+        return None
+
+    def registros_pendentes(self, ficha_id):
+        if self.gravacao != "lote":
+            return []
+        return self.fila.pendentes_da_ficha(ficha_id)
+
+    def descarregar(self, timeout=None):
+        if self._fila is None:
+            return True
+        return self._fila.descarregar(timeout)
+
+    def importar(self, ficha_id, arquivo, nome=None, padroes=None):
+        """Importa um CSV/XLSX de contagens para a ficha (ver `importacao_contagens`)."""
+        # As contagens enfileiradas antes da importação continuam antes dela na ficha.
+        if not self.descarregar(TIMEOUT_DESCARREGAR):
+            raise RuntimeError("Há contagens enfileiradas que ainda não puderam ser gravadas; tente importar de novo em instantes.")
+        return importacao_contagens.importar_contagens(
+            self.storage, ficha_id, arquivo, self.produtos(), nome=nome, padroes=padroes
+        )
+
+    def contar_registros(self, ficha_id):
+        return self.storage.contar_registros(ficha_id)
+
+    def tabela(self, ficha_id):
+        """Tabela de registros da ficha, sincronizada com o storage."""
+        mapa = self.mapa
+        with self._lock:
+            tabela = self._tabelas.get(ficha_id)
+            if tabela is None:
+                tabela = self._tabelas[ficha_id] = TabelaRegistros(mapa)
+        return tabela.sincronizar(self.storage, ficha_id)
+
+    # Locais
+
+    def progresso_locais(self, ficha_id, barracao=None):
+        """Registros por rua do mapa (de um barracão, ou de todos)."""
+        return self.tabela(ficha_id).locais.progresso(barracao)
+
+    def resumo_locais(self, ficha_id):
+        """Ruas e posições contadas por barracão."""
+        return self.tabela(ficha_id).locais.resumo_por_barracao()
+
+    def registros_na_faixa(self, ficha_id, barracao, rua_inicial, rua_final=None):
+        return self.tabela(ficha_id).registros_na_faixa(barracao, rua_inicial, rua_final)
+
+    def progresso(self, ficha_id):
+        """Ruas, posições e SKUs do catálogo já contados na ficha."""
+        tabela = self.tabela(ficha_id)
+        indice, versao = self._produtos_e_versao()
+        return tabela.memorizar("progresso", lambda t, total: resumo_progresso(t, indice), versao)
+
+    def skus_restantes(self, ficha_id):
+        tabela = self.tabela(ficha_id)
+        indice, versao = self._produtos_e_versao()
+        return tabela.memorizar("skus_restantes", lambda t, total: skus_restantes(t, indice), versao)
+
+    # Totais, exportação e comparação
+
+    def resumo(self, ficha_id):
+        tabela = self.tabela(ficha_id)
+        indice, versao = self._produtos_e_versao()
+        return tabela.memorizar("resumo", lambda t, total: resumo_totais(t, total, indice.fatores), versao)
+
+    def resumo_por_sku(self, ficha_id):
+        tabela = self.tabela(ficha_id)
+        indice, versao = self._produtos_e_versao()
+        return tabela.memorizar("resumo_sku", lambda t, total: t.resumo_por_sku(indice.fatores), versao)
+
+    def exportar(self, ficha_id, formato="csv"):
+        """Conteúdo do arquivo de exportação da ficha: "csv", "xlsx" ou "resumo"."""
+        tabela = self.tabela(ficha_id)
+        indice, versao = self._produtos_e_versao()
+        fatores = indice.fatores
+        if formato == "csv":
+            gerar = lambda t, total: exportacao.gerar_csv(t, total, fatores)
+        elif formato == "xlsx":
+            resumo_sku = self.resumo_por_sku(ficha_id)
+            gerar = lambda t, total: exportacao.gerar_xlsx(t, total, fatores, resumo_sku)
+        elif formato == "resumo":
+            resumo_sku = self.resumo_por_sku(ficha_id)
+            gerar = lambda t, total: exportacao.gerar_csv_resumo(resumo_sku)
+        else:
+            raise ValueError(f"Formato de exportação desconhecido: {formato}")
+        return tabela.memorizar(("exportar", formato), gerar, versao)
+
+    def comparar(self, ficha_a, ficha_b):
+        tabela_a, tabela_b = self.tabela(ficha_a), self.tabela(ficha_b)
+        return comparar_fichas(
+            tabela_a.fatia(0, tabela_a.total, CAMPOS_COMPARACAO),
+            tabela_b.fatia(0, tabela_b.total, CAMPOS_COMPARACAO),
+            self.produtos().fatores,
+        )
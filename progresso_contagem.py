@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+COLUNAS_SKUS_RESTANTES = ['codigo', 'descricao', 'marca', 'tipo']
+
+
+def skus_contados(tabela, indice_produtos):
+    """Máscara das linhas do catálogo que já têm contagem na ficha.
+
+    Parte dos SKUs distintos do agregado da tabela (mantido a cada registro),
+    não dos registros.
+    """
+    contados = tabela.skus_distintos()
+    mascara = np.zeros(len(indice_produtos.df), dtype=bool)
+    if contados:
+        posicoes = indice_produtos.posicoes(contados)
+        mascara[posicoes[posicoes >= 0]] = True
+    return mascara
+
+
+def resumo_progresso(tabela, indice_produtos):
+    """Cobertura da ficha: ruas/posições do mapa e SKUs do catálogo já contados."""
+    locais = tabela.locais.resumo_por_barracao()
+    contados = skus_contados(tabela, indice_produtos)
+    return {
+        'registros': tabela.total,
+        'ruas': int(locais['Ruas'].sum()),
+        'ruas_contadas': int(locais['Ruas contadas'].sum()),
+        'posicoes': int(locais['Posições'].sum()),
+        'posicoes_contadas': int(locais['Posições contadas'].sum()),
+        'fora_do_mapa': tabela.locais.fora_do_mapa,
+        'skus_catalogo': len(contados),
+        'skus_contados': int(contados.sum()),
+        'skus_restantes': int((~contados).sum()),
+    }
+
+
+def skus_restantes(tabela, indice_produtos):
+    """Itens do catálogo ainda sem nenhuma contagem na ficha."""
+    df = indice_produtos.df
+    colunas = [coluna for coluna in COLUNAS_SKUS_RESTANTES if coluna in df.columns]
+    return df.loc[~skus_contados(tabela, indice_produtos), colunas].reset_index(drop=True)
+
+
+def grade_locais(progresso):
+    """Barracão x Rua com o número de registros de cada rua (vazio = ainda não contada)."""
+    grade = progresso.pivot(index='Barracão', columns='Rua', values='Registros')
+    grade = grade.reindex(index=pd.unique(progresso['Barracão']), columns=pd.unique(progresso['Rua']))
+    return grade.where(grade > 0).astype('Int64')
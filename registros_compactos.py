@@ -0,0 +1,225 @@
+import threading
+from array import array
+from functools import lru_cache
+
+CAMPOS_REGISTRO = ["Hora", "SKU", "Descrição", "Barracão", "Rua Inicial", "Rua Final", "Pallets", "Caixas Soltas"]
+
+_TEXTOS = ("SKU", "Descrição", "Barracão", "Rua Inicial", "Rua Final")
+_INTEIROS = ("Pallets", "Caixas Soltas")
+_CHAVES = frozenset(CAMPOS_REGISTRO)
+_LIMITE_INT32 = 2 ** 31
+
+
+class Internador:
+    """Tabela valor <-> código inteiro, compartilhada por todo o processo.
+
+    SKUs, descrições e locais se repetem em milhares de registros; cada valor
+    distinto é guardado uma única vez e os registros guardam só o código.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codigos = {}
+        self.valores = []
+
+    def codigos(self, valores):
+        get = self._codigos.get
+        codigos = [get(valor, -1) for valor in valores]
+        if -1 in codigos:
+            codigos = [codigo if codigo >= 0 else self.codigo(valor) for codigo, valor in zip(codigos, valores)]
+        return codigos
+
+    def codigo(self, valor):
+        codigo = self._codigos.get(valor)
+        if codigo is None:
+            with self._lock:
+                codigo = self._codigos.get(valor)
+                if codigo is None:
+                    codigo = len(self.valores)
+                    self.valores.append(valor)
+                    self._codigos[valor] = codigo
+        return codigo
+
+
+TEXTOS = Internador()
+
+
+@lru_cache(maxsize=None)
+def _segundos(hora):
+    """"HH:MM:SS" em segundos desde a meia-noite, ou None se não estiver nesse formato."""
+    if type(hora) is str and len(hora) == 8 and hora[2] == hora[5] == ':':
+        digitos = hora[:2] + hora[3:5] + hora[6:]
+        if digitos.isascii() and digitos.isdigit():
+            horas, minutos, segundos = int(hora[:2]), int(hora[3:5]), int(hora[6:])
+            if horas < 24 and minutos < 60 and segundos < 60:
+                return horas * 3600 + minutos * 60 + segundos
+    return None
+
+
+def _codigo_hora(hora):
+    segundos = _segundos(hora) if type(hora) is str else None
+    return segundos if segundos is not None else -TEXTOS.codigo(hora) - 1
+
+
+@lru_cache(maxsize=None)
+def _hora(valor):
+    if valor >= 0:
+        return f"{valor // 3600:02}:{valor // 60 % 60:02}:{valor % 60:02}"
+    return TEXTOS.valores[-valor - 1]
+
+
+class RegistrosCompactos:
+    """Lista de registros de contagem guardada em colunas de inteiros.
+
+    Por registro ficam 32 bytes: a hora em segundos, SKU/descrição/local como
+    códigos do `TEXTOS` e pallets/caixas como int32. O que não cabe nesse
+    formato (hora fora de "HH:MM:SS", quantidades não inteiras ou ausentes,
+    chaves ausentes ou extras) é guardado à parte e devolvido igual, de modo
+    que ler e regravar uma ficha preserva todos os valores.
+
+    Comporta-se como uma lista de dicts (`len`, iteração, índice,
+    `append`/`extend`); fatias contínuas são outro `RegistrosCompactos` e
+    `colunas(inicio, fim)` devolve as colunas direto, sem montar os dicts.
+    """
+
+    def __init__(self, registros=()):
+        self._hora = array('i')
+        self._textos = {coluna: array('I') for coluna in _TEXTOS}
+        self._inteiros = {coluna: array('i') for coluna in _INTEIROS}
+        self._excecoes = {coluna: {} for coluna in _INTEIROS}
+        self._extras = {}
+        self.extend(registros)
+
+    def __len__(self):
+        return len(self._hora)
+
+    def append(self, registro):
+        self.extend([registro])
+
+    def extend(self, registros):
+        if isinstance(registros, RegistrosCompactos):
+            self._estender_compactos(registros)
+            return
+        registros = registros if isinstance(registros, list) else list(registros)
+        inicio = len(self._hora)
+        self.estender_colunas({coluna: [registro.get(coluna) for registro in registros] for coluna in CAMPOS_REGISTRO})
+        for posicao, registro in enumerate(registros, inicio):
+            if registro.keys() != _CHAVES:
+                self._extras[posicao] = {
+                    "ausentes": [coluna for coluna in CAMPOS_REGISTRO if coluna not in registro],
+                    "extras": {chave: valor for chave, valor in registro.items() if chave not in CAMPOS_REGISTRO},
+                }
+
+    def estender_colunas(self, colunas):
+        """Anexa registros dados como colunas alinhadas (listas ou arrays), uma por campo."""
+        inicio = len(self._hora)
+        self._hora.extend([_codigo_hora(hora) for hora in colunas["Hora"]])
+        for coluna, codigos in self._textos.items():
+            codigos.extend(TEXTOS.codigos(colunas[coluna]))
+        for coluna, numeros in self._inteiros.items():
+            valores = colunas[coluna]
+            valores = valores.tolist() if hasattr(valores, 'tolist') else valores
+            if set(map(type, valores)) <= {int}:
+                try:
+                    novos = array('i', valores)
+                except OverflowError:
+                    novos = None
+                if novos is not None and -_LIMITE_INT32 not in novos:
+                    numeros.extend(novos)
+                    continue
+            for posicao, valor in enumerate(valores, inicio):
+                if type(valor) is int and -_LIMITE_INT32 < valor < _LIMITE_INT32:
+                    numeros.append(valor)
+                else:
+                    numeros.append(-_LIMITE_INT32)
+                    self._excecoes[coluna][posicao] = valor
+
+    def _estender_compactos(self, outros):
+        # Mesmos códigos (o `TEXTOS` é um só): basta copiar as colunas.
+        inicio = len(self._hora)
+        self._hora.extend(outros._hora)
+        for coluna, codigos in self._textos.items():
+            codigos.extend(outros._textos[coluna])
+        for coluna, numeros in self._inteiros.items():
+            numeros.extend(outros._inteiros[coluna])
+            for posicao, valor in outros._excecoes[coluna].items():
+                self._excecoes[coluna][inicio + posicao] = valor
+        for posicao, extra in outros._extras.items():
+            self._extras[inicio + posicao] = extra
+
+    def _fatia(self, inicio, fim):
+        fatia = RegistrosCompactos()
+        fatia._hora = self._hora[inicio:fim]
+        fatia._textos = {coluna: codigos[inicio:fim] for coluna, codigos in self._textos.items()}
+        fatia._inteiros = {coluna: numeros[inicio:fim] for coluna, numeros in self._inteiros.items()}
+        fatia._excecoes = {
+            coluna: {posicao - inicio: valor for posicao, valor in excecoes.items() if inicio <= posicao < fim}
+            for coluna, excecoes in self._excecoes.items()
+        }
+        fatia._extras = {posicao - inicio: extra for posicao, extra in self._extras.items() if inicio <= posicao < fim}
+        return fatia
+
+    def colunas(self, inicio=0, fim=None, campos=CAMPOS_REGISTRO):
+        """Colunas `campos` dos registros [inicio, fim), em ordem de gravação."""
+        inicio, fim, _ = slice(inicio, fim).indices(len(self))
+        valores = TEXTOS.valores
+        colunas = {}
+        for coluna in campos:
+            if coluna == "Hora":
+                colunas[coluna] = [_hora(valor) for valor in self._hora[inicio:fim]]
+            elif coluna in self._textos:
+                colunas[coluna] = [valores[codigo] for codigo in self._textos[coluna][inicio:fim]]
+            else:
+                colunas[coluna] = self._inteiros[coluna][inicio:fim].tolist()
+                for posicao, valor in self._excecoes[coluna].items():
+                    if inicio <= posicao < fim:
+                        colunas[coluna][posicao - inicio] = valor
+        return colunas
+
+    def selecionar(self, posicoes, campos=CAMPOS_REGISTRO):
+        """Colunas `campos` dos registros nas `posicoes` dadas, nessa ordem."""
+        posicoes = [int(posicao) for posicao in posicoes]
+        valores = TEXTOS.valores
+        colunas = {}
+        for coluna in campos:
+            if coluna == "Hora":
+                horas = self._hora
+                colunas[coluna] = [_hora(horas[posicao]) for posicao in posicoes]
+            elif coluna in self._textos:
+                codigos = self._textos[coluna]
+                colunas[coluna] = [valores[codigos[posicao]] for posicao in posicoes]
+            else:
+                numeros, excecoes = self._inteiros[coluna], self._excecoes[coluna]
+                colunas[coluna] = [excecoes[posicao] if posicao in excecoes else numeros[posicao] for posicao in posicoes]
+        return colunas
+
+    def _registros(self, inicio, fim):
+        colunas = self.colunas(inicio, fim)
+        registros = [dict(zip(CAMPOS_REGISTRO, linha)) for linha in zip(*colunas.values())]
+        for posicao, extra in self._extras.items():
+            if inicio <= posicao < fim:
+                registro = registros[posicao - inicio]
+                for coluna in extra["ausentes"]:
+                    del registro[coluna]
+                registro.update(extra["extras"])
+        return registros
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            inicio, fim, passo = indice.indices(len(self))
+            if passo == 1:
+                return self._fatia(inicio, max(inicio, fim))
+            return self._registros(0, len(self))[indice]
+        if indice < 0:
+            indice += len(self)
+        if not 0 <= indice < len(self):
+            raise IndexError(indice)
+        return self._registros(indice, indice + 1)[0]
+
+    def __iter__(self):
+        # Em blocos, para não materializar a ficha inteira como dicts.
+        for inicio in range(0, len(self), 10_000):
+            yield from self._registros(inicio, min(len(self), inicio + 10_000))
+
+    def __eq__(self, outro):
+        return list(self) == list(outro)
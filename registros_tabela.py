@@ -0,0 +1,117 @@
+import threading
+
+import pandas as pd
+
+from agregado_sku import AgregadoSKU
+from locais_armazem import CoberturaLocais
+from registros_compactos import RegistrosCompactos, CAMPOS_REGISTRO
+
+COLUNAS_TABELA = CAMPOS_REGISTRO
+CAMPOS_AGREGADO = ('SKU', 'Descrição', 'Barracão', 'Pallets', 'Caixas Soltas')
+CAMPOS_AGREGADO_LOCAIS = CAMPOS_AGREGADO + ('Rua Inicial', 'Rua Final')
+
+
+class TabelaRegistros:
+    """Registros de uma ficha em colunas, mantidos incrementalmente.
+
+    A cada rerun só os registros gravados desde a última sincronização são
+    anexados (em `RegistrosCompactos`); a tabela exibida é montada apenas
+    para a página visível. Com um `mapa` do armazém, mantém também a
+    cobertura por local (`locais`).
+    """
+
+    def __init__(self, mapa=None):
+        self._lock = threading.RLock()
+        self.colunas = COLUNAS_TABELA
+        self.registros = RegistrosCompactos()
+        self.total = 0
+        self.geracao = None
+        self.cursor = None
+        self._memo = {}
+        self.agregado = AgregadoSKU()
+        self.mapa = mapa
+        self.locais = CoberturaLocais(mapa) if mapa is not None else None
+
+    def _anexar(self, registros):
+        self.registros.extend(registros)
+        campos = CAMPOS_AGREGADO if self.locais is None else CAMPOS_AGREGADO_LOCAIS
+        colunas = self.registros.colunas(self.total, campos=campos)
+        self.agregado.anexar_colunas(colunas)
+        if self.locais is not None:
+            self.locais.anexar_colunas(colunas)
+        self.total = len(self.registros)
+
+    def sincronizar(self, storage, nome_ficha):
+        with self._lock:
+            geracao = storage.geracao(nome_ficha)
+            if geracao != self.geracao:
+                # Os registros foram regravados (ex.: ficha arquivada e restaurada): recomeça.
+                self.registros = RegistrosCompactos()
+                self.total = 0
+                self._memo.clear()
+                self.agregado = AgregadoSKU()
+                self.locais = CoberturaLocais(self.mapa) if self.mapa is not None else None
+                self.geracao = geracao
+                self.cursor = None
+            novos, self.cursor = storage.registros_apos(nome_ficha, self.cursor)
+            if novos:
+                self._anexar(novos)
+        return self
+
+    def paginas(self, tamanho):
+        return max(1, -(-self.total // tamanho))
+
+    def fatia(self, inicio, fim, campos=COLUNAS_TABELA):
+        """Colunas `campos` dos registros [inicio, fim), do mais novo para o mais antigo."""
+        with self._lock:
+            return {coluna: valores[::-1] for coluna, valores in self.registros.colunas(inicio, fim, campos).items()}
+
+    def blocos(self, tamanho, total=None):
+        """Percorre os primeiros `total` registros em fatias, do mais novo ao mais antigo."""
+        fim = self.total if total is None else total
+        while fim > 0:
+            inicio = max(0, fim - tamanho)
+            yield self.fatia(inicio, fim)
+            fim = inicio
+
+    def pagina(self, numero, tamanho):
+        """Página `numero` (1 = mais recentes) em ordem do mais novo para o mais antigo."""
+        with self._lock:
+            fim = max(0, self.total - (numero - 1) * tamanho)
+            inicio = max(0, fim - tamanho)
+            return pd.DataFrame(self.fatia(inicio, fim))
+
+    def dataframe(self):
+        """Todos os registros, do mais novo para o mais antigo."""
+        return self.pagina(1, self.total or 1)
+
+    def resumo_por_sku(self, fatores):
+        with self._lock:
+            return self.agregado.resumo(fatores)
+
+    def skus_distintos(self):
+        with self._lock:
+            return list(self.agregado.por_sku)
+
+    def registros_na_faixa(self, barracao, rua_inicial, rua_final=None):
+        """Registros (do mais novo ao mais antigo) que cobrem alguma rua da faixa."""
+        with self._lock:
+            posicoes = self.locais.registros_na_faixa(barracao, rua_inicial, rua_final)[::-1]
+            return pd.DataFrame(self.registros.selecionar(posicoes, self.colunas))
+
+    def memorizar(self, chave, gerar, versao=None):
+        """Resultado de `gerar(tabela, total)`, reaproveitado enquanto a ficha não mudar.
+
+        `versao` identifica o que mais entra no resultado (ex.: o catálogo).
+        Cada `chave` guarda um único resultado, substituído quando o total ou
+        a versão mudam.
+        """
+        with self._lock:
+            carimbo = (self.total, versao)
+            em_cache = self._memo.get(chave)
+        if em_cache is not None and em_cache[0] == carimbo:
+            return em_cache[1]
+        resultado = gerar(self, carimbo[0])
+        with self._lock:
+            self._memo[chave] = (carimbo, resultado)
+        return resultado
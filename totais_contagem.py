@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+COLUNA_TOTAL_CAIXAS = "Total Caixas"
+COLUNA_TOTAL_UNIDADES = "Total Unidades"
+
+
+def fatores_conversao(df_produtos):
+    """Fatores do catálogo indexados pelo SKU (caixas/pallet e unidades/caixa)."""
+    if df_produtos.empty or 'codigo' not in df_produtos.columns:
+        return pd.DataFrame(columns=['qtd_por_pallet', 'qtd_por_caixa'], index=pd.Index([], dtype=str))
+    fatores = df_produtos[['codigo', 'qtd_por_pallet', 'qtd_por_caixa']].copy()
+    fatores['codigo'] = fatores['codigo'].astype(str)
+    fatores = fatores.drop_duplicates('codigo').set_index('codigo').astype('float64')
+    fatores.index = fatores.index.astype(object)
+    return fatores
+
+
+def numeros(valores):
+    """Converte uma coluna para float64, com 0 para valores ausentes ou inválidos."""
+    valores = np.asarray(valores)
+    if valores.dtype.kind not in 'iuf':
+        try:
+            valores = valores.astype('float64')
+        except (TypeError, ValueError):
+            valores = pd.to_numeric(pd.Series(valores, dtype=object), errors='coerce').to_numpy(dtype='float64')
+    return np.nan_to_num(valores.astype('float64'), nan=0.0)
+
+
+def como_texto(valores):
+    """Array de objetos str (sem converter quando a coluna já é toda texto)."""
+    valores = np.asarray(valores, dtype=object)
+    if pd.api.types.infer_dtype(valores, skipna=False) != 'string':
+        valores = valores.astype(str).astype(object)
+    return valores
+
+
+def calcular_totais(skus, pallets, caixas, fatores):
+    """Total de caixas e de unidades por registro, sem laço em Python.
+
+    total_caixas = pallets * qtd_por_pallet + caixas soltas
+    total_unidades = total_caixas * qtd_por_caixa
+
+    SKUs fora do catálogo ficam com NaN.
+    """
+    posicoes = fatores.index.get_indexer(pd.Index(como_texto(skus), dtype=object))
+    encontrado = posicoes >= 0
+
+    por_pallet = np.full(len(posicoes), np.nan)
+    por_caixa = np.full(len(posicoes), np.nan)
+    por_pallet[encontrado] = fatores['qtd_por_pallet'].to_numpy()[posicoes[encontrado]]
+    por_caixa[encontrado] = fatores['qtd_por_caixa'].to_numpy()[posicoes[encontrado]]
+
+    pallets = numeros(pallets)
+    caixas = numeros(caixas)
+
+    total_caixas = pallets * por_pallet + caixas
+    total_unidades = total_caixas * por_caixa
+    return total_caixas, total_unidades
+
+
+def adicionar_totais(colunas, fatores):
+    """Acrescenta as colunas de totais a um dicionário de colunas de registros."""
+    total_caixas, total_unidades = calcular_totais(colunas['SKU'], colunas['Pallets'], colunas['Caixas Soltas'], fatores)
+    colunas = dict(colunas)
+    colunas[COLUNA_TOTAL_CAIXAS] = pd.array(np.round(total_caixas), dtype='Int64')
+    colunas[COLUNA_TOTAL_UNIDADES] = pd.array(np.round(total_unidades), dtype='Int64')
+    return colunas
+
+
+def resumo_totais(tabela, total, fatores):
+    """Totais da ficha inteira (os `total` primeiros registros da tabela)."""
+    colunas = tabela.fatia(0, total, ('SKU', 'Pallets', 'Caixas Soltas'))
+    total_caixas, total_unidades = calcular_totais(colunas['SKU'], colunas['Pallets'], colunas['Caixas Soltas'], fatores)
+    return {
+        'registros': total,
+        'pallets': int(numeros(colunas['Pallets']).sum()),
+        'caixas': int(np.nansum(total_caixas)),
+        'unidades': int(np.nansum(total_unidades)),
+        'sem_catalogo': int(np.isnan(total_unidades).sum()),
+    }